@@ -145,6 +145,9 @@ class DriveUsageBox(wx.Panel):
     def SetOthersUsageColor(self, color):
         self.othersPanelColor = color
 
+    def SetDriveSize(self, drive_size_bytes):
+        self.drive_size_bytes = drive_size_bytes
+
     def SetAudioUsage(self, size):
         self.audioPanelWidth = float((float(size) * 100)/self.drive_size_bytes)
         self.legendAudioText.SetLabel('Audio ' + self.FileSizeHumanize(size))
@@ -17,20 +17,29 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import sys, os, wx, GoSyncController, GoSyncModel
+import sys, os
 from os.path import expanduser, dirname, relpath
-from GoSyncController import GoSyncController
 from defines import *
 
 # Add the current path to gosync path.
 sys.path.insert(0, APP_PATH)
 
 def main():
+    # The daemon runs the sync engine alone. wx and the GUI modules are
+    # only imported for the desktop application.
+    if '--daemon' in sys.argv[1:]:
+        from GoSyncDaemon import RunDaemon
+        sys.exit(RunDaemon())
+
+    import wx
+    from GoSyncController import GoSyncController
+
     os.chdir(APP_PATH)
     app = wx.PySimpleApp()
     controller = GoSyncController()
     controller.Center()
     controller.Show()
+    controller.sync_model.StartupMark('window')
     app.MainLoop()
 
 if __name__ == "__main__":
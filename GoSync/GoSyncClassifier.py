@@ -0,0 +1,104 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, json
+
+CATEGORIES = ['Audio', 'Movies', 'Photo', 'Document', 'Others']
+
+# Rules of every category. An entry is either a MIME type, a major type
+# ("audio/*") or a file extension (".mp3"). The "Usage Categories" key of
+# gosyncrc takes the same form and replaces the rules of the categories
+# it names, e.g. {"Document": ["application/pdf", "text/*", ".md"]}.
+DEFAULT_RULES = {
+    'Audio': ['audio/*', '.mp3', '.flac', '.ogg', '.oga', '.wav', '.m4a', '.aac',
+              '.aif', '.aiff', '.wma', '.opus'],
+    'Movies': ['video/*', '.mp4', '.m4v', '.mkv', '.avi', '.mov', '.webm', '.flv',
+               '.mpg', '.mpeg', '.wmv', '.3gp'],
+    'Photo': ['image/*', '.jpg', '.jpeg', '.png', '.gif', '.tif', '.tiff', '.bmp',
+              '.webp', '.heic', '.svg', '.raw', '.cr2', '.nef'],
+    'Document': ['application/pdf', 'application/x-dvi', 'application/postscript',
+                 'application/rtf', 'application/msword', 'application/powerpoint',
+                 'application/mspowerpoint', 'application/x-mspowerpoint',
+                 'application/vnd.ms-powerpoint', 'application/vnd.ms-excel',
+                 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+                 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                 'application/vnd.oasis.opendocument.text',
+                 'application/vnd.oasis.opendocument.spreadsheet',
+                 'application/vnd.oasis.opendocument.presentation',
+                 'text/plain', 'text/csv', 'text/rtf',
+                 '.pdf', '.dvi', '.ps', '.rtf', '.doc', '.docx', '.ppt', '.pptx', '.xls',
+                 '.xlsx', '.odt', '.ods', '.odp', '.txt', '.csv', '.md', '.tex', '.epub'],
+}
+
+# Google documents and folders take no quota and aren't counted.
+UNCOUNTED_PREFIX = 'application/vnd.google-apps.'
+
+# Files with one of these types are classified by extension alone.
+GENERIC_MIME_TYPES = ['', 'application/octet-stream', 'binary/octet-stream',
+                      'application/unknown', 'application/x-unknown',
+                      'application/download', 'application/x-download']
+
+# Maps a file to its usage category with at most three dict lookups: its
+# exact MIME type, then its major type, then its extension. What matches
+# none of them is "Others".
+class MimeClassifier(object):
+    def __init__(self, config=None):
+        rules = dict(DEFAULT_RULES)
+        if config:
+            rules.update(config)
+
+        self.mime_types = {}
+        self.major_types = {}
+        self.extensions = {}
+        for category, entries in rules.iteritems():
+            for entry in entries:
+                entry = entry.lower()
+                if entry.startswith('.'):
+                    self.extensions[entry] = category
+                elif entry.endswith('/*'):
+                    self.major_types[entry[:-2]] = category
+                else:
+                    self.mime_types[entry] = category
+
+        self.generic = frozenset(GENERIC_MIME_TYPES)
+        # Changes whenever the rules do, so that whatever was classified
+        # with other rules can be classified again.
+        self.signature = json.dumps(sorted((c, sorted(e)) for c, e in rules.iteritems()))
+
+    def Classify(self, mimeType, title):
+        """
+        Return the category of a file, or None if it isn't counted.
+        """
+        mimeType = (mimeType or '').lower()
+        if mimeType.startswith(UNCOUNTED_PREFIX):
+            return None
+
+        if mimeType not in self.generic:
+            category = self.mime_types.get(mimeType, None)
+            if category is not None:
+                return category
+
+            category = self.major_types.get(mimeType.split('/', 1)[0], None)
+            if category is not None:
+                return category
+
+        return self.extensions.get(os.path.splitext(title or '')[1].lower(), 'Others')
+
+    def GetSignature(self):
+        return self.signature
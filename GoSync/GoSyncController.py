@@ -18,7 +18,7 @@
 
 import wx, os, time
 import sys, os, wx, ntpath, defines, threading, math, webbrowser
-from GoSyncModel import GoSyncModel, ClientSecretsNotFound
+from GoSyncModel import GoSyncModel, ClientSecretsNotFound, AuthenticationFailed
 from defines import *
 from threading import Timer
 from DriveUsageBox import DriveUsageBox
@@ -40,12 +40,8 @@ class PageAccount(wx.Panel):
         aboutdrive = sync_model.DriveInfo()
         self.driveUsageBar = DriveUsageBox(self, long(aboutdrive['quotaBytesTotal']), -1)
         self.driveUsageBar.SetStatusMessage("Calculating your categorical Google Drive usage. Please wait.")
-        self.driveUsageBar.SetMoviesUsage(0)
-        self.driveUsageBar.SetDocumentUsage(0)
-        self.driveUsageBar.SetOthersUsage(0)
-        self.driveUsageBar.SetAudioUsage(0)
-        self.driveUsageBar.SetPhotoUsage(0)
-        self.driveUsageBar.RePaint()
+        # The usage saved last time, until it has been brought up to date.
+        self.ShowDriveUsage()
 
 
         mainsizer = wx.BoxSizer(wx.VERTICAL)
@@ -58,22 +54,34 @@ class PageAccount(wx.Panel):
                                           self.OnUsageCalculationDone)
         GoSyncEventController().BindEvent(self, GOSYNC_EVENT_CALCULATE_USAGE_UPDATE,
                                           self.OnUsageCalculationUpdate)
+        GoSyncEventController().BindEvent(self, GOSYNC_EVENT_ACCOUNT_UPDATE,
+                                          self.OnAccountUpdate)
+
+    def ShowDriveUsage(self):
+        self.driveUsageBar.SetMoviesUsage(self.sync_model.GetMovieUsage())
+        self.driveUsageBar.SetDocumentUsage(self.sync_model.GetDocumentUsage())
+        self.driveUsageBar.SetOthersUsage(self.sync_model.GetOthersUsage())
+        self.driveUsageBar.SetAudioUsage(self.sync_model.GetAudioUsage())
+        self.driveUsageBar.SetPhotoUsage(self.sync_model.GetPhotoUsage())
+        self.driveUsageBar.RePaint()
+
+    def OnAccountUpdate(self, event):
+        self.driveUsageBar.SetDriveSize(long(event.data['quotaBytesTotal']))
+        self.ShowDriveUsage()
 
     def OnUsageCalculationDone(self, event):
         if not event.data:
             self.driveUsageBar.SetStatusMessage("Your Google Drive usage is shown below:")
-            self.driveUsageBar.SetMoviesUsage(self.sync_model.GetMovieUsage())
-            self.driveUsageBar.SetDocumentUsage(self.sync_model.GetDocumentUsage())
-            self.driveUsageBar.SetOthersUsage(self.sync_model.GetOthersUsage())
-            self.driveUsageBar.SetAudioUsage(self.sync_model.GetAudioUsage())
-            self.driveUsageBar.SetPhotoUsage(self.sync_model.GetPhotoUsage())
-            self.driveUsageBar.RePaint()
+            self.ShowDriveUsage()
         else:
             self.driveUsageBar.SetStatusMessage("Sorry, could not calculate your Google Drive usage.")
 
     def OnUsageCalculationUpdate(self, event):
-        percent = (event.data * 100)/self.totalFiles
-        self.driveUsageBar.SetStatusMessage("Calculating your categorical usage... (%d%%)\n" % percent)
+        if self.totalFiles:
+            percent = min(99, (event.data * 100)/self.totalFiles)
+            self.driveUsageBar.SetStatusMessage("Calculating your categorical usage... (%d%%)\n" % percent)
+        else:
+            self.driveUsageBar.SetStatusMessage("Calculating your categorical usage... (%d files)\n" % event.data)
 
     def OnUsageCalculationStarted(self, event):
         self.totalFiles = event.data
@@ -93,6 +101,11 @@ class GoSyncController(wx.Frame):
             if res == wx.ID_YES:
                 webbrowser.open(CLIENT_SECRET_HELP_SITE, new=1, autoraise=True)
 
+            sys.exit(1)
+        except AuthenticationFailed:
+            dial = wx.MessageDialog(None, "Authentication Rejected!\n",
+                                    'Information', wx.OK | wx.ICON_EXCLAMATION)
+            res = dial.ShowModal()
             sys.exit(1)
         except:
             dial = wx.MessageDialog(None, 'GoSync failed to initialize\n',
@@ -101,11 +114,7 @@ class GoSyncController(wx.Frame):
             sys.exit(1)
 
         self.aboutdrive = self.sync_model.DriveInfo()
-
-        title_string = "GoSync --%s (%s used of %s)" % (self.aboutdrive['name'],
-                                                        self.FileSizeHumanize(long(self.aboutdrive['quotaBytesUsed'])),
-                                                        self.FileSizeHumanize(long(self.aboutdrive['quotaBytesTotal'])))
-        self.SetTitle(title_string)
+        self.ShowTitle()
         appIcon = wx.Icon(APP_ICON, wx.BITMAP_TYPE_PNG)
         self.SetIcon(appIcon)
         menuBar = wx.MenuBar()
@@ -114,6 +123,8 @@ class GoSyncController(wx.Frame):
         menu_txt = 'Pause/Resume Sync'
 
         self.CreateMenuItem(menu, menu_txt, self.OnToggleSync, icon=os.path.join(HERE, 'resources/sync-menu.png'), id=ID_SYNC_TOGGLE)
+        self.CreateMenuItem(menu, 'Sync &Now', self.OnSyncNow)
+        self.CreateMenuItem(menu, 'Recalculate &Usage', self.OnRecalculateUsage)
 
         menu.AppendSeparator()
         self.CreateMenuItem(menu, 'A&bout', self.OnAbout, os.path.join(HERE, 'resources/info.png'))
@@ -159,6 +170,10 @@ class GoSyncController(wx.Frame):
                                           self.OnSyncTimer)
         GoSyncEventController().BindEvent(self, GOSYNC_EVENT_SYNC_INV_FOLDER,
                                           self.OnSyncInvalidFolder)
+        GoSyncEventController().BindEvent(self, GOSYNC_EVENT_ERROR,
+                                          self.OnSyncError)
+        GoSyncEventController().BindEvent(self, GOSYNC_EVENT_ACCOUNT_UPDATE,
+                                          self.OnAccountUpdate)
 
         self.sync_model.SetTheBallRolling()
 
@@ -167,6 +182,21 @@ class GoSyncController(wx.Frame):
                                 'Error', wx.OK | wx.ICON_EXCLAMATION)
         res = dial.ShowModal()
 
+    def ShowTitle(self):
+        title_string = "GoSync --%s (%s used of %s)" % (self.aboutdrive['name'],
+                                                        self.FileSizeHumanize(long(self.aboutdrive['quotaBytesUsed'])),
+                                                        self.FileSizeHumanize(long(self.aboutdrive['quotaBytesTotal'])))
+        self.SetTitle(title_string)
+
+    def OnAccountUpdate(self, event):
+        self.aboutdrive = event.data
+        self.ShowTitle()
+
+    def OnSyncError(self, event):
+        title, message = event.data
+        dial = wx.MessageDialog(None, message, title, wx.OK | wx.ICON_EXCLAMATION)
+        res = dial.ShowModal()
+
     def OnSyncTimer(self, event):
         unicode_string = event.data.pop()
         self.sb.SetStatusText(unicode_string.encode('ascii', 'ignore'))
@@ -224,6 +254,12 @@ class GoSyncController(wx.Frame):
             self.sync_model.StartSync()
             self.sb.SetStatusText("Running", 1)
 
+    def OnSyncNow(self, evt):
+        self.sync_model.SyncNow()
+
+    def OnRecalculateUsage(self, evt):
+        self.sync_model.RecalculateUsage()
+
     def OnAbout(self, evt):
         """About GoSync"""
         about = wx.AboutDialogInfo()
@@ -0,0 +1,126 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, sys, json, time, signal, logging, threading
+from defines import *
+from GoSyncEvents import *
+from GoSyncModel import GoSyncModel, ClientSecretsNotFound, AuthenticationFailed
+
+# Runs the sync engine with no GUI. Errors go to the log (also on
+# stderr) and the state of the engine is written as JSON to
+# ~/.gosync/status.json whenever it changes. SIGUSR1 starts a sync pass
+# right away, SIGUSR2 counts the usage again from scratch, SIGTERM and
+# SIGINT stop the daemon.
+class GoSyncDaemon(object):
+    def __init__(self, sync_model):
+        self.sync_model = sync_model
+        self.status_file = os.path.join(sync_model.config_path, 'status.json')
+        self.status_lock = threading.Lock()
+        self.logger = logging.getLogger(APP_NAME)
+        self.state = 'Starting'
+
+        GoSyncEventController().AddListener(GOSYNC_EVENT_SYNC_STARTED, self.OnSyncStarted)
+        GoSyncEventController().AddListener(GOSYNC_EVENT_SYNC_DONE, self.OnSyncDone)
+        GoSyncEventController().AddListener(GOSYNC_EVENT_SYNC_TIMER, self.OnSyncTimer)
+        GoSyncEventController().AddListener(GOSYNC_EVENT_SYNC_INV_FOLDER, self.OnSyncInvalidFolder)
+        GoSyncEventController().AddListener(GOSYNC_EVENT_ERROR, self.OnSyncError)
+        GoSyncEventController().AddListener(GOSYNC_EVENT_ACCOUNT_UPDATE, self.OnAccountUpdate)
+
+    def WriteStatus(self):
+        with self.status_lock:
+            status = self.sync_model.GetStatus()
+            status['state'] = self.state
+            status['pid'] = os.getpid()
+            status['updated'] = time.time()
+
+            # Readers never see a half written file.
+            tmp_file = self.status_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(status, f, indent=1)
+            os.rename(tmp_file, self.status_file)
+
+    def OnSyncStarted(self, event):
+        self.state = 'Syncing'
+        self.WriteStatus()
+
+    def OnSyncDone(self, event):
+        if not event.data:
+            self.state = 'Idle'
+        else:
+            self.state = 'Sync failed'
+        self.WriteStatus()
+
+    def OnSyncTimer(self, event):
+        self.WriteStatus()
+
+    def OnSyncInvalidFolder(self, event):
+        self.state = 'Paused'
+        self.WriteStatus()
+
+    def OnAccountUpdate(self, event):
+        self.state = 'Connected'
+        self.WriteStatus()
+
+    def OnSyncError(self, event):
+        self.WriteStatus()
+
+    def Run(self):
+        stop = []
+
+        def OnStop(signum, frame):
+            stop.append(signum)
+
+        signal.signal(signal.SIGTERM, OnStop)
+        signal.signal(signal.SIGINT, OnStop)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self.sync_model.SyncNow())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self.sync_model.RecalculateUsage())
+
+        self.sync_model.SetTheBallRolling()
+        self.sync_model.StartSync()
+        self.sync_model.StartupMark('daemon')
+        self.WriteStatus()
+
+        while not stop:
+            signal.pause()
+
+        self.logger.info("Daemon: stopping on signal %d\n" % stop[0])
+        self.sync_model.StopSync()
+        self.state = 'Stopped'
+        self.WriteStatus()
+        return 0
+
+def RunDaemon():
+    logger = logging.getLogger(APP_NAME)
+    sh = logging.StreamHandler(sys.stderr)
+    sh.setLevel(logging.INFO)
+    sh.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    logger.addHandler(sh)
+
+    try:
+        sync_model = GoSyncModel(headless=True)
+    except ClientSecretsNotFound:
+        logger.error("Client secret file was not found. See %s on how to create one.\n"
+                     % CLIENT_SECRET_HELP_SITE)
+        return 1
+    except AuthenticationFailed:
+        return 1
+    except:
+        logger.exception("GoSync failed to initialize\n")
+        return 1
+
+    return GoSyncDaemon(sync_model).Run()
@@ -18,22 +18,23 @@
 
 import os
 
+class TreeFrozen(RuntimeError):
+    pass
+
+# A folder of the drive. Only what the tree needs is kept, not the
+# metadata of the folder. The path is worked out when first asked for.
 class DriveFolder(object):
-    def __init__(self, parent, id, name, data=None):
+    __slots__ = ['id', 'name', 'parent', 'children', 'path']
+
+    def __init__(self, parent, id, name):
         self.children = []
         self.id = id
         self.parent = parent
-        self.data = data
         self.name = name
-
-    def SetData(self, data):
-        self.data = data
-
-    def GetData(self):
-        return self.data
+        self.path = None
 
     def GetParent(self):
-        return parent
+        return self.parent
 
     def GetId(self):
         return self.id
@@ -51,55 +52,82 @@ class DriveFolder(object):
         return self.children
 
     def GetPath(self):
-        cpath =''
-        if self.parent is not None:
-            cpath = self.parent.GetPath()
+        if self.path is None:
+            if self.parent is None:
+                self.path = ''
+            else:
+                self.path = os.path.join(self.parent.GetPath(), self.name)
 
-        if self.parent is None:
-            path = os.path.join(cpath, '')
-        else:
-            path = os.path.join(cpath, self.GetName())
-
-        return path
+        return self.path
 
 
+# Folders of the drive indexed by id, so finding or adding one doesn't
+# search the tree. The index by path is built when first needed and
+# dropped whenever the tree changes.
+#
+# Once frozen, a tree is a snapshot: it can no longer be changed, so it
+# can be handed to any number of readers without copying or locking.
+# Changes go into a new tree, which gets a higher generation when it is
+# frozen in turn.
 class GoogleDriveTree(object):
     def __init__(self):
-        self.root_node = DriveFolder(None, 'root', 'Google Drive Root', None)
+        self.root_node = DriveFolder(None, 'root', 'Google Drive Root')
+        self.nodes = {'root': self.root_node}
+        self.paths = None
+        self.generation = None
+
+    def Freeze(self, generation):
+        """
+        Make the tree read-only. Paths are all worked out now, so
+        readers never write to the nodes either.
+        """
+        self.FindFolderByPath('')
+        self.generation = generation
+
+    def IsFrozen(self):
+        return self.generation is not None
+
+    def GetGeneration(self):
+        return self.generation
+
+    def CheckWritable(self):
+        if self.generation is not None:
+            raise TreeFrozen()
 
     def GetRoot(self):
         return self.root_node
 
-    def FindFolderInParent(self, parent, id):
-        for f in parent.GetChildren():
-            if f.GetId() == id:
-                return f
-            
-            ret = self.FindFolderInParent(f, id)
-            if ret:
-                return ret
-
-        return None
+    def __len__(self):
+        return len(self.nodes) - 1
 
     def FindFolder(self, id):
-        if id == 'root':
-            return self.root_node
-        else:
-            return self.FindFolderInParent(self.root_node, id)
+        return self.nodes.get(id, None)
 
-    def AddFolder(self, parent, folder_id, folder_name, data):
-        if not parent:
-            return None
+    def FindFolderByPath(self, path):
+        if self.paths is None:
+            self.paths = dict((node.GetPath(), node) for node in self.nodes.itervalues())
+        return self.paths.get(path.strip(os.sep), None)
 
-        pnode = self.FindFolder(parent)
+    def AddFolder(self, parent, folder_id, folder_name):
+        self.CheckWritable()
+        pnode = self.nodes.get(parent, None)
+        if pnode is None:
+            return None
 
-        if self.FindFolder(folder_id):
-            return
+        cnode = self.nodes.get(folder_id, None)
+        if cnode is not None:
+            return cnode
 
-        cnode = DriveFolder(pnode, folder_id, folder_name, data)
+        cnode = DriveFolder(pnode, folder_id, folder_name)
         pnode.AddChild(cnode)
-
-    def DeleteFolder(self, folder_id):
-        folder = self.FindFolder(folder_id)
-        if folder:
-            folder.GetParent().DeleteChild(folder)
+        self.nodes[folder_id] = cnode
+        self.paths = None
+        return cnode
+
+    def LoadIndex(self, index):
+        """
+        Populate the tree with all the folders in the drive index. The
+        index is walked once, parents always before their children.
+        """
+        for f, fpath in index.Walk(folders_only=True):
+            self.AddFolder(f['parents'][0]['id'], f['id'], f['title'])
@@ -16,7 +16,7 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import os, wx
+import os, threading, time
 
 GOSYNC_EVENT_CALCULATE_USAGE_STARTED = '_gosync_calculate_usage_started'
 GOSYNC_EVENT_CALCULATE_USAGE_UPDATE = '_gosync_calculate_usage_update'
@@ -26,35 +26,90 @@ GOSYNC_EVENT_SYNC_UPDATE = '_gosync_sync_update'
 GOSYNC_EVENT_SYNC_DONE = '_gosync_sync_done'
 GOSYNC_EVENT_SYNC_TIMER = '_gosync_sync_timer'
 GOSYNC_EVENT_SYNC_INV_FOLDER = '_gosync_sync_invalid_folder'
+GOSYNC_EVENT_ERROR = '_gosync_error'
+GOSYNC_EVENT_ACCOUNT_UPDATE = '_gosync_account_update'
 
-GOSYNC_EVENT_ID_SYNC_STARTED = wx.NewId()
-GOSYNC_EVENT_ID_SYNC_UPDATE = wx.NewId()
-GOSYNC_EVENT_ID_SYNC_DONE = wx.NewId()
-GOSYNC_EVENT_ID_CALCULATE_USAGE_STARTED = wx.NewId()
-GOSYNC_EVENT_ID_CALCULATE_USAGE_UPDATE = wx.NewId()
-GOSYNC_EVENT_ID_CALCULATE_USAGE_DONE = wx.NewId()
-GOSYNC_EVENT_ID_SYNC_TIMER = wx.NewId()
-GOSYNC_EVENT_ID_SYNC_INV_FOLDER = wx.NewId()
+# Events that are always delivered, right away and in order.
+GOSYNC_CRITICAL_EVENTS = [GOSYNC_EVENT_SYNC_STARTED,
+                          GOSYNC_EVENT_SYNC_DONE,
+                          GOSYNC_EVENT_SYNC_INV_FOLDER,
+                          GOSYNC_EVENT_ERROR,
+                          GOSYNC_EVENT_CALCULATE_USAGE_STARTED,
+                          GOSYNC_EVENT_CALCULATE_USAGE_DONE]
 
-class GoSyncEvent(wx.PyEvent):
-    def __init__(self, event, data):
-        wx.PyEvent.__init__(self)
+# How many times per second a listener gets the other events, unless it
+# asks for another rate when binding. In between, only the latest data
+# posted is kept and delivered once the listener is due again.
+GOSYNC_DEFAULT_MAX_RATE = {GOSYNC_EVENT_SYNC_UPDATE: 5,
+                           GOSYNC_EVENT_CALCULATE_USAGE_UPDATE: 5,
+                           GOSYNC_EVENT_SYNC_TIMER: 1}
 
-        self.SetEventType(event)
+# What a callback listener is called with. It looks like the wx event a
+# window gets: the data posted is in "data".
+class GoSyncEvent(object):
+    def __init__(self, event, data):
+        self.event = event
         self.data = data
 
+def _PostWxEvent(listener, event_id, data):
+    # wx is only loaded by the GUI, never by the sync engine itself.
+    import wx
+    evt = wx.PyEvent()
+    evt.SetEventType(event_id)
+    evt.data = data
+    wx.PostEvent(listener, evt)
+
+_NO_DATA = object()
+
+# Delivery of one event to one listener, at most max_rate times a second
+# (no limit if max_rate is None). deliver(data) hands it over.
+class GoSyncEventChannel(object):
+    def __init__(self, listener, deliver, max_rate=None):
+        self.listener = listener
+        self.deliver = deliver
+        self.interval = 1.0 / max_rate if max_rate else 0
+        self.lock = threading.Lock()
+        self.last = 0
+        self.pending = _NO_DATA
+        self.timer = None
+
+    def _Deliver(self, data):
+        self.last = time.time()
+        self.deliver(data)
+
+    def Post(self, data):
+        with self.lock:
+            wait = self.last + self.interval - time.time()
+            if wait <= 0 and self.timer is None:
+                self._Deliver(data)
+                return
+
+            self.pending = data
+            if self.timer is None:
+                self.timer = threading.Timer(max(wait, 0), self.Flush)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def Flush(self):
+        """
+        Deliver the data held back, if any, now.
+        """
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            if self.pending is not _NO_DATA:
+                data = self.pending
+                self.pending = _NO_DATA
+                self._Deliver(data)
+
 # A singleton class for event passing between
 # different modules of GoSync
 class GoSyncEventController(object):
     _event_controller_instance = None
-    _sync_events = {GOSYNC_EVENT_SYNC_STARTED: GOSYNC_EVENT_ID_SYNC_STARTED,
-                    GOSYNC_EVENT_SYNC_UPDATE: GOSYNC_EVENT_ID_SYNC_UPDATE,
-                    GOSYNC_EVENT_SYNC_DONE: GOSYNC_EVENT_ID_SYNC_DONE,
-                    GOSYNC_EVENT_CALCULATE_USAGE_STARTED: GOSYNC_EVENT_ID_CALCULATE_USAGE_STARTED,
-                    GOSYNC_EVENT_CALCULATE_USAGE_UPDATE: GOSYNC_EVENT_ID_CALCULATE_USAGE_UPDATE,
-                    GOSYNC_EVENT_CALCULATE_USAGE_DONE: GOSYNC_EVENT_ID_CALCULATE_USAGE_DONE,
-                    GOSYNC_EVENT_SYNC_TIMER: GOSYNC_EVENT_ID_SYNC_TIMER,
-                    GOSYNC_EVENT_SYNC_INV_FOLDER: GOSYNC_EVENT_ID_SYNC_INV_FOLDER}
+    # wx event ids, made when a window first binds the event.
+    _sync_events = {}
     _sync_listeners = {GOSYNC_EVENT_SYNC_STARTED:[],
                        GOSYNC_EVENT_SYNC_UPDATE: [],
                        GOSYNC_EVENT_SYNC_DONE: [],
@@ -62,7 +117,9 @@ class GoSyncEventController(object):
                        GOSYNC_EVENT_CALCULATE_USAGE_UPDATE: [],
                        GOSYNC_EVENT_CALCULATE_USAGE_DONE: [],
                        GOSYNC_EVENT_SYNC_TIMER: [],
-                       GOSYNC_EVENT_SYNC_INV_FOLDER: []}
+                       GOSYNC_EVENT_SYNC_INV_FOLDER: [],
+                       GOSYNC_EVENT_ERROR: [],
+                       GOSYNC_EVENT_ACCOUNT_UPDATE: []}
 
     def __new__(cls, *args, **kwargs):
         if not cls._event_controller_instance:
@@ -72,17 +129,56 @@ class GoSyncEventController(object):
         return cls._event_controller_instance
 
     def PostEvent(self, event, data):
-        if self._sync_listeners[event] and \
-                self._sync_listeners[event]:
-            for listener in self._sync_listeners[event]:
-                wx.PostEvent(listener, GoSyncEvent(self._sync_events[event], data))
+        for channel in self._sync_listeners[event]:
+            if event in GOSYNC_CRITICAL_EVENTS:
+                # Whatever was held back for this listener comes first,
+                # so that e.g. a late progress update can't follow DONE.
+                for channels in self._sync_listeners.itervalues():
+                    for other in channels:
+                        if other.listener is channel.listener:
+                            other.Flush()
+            channel.Post(data)
+
+    def _MaxRate(self, event, max_rate):
+        if event not in self._sync_listeners:
+            raise ValueError("Invalid event")
+
+        if event in GOSYNC_CRITICAL_EVENTS:
+            return None
+        if max_rate is None:
+            return GOSYNC_DEFAULT_MAX_RATE.get(event, None)
+        return max_rate
+
+    def BindEvent(self, notify_object, event, func, max_rate=None):
+        """
+        Call func on notify_object (a wx window) for every event posted,
+        or for the latest one at most max_rate times a second. Critical
+        events are never held back.
+        """
+        import wx
 
-    def BindEvent(self, notify_object, event, func):
         if not notify_object:
             raise ValueError("Invalid notify object")
-    
-        if not self._sync_events[event]:
-            raise ValueError("Invalid event")
 
-        notify_object.Connect(-1, -1, self._sync_events[event], func)
-        self._sync_listeners[event].append(notify_object)
+        max_rate = self._MaxRate(event, max_rate)
+        if event not in self._sync_events:
+            self._sync_events[event] = wx.NewId()
+        event_id = self._sync_events[event]
+
+        notify_object.Connect(-1, -1, event_id, func)
+        self._sync_listeners[event].append(
+            GoSyncEventChannel(notify_object,
+                               lambda data: _PostWxEvent(notify_object, event_id, data),
+                               max_rate))
+
+    def AddListener(self, event, func, max_rate=None):
+        """
+        Like BindEvent, without a GUI: func is called with a GoSyncEvent,
+        on the thread that posted the event or on a timer thread.
+        """
+        max_rate = self._MaxRate(event, max_rate)
+        # Methods of the same object count as one listener, as a window
+        # does, for the ordering of critical events.
+        listener = getattr(func, '__self__', None) or func
+        self._sync_listeners[event].append(
+            GoSyncEventChannel(listener, lambda data: func(GoSyncEvent(event, data)), max_rate))
@@ -0,0 +1,80 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading
+from contextlib import contextmanager
+
+def PathsRelated(a, b):
+    """
+    True if a and b are the same path or one is below the other. The
+    empty path stands for the root of the mirror.
+    """
+    if a == '' or b == '':
+        return True
+    return a == b or a.startswith(b + '/') or b.startswith(a + '/')
+
+# Locks on paths instead of one lock for everything. A lock on a path
+# also covers everything below it, so two operations only wait for each
+# other when they touch the same path or one works inside a folder the
+# other is working on. A thread never waits for the locks it holds
+# itself, so an operation can lock a folder and then a file in it.
+#
+# Never queue work on a TransferPool while holding a lock: a worker
+# waiting for the same path would keep the queue from draining.
+class PathLockManager(object):
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.held = []
+
+    def _Conflicts(self, paths, owner):
+        for hpath, howner in self.held:
+            if howner is owner:
+                continue
+            for path in paths:
+                if PathsRelated(path, hpath):
+                    return True
+        return False
+
+    def Acquire(self, *paths):
+        """
+        Lock all paths at once, waiting until none of them is held by
+        another thread. Returns a handle for Release.
+        """
+        owner = threading.current_thread()
+        with self.cond:
+            while self._Conflicts(paths, owner):
+                self.cond.wait()
+
+            entries = [(path, owner) for path in paths]
+            self.held.extend(entries)
+
+        return entries
+
+    def Release(self, entries):
+        with self.cond:
+            for entry in entries:
+                self.held.remove(entry)
+            self.cond.notify_all()
+
+    @contextmanager
+    def Lock(self, *paths):
+        entries = self.Acquire(*paths)
+        try:
+            yield
+        finally:
+            self.Release(entries)
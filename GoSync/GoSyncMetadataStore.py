@@ -0,0 +1,475 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, sqlite3, threading
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS remote (id TEXT PRIMARY KEY, parent TEXT, title TEXT,
+                                   mimeType TEXT, md5 TEXT, size INTEGER, modifiedDate TEXT);
+CREATE INDEX IF NOT EXISTS remote_parent ON remote (parent, title);
+CREATE TABLE IF NOT EXISTS remote_rebuild (id TEXT PRIMARY KEY, parent TEXT, title TEXT,
+                                           mimeType TEXT, md5 TEXT, size INTEGER, modifiedDate TEXT);
+CREATE TABLE IF NOT EXISTS rollup (folder TEXT, category TEXT, files INTEGER, bytes INTEGER,
+                                   PRIMARY KEY (folder, category));
+CREATE TABLE IF NOT EXISTS local (path TEXT PRIMARY KEY, inode INTEGER, mtime REAL,
+                                  size INTEGER, hash TEXT);
+CREATE INDEX IF NOT EXISTS local_inode ON local (inode);
+CREATE TABLE IF NOT EXISTS base (path TEXT PRIMARY KEY, id TEXT, md5 TEXT);
+CREATE TABLE IF NOT EXISTS uploads (path TEXT PRIMARY KEY, parent TEXT, uri TEXT,
+                                    size INTEGER, mtime REAL);
+CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY, op TEXT, path TEXT, dest TEXT);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+DROP TABLE IF EXISTS usage;
+DROP TABLE IF EXISTS usage_rebuild;
+DELETE FROM meta WHERE key = 'usage';
+"""
+
+REMOTE_COLUMNS = "id, parent, title, mimeType, md5, size, modifiedDate"
+
+def _Text(value):
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return value
+
+# On-disk store of what GoSync knows about the drive ("remote" entries,
+# keyed by file id and by parent/title) and about the local mirror
+# ("local" entries, keyed by path relative to the mirror). "base" entries
+# record which file every path of the mirror was last in sync with,
+# which is how a reconciliation tells apart what changed on which side
+# since then. The number and size of files per category below every
+# folder ("rollup") are kept up to date along with the remote entries,
+# using classify(mimeType, title) to get the category of a file (None
+# if it doesn't count). The rollups are worked out again when
+# classify_key, which names the classification rules, changes. Every
+# update is its own small transaction, so nothing is ever rewritten as a
+# whole and nothing has to be held in memory. Remote entries are handed
+# out as dicts with the same keys as the Drive file resource.
+class MetadataStore(object):
+    def __init__(self, db_file, classify=None, classify_key='1'):
+        self.classify = classify or (lambda mimeType, title: None)
+        self.classify_key = classify_key
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+
+        if self.IsComplete() and self._Query("SELECT value FROM meta WHERE key='rollup'") != [(classify_key,)]:
+            self.RecomputeRollups()
+
+    def Close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _Row(self, file_obj):
+        parent = None
+        for p in file_obj.get('parents', []):
+            parent = 'root' if p.get('isRoot', False) else p['id']
+            break
+
+        size = file_obj.get('fileSize', None)
+        if size is not None:
+            size = long(size)
+
+        return (file_obj['id'], parent, file_obj['title'], file_obj['mimeType'],
+                file_obj.get('md5Checksum', None), size, file_obj.get('modifiedDate', None))
+
+    def _Entry(self, row):
+        entry = {'id': row[0], 'title': row[2], 'mimeType': row[3]}
+        if row[1] is not None:
+            entry['parents'] = [{'id': row[1], 'isRoot': row[1] == 'root'}]
+        if row[4] is not None:
+            entry['md5Checksum'] = row[4]
+        if row[5] is not None:
+            entry['fileSize'] = str(row[5])
+        if row[6] is not None:
+            entry['modifiedDate'] = row[6]
+        return entry
+
+    def _Query(self, sql, args=()):
+        with self.lock:
+            return self.conn.execute(sql, args).fetchall()
+
+    def _Update(self, sql, args=()):
+        with self.lock:
+            with self.conn:
+                self.conn.execute(sql, args)
+
+    ####### REMOTE ENTRIES #######
+    def IsComplete(self):
+        """
+        True once the remote entries were filled by a full listing.
+        """
+        return bool(self._Query("SELECT value FROM meta WHERE key='complete'"))
+
+    def SetComplete(self, complete=True):
+        if complete:
+            self._Update("INSERT OR REPLACE INTO meta VALUES ('complete', '1')")
+        else:
+            self._Update("DELETE FROM meta WHERE key='complete'")
+
+    def BeginRebuild(self):
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM remote_rebuild")
+
+    def AddRebuildPage(self, file_list):
+        rows = [self._Row(f) for f in file_list]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO remote_rebuild VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                      rows)
+
+    def FinishRebuild(self):
+        """
+        Replace the remote entries with the ones collected since
+        BeginRebuild in one transaction.
+        """
+        with self.lock:
+            with self.conn:
+                self.conn.execute("DELETE FROM remote")
+                self.conn.execute("INSERT INTO remote SELECT * FROM remote_rebuild")
+                self.conn.execute("DELETE FROM remote_rebuild")
+                self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('complete', '1')")
+                self._BuildRollups()
+
+    def AddFile(self, file_obj):
+        row = self._Row(file_obj)
+        with self.lock:
+            with self.conn:
+                old = self.conn.execute("SELECT %s FROM remote WHERE id = ?" % REMOTE_COLUMNS,
+                                        (row[0],)).fetchall()
+                if old:
+                    self._AdjustRollups(old[0], -1)
+                self.conn.execute("INSERT OR REPLACE INTO remote VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+                self._AdjustRollups(row, 1)
+        return self._Entry(row)
+
+    def RemoveFile(self, file_id, recursive=True):
+        """
+        Drop file_id from the store. When recursive is set, everything
+        below it goes too.
+        """
+        if recursive:
+            ids = "WITH RECURSIVE sub(id) AS (SELECT ? UNION ALL " \
+                  "SELECT remote.id FROM remote JOIN sub ON remote.parent = sub.id) "
+        else:
+            ids = "WITH sub(id) AS (SELECT ?) "
+
+        with self.lock:
+            with self.conn:
+                old = self.conn.execute(ids + "SELECT %s FROM remote WHERE id IN sub" % REMOTE_COLUMNS,
+                                        (file_id,)).fetchall()
+                for row in old:
+                    if row[0] == file_id:
+                        self._AdjustRollups(row, -1)
+                self.conn.execute(ids + "DELETE FROM rollup WHERE folder IN sub", (file_id,))
+                self.conn.execute(ids + "DELETE FROM remote WHERE id IN sub", (file_id,))
+
+    def GetFile(self, file_id):
+        rows = self._Query("SELECT %s FROM remote WHERE id = ?" % REMOTE_COLUMNS, (file_id,))
+        if not rows:
+            return None
+        return self._Entry(rows[0])
+
+    def GetChildren(self, file_id):
+        return [self._Entry(r) for r in
+                self._Query("SELECT %s FROM remote WHERE parent = ?" % REMOTE_COLUMNS, (file_id,))]
+
+    def GetChildFolders(self, file_id):
+        return [self._Entry(r) for r in
+                self._Query("SELECT %s FROM remote WHERE parent = ? AND mimeType = ?" % REMOTE_COLUMNS,
+                            (file_id, FOLDER_MIME_TYPE))]
+
+    def GetPath(self, file_id):
+        """
+        Return the path of file_id relative to the drive root or None if
+        the file is not reachable from the root (e.g. shared with me).
+        """
+        if file_id == 'root':
+            return ''
+
+        names = []
+        seen = set()
+        while file_id != 'root':
+            if file_id in seen:
+                return None
+            seen.add(file_id)
+            rows = self._Query("SELECT title, parent FROM remote WHERE id = ?", (file_id,))
+            if not rows or rows[0][1] is None:
+                return None
+            names.append(rows[0][0])
+            file_id = rows[0][1]
+
+        names.reverse()
+        return os.path.join(*names)
+
+    def FindPath(self, path):
+        """
+        Return the entry at path (relative to the drive root) or None.
+        """
+        entry = None
+        parent = 'root'
+        for name in _Text(path).split(os.sep):
+            rows = self._Query("SELECT %s FROM remote WHERE parent = ? AND title = ?" % REMOTE_COLUMNS,
+                               (parent, name))
+            if not rows:
+                return None
+            entry = self._Entry(rows[0])
+            parent = entry['id']
+
+        return entry
+
+    def IsFolder(self, file_id):
+        entry = self.GetFile(file_id)
+        return entry is not None and entry['mimeType'] == FOLDER_MIME_TYPE
+
+    def Walk(self, parent='root', pwd='', folders_only=False):
+        """
+        Depth first walk below parent, yielding (file, path) pairs.
+        """
+        stack = [(parent, pwd)]
+        while stack:
+            pid, ppath = stack.pop()
+            if folders_only:
+                children = self.GetChildFolders(pid)
+            else:
+                children = self.GetChildren(pid)
+            for f in children:
+                fpath = os.path.join(ppath, f['title'])
+                yield f, fpath
+                if f['mimeType'] == FOLDER_MIME_TYPE:
+                    stack.append((f['id'], fpath))
+
+    def __len__(self):
+        return self._Query("SELECT COUNT(*) FROM remote")[0][0]
+
+    def CountFiles(self):
+        """
+        Return the number of remote entries that are not folders.
+        """
+        return self._Query("SELECT COUNT(*) FROM remote WHERE mimeType != ?", (FOLDER_MIME_TYPE,))[0][0]
+
+    ####### FOLDER ROLLUPS #######
+    def _Ancestors(self, folder_id):
+        """
+        Yield folder_id and the folders above it, up to the root or the
+        first folder not in the store.
+        """
+        seen = set()
+        while folder_id is not None and folder_id not in seen:
+            seen.add(folder_id)
+            yield folder_id
+            if folder_id == 'root':
+                break
+            rows = self.conn.execute("SELECT parent FROM remote WHERE id = ?", (folder_id,)).fetchall()
+            folder_id = rows[0][0] if rows else None
+
+    def _AddToRollups(self, parent, totals, sign):
+        """
+        Add totals ({category: (files, bytes)}) to parent and every folder
+        above it. Must be called inside a transaction.
+        """
+        for folder in self._Ancestors(parent):
+            for category, (files, size) in totals.iteritems():
+                self.conn.execute("INSERT OR IGNORE INTO rollup VALUES (?, ?, 0, 0)", (folder, category))
+                self.conn.execute("UPDATE rollup SET files = files + ?, bytes = bytes + ? "
+                                  "WHERE folder = ? AND category = ?",
+                                  (sign * files, sign * size, folder, category))
+
+    def _AdjustRollups(self, row, sign):
+        """
+        Add (sign 1) or take away (sign -1) the remote row, and for a
+        folder everything below it, from the folders above it.
+        """
+        if row[3] == FOLDER_MIME_TYPE:
+            totals = dict((r[0], (r[1], r[2])) for r in
+                          self.conn.execute("SELECT category, files, bytes FROM rollup WHERE folder = ?",
+                                            (row[0],)))
+        else:
+            category = self.classify(row[3], row[2])
+            if category is None:
+                return
+            totals = {category: (1, row[5] or 0)}
+
+        if totals:
+            self._AddToRollups(row[1], totals, sign)
+
+    def _BuildRollups(self):
+        """
+        Work out every rollup in one pass over the remote entries. Must
+        be called inside a transaction.
+        """
+        parents = dict(self.conn.execute("SELECT id, parent FROM remote WHERE mimeType = ?",
+                                         (FOLDER_MIME_TYPE,)))
+        rollups = {}
+        for row in self.conn.execute("SELECT %s FROM remote WHERE mimeType != ?" % REMOTE_COLUMNS,
+                                     (FOLDER_MIME_TYPE,)):
+            category = self.classify(row[3], row[2])
+            if category is None:
+                continue
+
+            folder = row[1]
+            seen = set()
+            while folder is not None and folder not in seen:
+                seen.add(folder)
+                files, size = rollups.get((folder, category), (0, 0))
+                rollups[(folder, category)] = (files + 1, size + (row[5] or 0))
+                folder = parents.get(folder, None)
+
+        self.conn.execute("DELETE FROM rollup")
+        self.conn.executemany("INSERT INTO rollup VALUES (?, ?, ?, ?)",
+                              [(f, c, n, b) for (f, c), (n, b) in rollups.iteritems()])
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('rollup', ?)", (self.classify_key,))
+
+    def RecomputeRollups(self):
+        """
+        Work out the rollups again, e.g. after the categories changed.
+        """
+        with self.lock:
+            with self.conn:
+                self._BuildRollups()
+
+    def GetFolderUsage(self, folder_id='root'):
+        """
+        Return {category: (files, bytes)} of everything below folder_id.
+        """
+        return dict((row[0], (row[1], row[2])) for row in
+                    self._Query("SELECT category, files, bytes FROM rollup "
+                                "WHERE folder = ? AND files > 0", (folder_id,)))
+
+    def GetAllFolderUsage(self):
+        """
+        Return {folder id: {category: (files, bytes)}} of every folder
+        holding files.
+        """
+        usage = {}
+        for folder, category, files, size in self._Query("SELECT folder, category, files, bytes FROM rollup "
+                                                         "WHERE files > 0"):
+            usage.setdefault(folder, {})[category] = (files, size)
+        return usage
+
+    ####### LOCAL ENTRIES #######
+    def PutLocal(self, path, st, hash=None):
+        """
+        Record the local file at path with its os.stat() result and, if
+        known, its MD5 checksum.
+        """
+        self._Update("INSERT OR REPLACE INTO local VALUES (?, ?, ?, ?, ?)",
+                     (_Text(path), st.st_ino, st.st_mtime, st.st_size, hash))
+
+    def GetLocal(self, path):
+        """
+        Return (inode, mtime, size, hash) recorded for path or None.
+        """
+        rows = self._Query("SELECT inode, mtime, size, hash FROM local WHERE path = ?", (_Text(path),))
+        if not rows:
+            return None
+        return rows[0]
+
+    def RemoveLocal(self, path):
+        """
+        Forget path and everything recorded below it, base entries
+        included.
+        """
+        path = _Text(path)
+        with self.lock:
+            with self.conn:
+                for table in ['local', 'base']:
+                    self.conn.execute("DELETE FROM %s WHERE path = ? OR (path > ? AND path < ?)" % table,
+                                      (path, path + u'/', path + u'0'))
+
+    def MoveLocal(self, old_path, new_path):
+        old_path = _Text(old_path)
+        new_path = _Text(new_path)
+        with self.lock:
+            with self.conn:
+                for table in ['local', 'base']:
+                    self.conn.execute("UPDATE OR REPLACE %s SET path = ? || substr(path, ?) "
+                                      "WHERE path = ? OR (path > ? AND path < ?)" % table,
+                                      (new_path, len(old_path) + 1, old_path, old_path + u'/',
+                                       old_path + u'0'))
+
+    ####### BASE ENTRIES #######
+    def PutBase(self, path, file_id, md5=None):
+        """
+        Record that path is in sync with the drive file file_id, whose
+        content has the MD5 checksum md5 (None for folders).
+        """
+        self._Update("INSERT OR REPLACE INTO base VALUES (?, ?, ?)", (_Text(path), file_id, md5))
+
+    def GetBaseEntry(self, path):
+        """
+        Return (id, md5) of path if it was last known in sync, else None.
+        """
+        rows = self._Query("SELECT id, md5 FROM base WHERE path = ?", (_Text(path),))
+        if not rows:
+            return None
+        return rows[0]
+
+    def GetBase(self):
+        """
+        Return {path: (id, md5)} for every path last known in sync.
+        """
+        return dict((row[0], (row[1], row[2])) for row in
+                    self._Query("SELECT path, id, md5 FROM base"))
+
+    ####### UPLOAD SESSIONS #######
+    def PutUpload(self, path, parent, uri, st):
+        """
+        Remember the resumable upload session of the local file at path,
+        along with the size and mtime it had when the upload started.
+        """
+        self._Update("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?)",
+                     (_Text(path), parent, uri, st.st_size, st.st_mtime))
+
+    def GetUpload(self, path):
+        """
+        Return (parent, uri, size, mtime) of the upload session of path
+        or None.
+        """
+        rows = self._Query("SELECT parent, uri, size, mtime FROM uploads WHERE path = ?", (_Text(path),))
+        if not rows:
+            return None
+        return rows[0]
+
+    def GetUploads(self):
+        """
+        Return (path, parent) for every unfinished upload.
+        """
+        return self._Query("SELECT path, parent FROM uploads")
+
+    def RemoveUpload(self, path):
+        self._Update("DELETE FROM uploads WHERE path = ?", (_Text(path),))
+
+    ####### OBSERVED EVENTS #######
+    def PutEvent(self, seq, op, path, dest=None):
+        self._Update("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?)",
+                     (seq, op, _Text(path), _Text(dest)))
+
+    def RemoveEvent(self, seq):
+        self._Update("DELETE FROM events WHERE seq = ?", (seq,))
+
+    def GetEvents(self):
+        """
+        Return (seq, op, path, dest) of every saved event, oldest first.
+        """
+        return self._Query("SELECT seq, op, path, dest FROM events ORDER BY seq")
@@ -0,0 +1,224 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, threading, time
+from contextlib import contextmanager
+from functools import wraps
+
+OP_DURATION = 'gosync_operation_duration_seconds'
+OP_ERRORS = 'gosync_operation_errors_total'
+BYTES = 'gosync_bytes_total'
+API_REQUESTS = 'gosync_api_requests_total'
+API_RETRIES = 'gosync_api_retries_total'
+
+# Type and help text of every metric, in the order they are written.
+METRICS = [(OP_DURATION, 'histogram', 'Time taken by sync operations, by operation.'),
+           (OP_ERRORS, 'counter', 'Sync operations that failed, by operation.'),
+           (BYTES, 'counter', 'Bytes uploaded, downloaded and hashed.'),
+           (API_REQUESTS, 'counter', 'Drive API requests sent, retries included.'),
+           (API_RETRIES, 'counter', 'Drive API requests retried, by reason.'),
+           ('gosync_api_rate', 'gauge', 'Drive API requests per second currently allowed.'),
+           ('gosync_queue_length', 'gauge', 'Jobs waiting, by queue.'),
+           ('gosync_path_cache_hits_total', 'counter', 'Path cache lookups answered from the cache.'),
+           ('gosync_path_cache_misses_total', 'counter', 'Path cache lookups that missed.'),
+           ('gosync_drive_files', 'gauge', 'Files in the drive index.')]
+
+# Upper bounds of the latency buckets, in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+def _Key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def _Labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                             for k, v in pairs)
+
+def _Number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Histogram(object):
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+# Counters, histograms and gauges of the sync engine, kept in memory.
+# Gauges are read from a callback when the metrics are collected.
+# Snapshot() gives them to the GUI or a script and Prometheus() formats
+# them for the node exporter's textfile collector.
+class MetricsRegistry(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def Inc(self, name, value=1, **labels):
+        key = _Key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def Observe(self, name, value, **labels):
+        key = _Key(name, labels)
+        with self.lock:
+            h = self.histograms.get(key, None)
+            if h is None:
+                h = self.histograms[key] = _Histogram(self.buckets)
+            n = 0
+            while n < len(self.buckets) and value > self.buckets[n]:
+                n += 1
+            h.counts[n] += 1
+            h.sum += value
+            h.count += 1
+
+    def Gauge(self, name, func, **labels):
+        """
+        Report func() as the value of name when collecting.
+        """
+        with self.lock:
+            self.gauges[_Key(name, labels)] = func
+
+    @contextmanager
+    def Time(self, op, expected=()):
+        """
+        Time the with block as operation op, and count it as failed if
+        it raises anything but one of the expected exceptions.
+        """
+        start = time.time()
+        try:
+            yield
+        except expected:
+            raise
+        except:
+            self.Inc(OP_ERRORS, op=op)
+            raise
+        finally:
+            self.Observe(OP_DURATION, time.time() - start, op=op)
+
+    def Quantile(self, h, q):
+        """
+        Estimate the q-quantile of a histogram the way Prometheus does,
+        by interpolating within the bucket it falls in.
+        """
+        if not h.count:
+            return None
+        rank = q * h.count
+        seen = 0
+        lower = 0.0
+        for n, upper in enumerate(self.buckets):
+            if seen + h.counts[n] >= rank:
+                if not h.counts[n]:
+                    return upper
+                return lower + (upper - lower) * (rank - seen) / h.counts[n]
+            seen += h.counts[n]
+            lower = upper
+        return self.buckets[-1]
+
+    def _Gauges(self):
+        with self.lock:
+            gauges = self.gauges.items()
+
+        values = {}
+        for key, func in gauges:
+            try:
+                values[key] = func()
+            except Exception:
+                pass
+        return values
+
+    def Snapshot(self):
+        """
+        Return every metric as a dict of name{labels} -> value. Histograms
+        give their count, sum, and estimated median and 99th percentile.
+        """
+        snapshot = {}
+        for (name, labels), value in self._Gauges().items():
+            snapshot[name + _Labels(labels)] = value
+
+        with self.lock:
+            for (name, labels), value in self.counters.items():
+                snapshot[name + _Labels(labels)] = value
+            for (name, labels), h in self.histograms.items():
+                snapshot[name + _Labels(labels)] = {'count': h.count, 'sum': h.sum,
+                                                    'p50': self.Quantile(h, 0.5),
+                                                    'p99': self.Quantile(h, 0.99)}
+        return snapshot
+
+    def Prometheus(self):
+        """
+        Return the metrics in the Prometheus text format.
+        """
+        gauges = self._Gauges()
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {}
+            for key, h in self.histograms.items():
+                histograms[key] = (list(h.counts), h.sum, h.count)
+
+        lines = []
+        for name, kind, help_text in METRICS:
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            if kind == 'histogram':
+                for (hname, labels), (counts, total, count) in sorted(histograms.items()):
+                    if hname != name:
+                        continue
+                    cumulative = 0
+                    for n, upper in enumerate(list(self.buckets) + [float('inf')]):
+                        cumulative += counts[n]
+                        lines.append('%s_bucket%s %d' % (name, _Labels(labels, [('le', _Number(upper))]),
+                                                         cumulative))
+                    lines.append('%s_sum%s %s' % (name, _Labels(labels), _Number(total)))
+                    lines.append('%s_count%s %d' % (name, _Labels(labels), count))
+            else:
+                for values in (counters, gauges):
+                    for (vname, labels), value in sorted(values.items()):
+                        if vname == name:
+                            lines.append('%s%s %s' % (name, _Labels(labels), _Number(value)))
+        return '\n'.join(lines) + '\n'
+
+    def WriteTextfile(self, path):
+        """
+        Write the metrics to path. The file is replaced in one step, so
+        the collector never reads half of it.
+        """
+        tmp_file = path + '.tmp'
+        with open(tmp_file, 'w') as f:
+            f.write(self.Prometheus())
+        os.rename(tmp_file, path)
+
+def Timed(op, expected=()):
+    """
+    Decorator timing a method of an object with a "metrics" registry as
+    operation op. The expected exceptions are not counted as failures.
+    """
+    def decorate(func):
+        @wraps(func)
+        def timed(self, *args, **kwargs):
+            with self.metrics.Time(op, expected):
+                return func(self, *args, **kwargs)
+        return timed
+    return decorate
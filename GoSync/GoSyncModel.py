@@ -16,20 +16,32 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import sys, os, wx, ntpath, defines, threading, hashlib, time, copy
+import sys, os, ntpath, defines, threading, hashlib, time, shutil, collections
 from pydrive.auth import GoogleAuth
-from pydrive.drive import GoogleDrive
 from os.path import expanduser
 from watchdog.observers import Observer
 from watchdog.events import PatternMatchingEventHandler
 from threading import Thread
 from apiclient.errors import HttpError
 from apiclient import errors
+from apiclient.http import MediaFileUpload
+import httplib2
 import logging
 from defines import *
 from GoSyncEvents import *
 from GoSyncDriveTree import GoogleDriveTree
-import json, pickle
+from GoSyncMetadataStore import MetadataStore
+from GoSyncPathCache import PathCache
+from GoSyncTransferPool import TransferPool
+from GoSyncWorkQueue import *
+from GoSyncLockManager import PathLockManager
+from GoSyncReconciler import *
+from GoSyncClassifier import MimeClassifier, CATEGORIES
+from GoSyncScheduler import SyncScheduler
+from GoSyncRateLimiter import ApiRateLimiter, ClassifyError
+from GoSyncServicePool import HttpClientPool
+from GoSyncMetrics import *
+import json
 
 class ClientSecretsNotFound(RuntimeError):
     """Client secrets file was not found"""
@@ -49,25 +61,53 @@ class FileListQueryFailed(RuntimeError):
     """The query of file list failed"""
 class ConfigLoadFailed(RuntimeError):
     """Failed to load the GoSync configuration file"""
-
-audio_file_mimelist = ['audio/mpeg', 'audio/x-mpeg-3', 'audio/mpeg3', 'audio/aiff', 'audio/x-aiff']
-movie_file_mimelist = ['video/mp4', 'video/x-msvideo', 'video/mpeg', 'video/flv', 'video/quicktime']
-image_file_mimelist = ['image/png', 'image/jpeg', 'image/jpg', 'image/tiff']
-document_file_mimelist = ['application/powerpoint', 'applciation/mspowerpoint', \
-                              'application/x-mspowerpoint', 'application/pdf', \
-                              'application/x-dvi']
-google_docs_mimelist = ['application/vnd.google-apps.spreadsheet', \
-                            'application/vnd.google-apps.sites', \
-                            'application/vnd.google-apps.script', \
-                            'application/vnd.google-apps.presentation', \
-                            'application/vnd.google-apps.fusiontable', \
-                            'application/vnd.google-apps.form', \
-                            'application/vnd.google-apps.drawing', \
-                            'application/vnd.google-apps.document', \
-                            'application/vnd.google-apps.map']
+class ChangeTokenInvalid(RuntimeError):
+    """The saved start page token was rejected by the changes feed"""
+class DownloadVerificationFailed(RuntimeError):
+    """MD5 checksum of the downloaded file didn't match the remote one"""
+class AuthenticationFailed(RuntimeError):
+    """The user could not be authenticated with Google Drive"""
+
+# Documents, shortcuts and the other types of Google's own have no
+# content to download, whether or not they are known here.
+GOOGLE_APPS_MIMETYPE_PREFIX = 'application/vnd.google-apps.'
+# Downloads the drive refuses for good, e.g. files their owner doesn't
+# allow to be downloaded, don't hold back the sync.
+PERMANENT_DOWNLOAD_ERRORS = frozenset([400, 403, 404])
+
+# Fields of the file resources the sync engine actually reads. Queries
+# ask only for these (partial response) to keep the payload small.
+FILE_FIELDS = ['id', 'title', 'mimeType', 'md5Checksum', 'fileSize', 'modifiedDate', 'parents(id,isRoot)']
+FOLDER_FIELDS = ['id', 'title', 'mimeType', 'parents(id,isRoot)']
+CHANGE_FIELDS = 'nextPageToken,newStartPageToken,items(fileId,deleted,file(%s,labels/trashed))' % ','.join(FILE_FIELDS)
+ABOUT_FIELDS = 'name,user/emailAddress,quotaBytesTotal,quotaBytesUsed'
+MAX_LIST_PAGE_SIZE = 1000
+HASH_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 16 * 1024 * 1024
+# Downloads are written to a hidden file next to the target, named
+# .<title>.<md5>.gosync-part, and renamed into place when complete.
+PARTIAL_DOWNLOAD_SUFFIX = '.gosync-part'
+# Resumable upload chunks must be a multiple of 256 KiB.
+UPLOAD_CHUNK_ALIGN = 256 * 1024
 
 class GoSyncModel(object):
-    def __init__(self):
+    def __init__(self, headless=False):
+        self.logger = logging.getLogger(APP_NAME)
+        self.logger.setLevel(logging.DEBUG)
+        fh = logging.FileHandler(os.path.join(os.environ['HOME'], 'GoSync.log'))
+        fh.setLevel(logging.DEBUG)
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        fh.setFormatter(formatter)
+        self.logger.addHandler(fh)
+
+        # Errors are logged and kept here for whoever shows the status;
+        # the model never talks to the user itself.
+        self.headless = headless
+        self.recentErrors = collections.deque(maxlen=20)
+        self.lastSync = None
+        self.startupTimes = {}
+        self.is_logged_in = False
+
         self.calculatingDriveUsage = False
         self.driveAudioUsage = 0
         self.driveMoviesUsage = 0
@@ -76,14 +116,15 @@ class GoSyncModel(object):
         self.driveOthersUsage = 0
         self.totalFilesToCheck = 0
         self.savedTotalSize = 0
-        self.fcount = 0
         self.updates_done = 0
+        self.remoteChanges = 0
 
         self.config_path = os.path.join(os.environ['HOME'], ".gosync")
         self.credential_file = os.path.join(self.config_path, "credentials.json")
         self.settings_file = os.path.join(self.config_path, "settings.yaml")
         self.base_mirror_directory = os.path.join(os.environ['HOME'], "Google Drive")
         self.client_secret_file = os.path.join(os.environ['HOME'], '.gosync', 'client_secrets.json')
+        self.account_file = os.path.join(self.config_path, 'account.json')
         self.sync_selection = []
         self.config_file = os.path.join(os.environ['HOME'], '.gosync', 'gosyncrc')
         self.config_dict = {}
@@ -114,15 +155,29 @@ class GoSyncModel(object):
             sfile.close()
 
         self.observer = Observer()
-        self.DoAuthenticate()
-        self.about_drive = self.authToken.service.about().get().execute()
+        # Every Drive API call, from whichever thread, goes through this
+        # one limiter. The rate is set from the config once it is loaded.
+        self.metrics = MetricsRegistry()
+        self.apiLimiter = ApiRateLimiter(metrics=self.metrics)
+        # Calls made outside the transfer pools take a client from here.
+        self.httpPool = HttpClientPool(self.NewHttpClient)
+        # Start from what we knew about the account last time and log in
+        # in the background. Only the very first start has to wait.
+        self.about_drive = self.LoadAccountCache()
+        if self.about_drive is None:
+            self.DoAuthenticate()
+            self.about_drive = self.FetchDriveInfo()
         self.user_email = self.about_drive['user']['emailAddress']
+        self.authReady = threading.Event()
+        self.startup_thread = threading.Thread(target=self.FinishStartup)
+        self.startup_thread.daemon = True
 
         self.mirror_directory = os.path.join(self.base_mirror_directory, self.user_email)
         if not os.path.exists(self.mirror_directory):
             os.mkdir(self.mirror_directory, 0755)
 
-        self.tree_pickle_file = os.path.join(self.config_path, 'gtree-' + self.user_email + '.pick')
+        self.metadata_file = os.path.join(self.config_path, 'gosync-' + self.user_email + '.db')
+        self.change_token = None
 
         if not os.path.exists(self.config_file):
             self.CreateDefaultConfigFile()
@@ -132,11 +187,25 @@ class GoSyncModel(object):
         except:
             raise
 
-
-        self.iobserv_handle = self.observer.schedule(FileModificationNotifyHandler(self),
-                                                     self.mirror_directory, recursive=True)
-
-        self.sync_lock = threading.Lock()
+        self.apiLimiter.SetMaxRate(self.config_dict.get('API Requests Per Second', 10))
+        self.httpPool.SetSize(self.config_dict.get('API Connections', 4))
+        self.pathCache = PathCache(self.config_dict.get('Path Cache Size', 10000),
+                                   self.config_dict.get('Path Cache TTL', 600))
+        self.downloadPool = TransferPool('download', self.config_dict.get('Download Workers', 4),
+                                         self.NewHttpClient)
+        self.uploadPool = TransferPool('upload', self.config_dict.get('Upload Workers', 4),
+                                       self.NewHttpClient)
+        self.resumable_upload_threshold = self.config_dict.get('Resumable Upload Threshold',
+                                                               8 * 1024 * 1024)
+        chunk = self.config_dict.get('Upload Chunk Size', 8 * 1024 * 1024)
+        self.upload_chunk_size = max(1, (chunk + UPLOAD_CHUNK_ALIGN - 1) / UPLOAD_CHUNK_ALIGN) * UPLOAD_CHUNK_ALIGN
+
+        self.iobserv_handle = None
+
+        # Paths (relative to the mirror) being worked on. Sync, usage
+        # calculation and observed changes run side by side and only wait
+        # for each other on the same path or subtree.
+        self.pathLocks = PathLockManager()
         self.sync_thread = threading.Thread(target=self.run)
         self.usage_calc_thread = threading.Thread(target=self.calculateUsage)
         self.sync_thread.daemon = True
@@ -145,30 +214,172 @@ class GoSyncModel(object):
         self.syncRunning.clear()
         self.usageCalculateEvent = threading.Event()
         self.usageCalculateEvent.set()
-
-        self.logger = logging.getLogger(APP_NAME)
-        self.logger.setLevel(logging.DEBUG)
-        fh = logging.FileHandler(os.path.join(os.environ['HOME'], 'GoSync.log'))
-        fh.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        self.logger.addHandler(fh)
-        if not os.path.exists(self.tree_pickle_file):
-            self.driveTree = GoogleDriveTree()
-        else:
-            self.driveTree = pickle.load(open(self.tree_pickle_file, "rb"))
+        self.usageRecount = False
+        # Remote passes run when the scheduler says so: sooner after
+        # passes that found changes, less often while the drive is idle.
+        self.scheduler = SyncScheduler(self.config_dict.get('Sync Interval', 600),
+                                       self.config_dict.get('Min Sync Interval', 60),
+                                       self.config_dict.get('Max Sync Interval', 3600))
+        # The observer doesn't see what changed in the mirror while GoSync
+        # wasn't running, or what it missed. The mirror is compared with
+        # the index on the first pass and then every so often.
+        self.reconcile_interval = self.config_dict.get('Reconcile Interval', 3600)
+        self.lastReconcile = 0
+
+        # Index of the whole drive by id and of the local mirror by path.
+        # The changes feed only gives ids, so this is also what lets us
+        # find the local copy of a file that was trashed, renamed or moved
+        # remotely.
+        self.classifier = MimeClassifier(self.config_dict.get('Usage Categories', None))
+        self.metaStore = MetadataStore(self.metadata_file, self.classifier.Classify,
+                                       self.classifier.GetSignature())
+        # The tree is loaded from the index by FinishStartup.
+        self.treeGeneration = 0
+        self.PublishDriveTree(GoogleDriveTree())
+
+        self.observerQueue = ObserverWorkQueue(self.metaStore, self.HandleObservedEvent,
+                                               self.config_dict.get('Observer Workers', 4))
+
+        self.metrics.Gauge('gosync_api_rate', self.apiLimiter.GetRate)
+        self.metrics.Gauge('gosync_queue_length', self.observerQueue.__len__, queue='observer')
+        self.metrics.Gauge('gosync_queue_length', self.uploadPool.__len__, queue='upload')
+        self.metrics.Gauge('gosync_queue_length', self.downloadPool.__len__, queue='download')
+        self.metrics.Gauge('gosync_path_cache_hits_total', lambda: self.pathCache.hits)
+        self.metrics.Gauge('gosync_path_cache_misses_total', lambda: self.pathCache.misses)
+        self.metrics.Gauge('gosync_drive_files', self.metaStore.__len__)
+        # Written for the node exporter's textfile collector. An empty
+        # file name turns it off.
+        self.metrics_file = self.config_dict.get('Metrics File',
+                                                 os.path.join(self.config_path, 'gosync.prom'))
+        self.metrics_interval = self.config_dict.get('Metrics Interval', 60)
+        self.metrics_thread = threading.Thread(target=self.WriteMetrics)
+        self.metrics_thread.daemon = True
+        self.StartupMark('model')
 
     def SetTheBallRolling(self):
         self.sync_thread.start()
         self.usage_calc_thread.start()
         self.observer.start()
+        self.startup_thread.start()
+        if self.metrics_file:
+            self.metrics_thread.start()
+
+    ####### STARTUP SECTION #######
+    def StartupMark(self, step):
+        """
+        Record how long after the start of GoSync the given startup step
+        was done.
+        """
+        if step not in self.startupTimes:
+            self.startupTimes[step] = time.time() - APP_START_TIME
+            self.logger.info("Startup: %s ready after %.2f seconds\n" % (step, self.startupTimes[step]))
+
+    def LoadAccountCache(self):
+        try:
+            with open(self.account_file, 'r') as f:
+                about = json.load(f)
+            about['user']['emailAddress']
+            return about
+        except (IOError, ValueError, KeyError, TypeError):
+            return None
+
+    def FetchDriveInfo(self):
+        """
+        Ask the drive about the account and its quota, and keep the
+        answer for the next start.
+        """
+        about = self.ApiCall(self.authToken.service.about().get(fields=ABOUT_FIELDS))
+        try:
+            tmp_file = self.account_file + '.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(about, f)
+            os.rename(tmp_file, self.account_file)
+        except (IOError, OSError):
+            self.logger.exception("FetchDriveInfo: could not save the account info\n")
+        return about
+
+    def FinishStartup(self):
+        """
+        The part of the startup that can wait until the window is up:
+        watching the mirror, loading the drive tree and logging in. The
+        sync and the observed changes wait for it, local changes made in
+        the meantime are queued.
+        """
+        try:
+            self.iobserv_handle = self.observer.schedule(FileModificationNotifyHandler(self),
+                                                         self.mirror_directory, recursive=True)
+            self.StartupMark('observer')
+
+            if self.metaStore.IsComplete():
+                driveTree = GoogleDriveTree()
+                driveTree.LoadIndex(self.metaStore)
+                self.PublishDriveTree(driveTree)
+            self.StartupMark('tree')
+
+            if not self.is_logged_in:
+                self.DoAuthenticate()
+                about = self.FetchDriveInfo()
+                if about['user']['emailAddress'] != self.user_email:
+                    self.ReportError('Account Changed',
+                                     "Logged in as %s instead of %s. Please restart GoSync.\n"
+                                     % (about['user']['emailAddress'], self.user_email))
+                    return
+                self.about_drive = about
+            self.StartupMark('auth')
+        except AuthenticationFailed:
+            return
+        except:
+            self.logger.exception("FinishStartup: startup failed\n")
+            self.ReportError('Startup Failed', "GoSync failed to connect to Google Drive.\n")
+            return
+
+        GoSyncEventController().PostEvent(GOSYNC_EVENT_ACCOUNT_UPDATE, self.about_drive)
+        self.authReady.set()
+        self.observerQueue.Start()
+        self.ResumePendingUploads()
 
     def IsUserLoggedIn(self):
         return self.is_logged_in
 
+    @Timed('hash')
+    def ChecksumOfFile(self, abs_filepath):
+        md5 = hashlib.md5()
+        hashed = 0
+        with open(abs_filepath, "rb") as f:
+            while True:
+                data = f.read(HASH_CHUNK_SIZE)
+                if not data:
+                    break
+                md5.update(data)
+                hashed += len(data)
+
+        self.metrics.Inc(BYTES, hashed, direction='hash')
+        return md5.hexdigest()
+
     def HashOfFile(self, abs_filepath):
-        data = open(abs_filepath, "r").read()
-        return hashlib.md5(data).hexdigest()
+        """
+        Return the MD5 checksum of the file. The checksum recorded in the
+        metadata store is reused as long as the inode, size and mtime of
+        the file haven't changed. Otherwise the file is read in chunks so
+        that memory use doesn't grow with the file size.
+        """
+        st = os.stat(abs_filepath)
+        try:
+            drivepath = abs_filepath.split(self.mirror_directory+'/')[1]
+        except IndexError:
+            drivepath = None
+
+        if drivepath is not None:
+            cached = self.metaStore.GetLocal(drivepath)
+            if cached and cached[3] and cached[0] == st.st_ino and \
+                    cached[1] == st.st_mtime and cached[2] == st.st_size:
+                return cached[3]
+
+        digest = self.ChecksumOfFile(abs_filepath)
+        if drivepath is not None:
+            self.metaStore.PutLocal(drivepath, st, digest)
+
+        return digest
 
     def CreateDefaultConfigFile(self):
         f = open(self.config_file, 'w')
@@ -185,7 +396,7 @@ class GoSyncModel(object):
                 try:
                     self.config_dict = self.config[self.user_email]
                     self.sync_selection = self.config_dict['Sync Selection']
-                    print self.config_dict['Drive Usage']
+                    self.change_token = self.config_dict.get('Change Token', None)
                     try:
                         self.drive_usage_dict = self.config_dict['Drive Usage']
                         self.totalFilesToCheck = self.drive_usage_dict['Total Files']
@@ -220,19 +431,63 @@ class GoSyncModel(object):
     def DoAuthenticate(self):
         try:
             self.authToken = GoogleAuth(self.settings_file)
-            self.authToken.LocalWebserverAuth()
-            self.drive = GoogleDrive(self.authToken)
+            if self.headless:
+                # No browser to come back to: print the URL and read the
+                # code from the console.
+                self.authToken.CommandLineAuth()
+            else:
+                self.authToken.LocalWebserverAuth()
             self.is_logged_in = True
         except:
-            dial = wx.MessageDialog(None, "Authentication Rejected!\n",
-                                    'Information', wx.ID_OK | wx.ICON_EXCLAMATION)
-            dial.ShowModal()
             self.is_logged_in = False
-            pass
+            self.logger.exception("DoAuthenticate: authentication failed\n")
+            self.ReportError('Authentication Rejected', "Authentication Rejected!\n")
+            raise AuthenticationFailed()
+
+    def ReportError(self, title, message):
+        """
+        Log an error the user should know about, remember it for the
+        status and tell the listeners.
+        """
+        self.logger.error(message)
+        self.recentErrors.append((time.time(), title, message))
+        GoSyncEventController().PostEvent(GOSYNC_EVENT_ERROR, (title, message))
+
+    def GetMetrics(self):
+        """
+        Return the counters, gauges and latency summaries of the sync
+        engine, see MetricsRegistry.Snapshot.
+        """
+        return self.metrics.Snapshot()
+
+    def WriteMetrics(self):
+        while True:
+            try:
+                self.metrics.WriteTextfile(self.metrics_file)
+            except (IOError, OSError):
+                self.logger.exception("WriteMetrics: could not write %s\n" % self.metrics_file)
+            time.sleep(self.metrics_interval)
+
+    def GetStatus(self):
+        """
+        Return a snapshot of what the sync engine is doing.
+        """
+        status = {'running': self.IsSyncEnabled(),
+                  'next_sync': self.scheduler.GetNextRun(),
+                  'last_sync': None,
+                  'last_sync_ok': None,
+                  'pending_events': len(self.observerQueue),
+                  'startup': dict(self.startupTimes),
+                  'errors': [{'time': t, 'title': title, 'message': message}
+                             for t, title, message in self.recentErrors]}
+        if self.lastSync:
+            status['last_sync'], status['last_sync_ok'] = self.lastSync
+        return status
 
     def DoUnAuthenticate(self):
             self.do_sync = False
-            self.observer.unschedule(self.iobserv_handle)
+            if self.iobserv_handle:
+                self.observer.unschedule(self.iobserv_handle)
             self.iobserv_handle = None
             os.remove(self.credential_file)
             self.is_logged_in = False
@@ -250,7 +505,9 @@ class GoSyncModel(object):
         mentioned in parent.
         """
         self.logger.debug("GetFolderOnDrive: searching %s on %s... " % (folder_name, parent))
-        file_list = self.drive.ListFile({'q': "'%s' in parents and trashed=false" % parent}).GetList()
+        file_list = self.MakeFileListQuery({'q': "'%s' in parents and trashed=false and title='%s' and mimeType='application/vnd.google-apps.folder'"
+                                            % (parent, self.QuoteQueryString(folder_name))},
+                                           FOLDER_FIELDS)
         for f in file_list:
             if f['title'] == folder_name and f['mimeType']=='application/vnd.google-apps.folder':
                 self.logger.debug("Found!\n")
@@ -258,29 +515,51 @@ class GoSyncModel(object):
 
         return None
 
+    # Not finding the path is an answer, not a failure.
+    @Timed('locate_folder', expected=FolderNotFound)
     def LocateFolderOnDrive(self, folder_path):
         """
         Locate and return the directory in the path. The complete path
         is walked and the last directory is returned. An exception is raised
         if the path walking fails at any stage.
         """
+        folder = self.pathCache.Get(folder_path)
+        if folder:
+            return folder
+
+        folder = self.metaStore.FindPath(folder_path)
+        if folder and folder['mimeType'] == 'application/vnd.google-apps.folder':
+            return folder
+
         dir_list = folder_path.split(os.sep)
         croot = 'root'
-        for dir1 in dir_list:
+        start = 0
+        # Resume the walk from the deepest parent we already know.
+        for n in range(len(dir_list) - 1, 0, -1):
+            folder = self.pathCache.Get(os.sep.join(dir_list[:n]))
+            if folder:
+                croot = folder['id']
+                start = n
+                break
+
+        for n in range(start, len(dir_list)):
             try:
-                folder = self.GetFolderOnDrive(dir1, croot)
+                folder = self.GetFolderOnDrive(dir_list[n], croot)
                 if not folder:
                     raise FolderNotFound()
             except:
                 raise
 
+            self.pathCache.Put(os.sep.join(dir_list[:n + 1]), folder)
             croot = folder['id']
 
         return folder
 
     def LocateFileInFolder(self, filename, parent='root'):
         try:
-            file_list = self.MakeFileListQuery({'q': "'%s' in parents and trashed=false" % parent})
+            file_list = self.MakeFileListQuery({'q': "'%s' in parents and trashed=false and title='%s'"
+                                                % (parent, self.QuoteQueryString(filename))},
+                                               FILE_FIELDS)
             for f in file_list:
                 if f['title'] == filename:
                     return f
@@ -290,7 +569,18 @@ class GoSyncModel(object):
             raise FileNotFound()
 
 
+    @Timed('locate', expected=(FileNotFound, FolderNotFound))
     def LocateFileOnDrive(self, abs_filepath):
+        fil = self.pathCache.Get(abs_filepath)
+        if fil:
+            return fil
+
+        # The index knows everything on the drive as of the last sync.
+        # Only what isn't in it is looked up on the drive.
+        fil = self.metaStore.FindPath(abs_filepath)
+        if fil:
+            return fil
+
         dirpath = os.path.dirname(abs_filepath)
         filename = self.PathLeaf(abs_filepath)
 
@@ -299,6 +589,7 @@ class GoSyncModel(object):
                 f = self.LocateFolderOnDrive(dirpath)
                 try:
                     fil = self.LocateFileInFolder(filename, f['id'])
+                    self.pathCache.Put(abs_filepath, fil)
                     return fil
                 except FileNotFound:
                     self.logger.debug("LocateFileOnDrive: File not found.\n")
@@ -315,6 +606,7 @@ class GoSyncModel(object):
         else:
             try:
                 fil = self.LocateFileInFolder(filename)
+                self.pathCache.Put(abs_filepath, fil)
                 return fil
             except FileNotFound:
                 self.logger.debug("LocateFileOnDrive: File not found.\n")
@@ -327,49 +619,183 @@ class GoSyncModel(object):
                 raise
 
     def CreateDirectoryInParent(self, dirname, parent_id='root'):
-        upfile = self.drive.CreateFile({'title': dirname,
-                                        'mimeType': "application/vnd.google-apps.folder",
-                                        "parents": [{"kind": "drive#fileLink", "id": parent_id}]})
-        upfile.Upload()
+        body = {'title': dirname,
+                'mimeType': "application/vnd.google-apps.folder",
+                "parents": [{"kind": "drive#fileLink", "id": parent_id}]}
+        folder = self.ApiCall(self.authToken.service.files().insert(body=body, fields=','.join(FOLDER_FIELDS)))
+        self.metaStore.AddFile(folder)
+        return folder
 
     def CreateDirectoryByPath(self, dirpath):
+        """
+        Create the folder at dirpath on the drive, unless it is there
+        already. Returns the folder, or None if it could not be created.
+        """
         self.logger.debug("create directory: %s\n" % dirpath)
         drivepath = dirpath.split(self.mirror_directory+'/')[1]
         basepath = os.path.dirname(drivepath)
         dirname = self.PathLeaf(dirpath)
 
         try:
-            f = self.LocateFolderOnDrive(drivepath)
-            return
+            return self.LocateFolderOnDrive(drivepath)
         except FolderNotFound:
             if basepath == '':
-                self.CreateDirectoryInParent(dirname)
+                return self.CreateDirectoryInParent(dirname)
             else:
                 try:
                     parent_folder = self.LocateFolderOnDrive(basepath)
-                    self.CreateDirectoryInParent(dirname, parent_folder['id'])
+                    return self.CreateDirectoryInParent(dirname, parent_folder['id'])
                 except:
-                    errorMsg = "Failed to locate directory path %s on drive.\n" % basepath
-                    self.logger.error(errorMsg)
-                    dial = wx.MessageDialog(None, errorMsg, 'Directory Not Found',
-                                            wx.ID_OK | wx.ICON_EXCLAMATION)
-                    dial.ShowModal()
-                    return
+                    self.ReportError('Directory Not Found',
+                                     "Failed to locate directory path %s on drive.\n" % basepath)
+                    return None
         except FileListQueryFailed:
-            errorMsg = "Server Query Failed!\n"
-            self.logger.error(errorMsg)
-            dial = wx.MessageDialog(None, errorMsg, 'Directory Not Found',
-                                    wx.ID_OK | wx.ICON_EXCLAMATION)
-            dial.ShowModal()
-            return
+            self.ReportError('Directory Not Found', "Server Query Failed!\n")
+            return None
+
+    def NewUploadRequest(self, file_path, parent, file_id, media):
+        """
+        Return the request uploading file_path: a new version of the
+        drive file file_id if given, else a new file in parent.
+        """
+        if file_id:
+            return self.authToken.service.files().update(fileId=file_id,
+                                                         body={'title': self.PathLeaf(file_path)},
+                                                         media_body=media,
+                                                         fields=','.join(FILE_FIELDS))
+
+        body = {'title': self.PathLeaf(file_path),
+                "parents": [{"kind": "drive#fileLink", "id": parent}]}
+        return self.authToken.service.files().insert(body=body, media_body=media,
+                                                     fields=','.join(FILE_FIELDS))
+
+    def UploadStatus(self, http, uri, size):
+        """
+        Ask the server how much of the upload session at uri it has.
+        Returns (bytes received, None), or (size, the uploaded file) if
+        the upload is complete.
+        """
+        resp, content = http.request(uri, method='PUT',
+                                     headers={'Content-Length': '0',
+                                              'Content-Range': 'bytes */%d' % size})
+        if resp.status in [200, 201]:
+            return size, json.loads(content)
+        if resp.status != 308:
+            raise HttpError(resp, content, uri=uri)
+        if 'range' in resp:
+            return int(resp['range'].split('-')[1]) + 1, None
+        return 0, None
+
+    def ResumableUpload(self, http, file_path, parent, file_id=None):
+        """
+        Upload file_path in chunks. The session URI is saved in the
+        metadata store as soon as the server hands it out, so that an
+        upload interrupted by a network error or a restart continues from
+        the last byte the server has instead of starting over.
+        """
+        drivepath = file_path.split(self.mirror_directory+'/')[1]
+        st = os.stat(file_path)
+        media = MediaFileUpload(file_path, chunksize=self.upload_chunk_size, resumable=True)
+        request = self.NewUploadRequest(file_path, parent, file_id, media)
+
+        session = self.metaStore.GetUpload(drivepath)
+        response = None
+        saved = False
+        try:
+            if session and session[1] and session[2] == st.st_size and session[3] == st.st_mtime:
+                self.logger.info("Resuming upload of %s\n" % drivepath)
+                # next_chunk() sends the file from resumable_progress on.
+                progress, response = self.apiLimiter.Call(self.UploadStatus, http, session[1],
+                                                          st.st_size)
+                request.resumable_uri = session[1]
+                request.resumable_progress = progress
+                saved = True
+
+            while response is None:
+                # A failed chunk leaves the request in error state, so the
+                # limiter's retry asks the server where to continue from.
+                status, response = self.apiLimiter.Call(request.next_chunk, http=http)
+                if not saved and request.resumable_uri:
+                    self.metaStore.PutUpload(drivepath, parent, request.resumable_uri, st)
+                    saved = True
+        except HttpError as error:
+            if error.resp.status in [404, 410]:
+                # The session expired. Start a new one.
+                self.logger.info("Upload session of %s expired\n" % drivepath)
+                self.metaStore.RemoveUpload(drivepath)
+                media.stream().close()
+                return self.ResumableUpload(http, file_path, parent, file_id)
+            raise
+        finally:
+            media.stream().close()
+
+        self.metaStore.RemoveUpload(drivepath)
+        return response
+
+    def UploadWorker(self, http, file_path, parent, file_id=None):
+        with self.pathLocks.Lock(file_path.split(self.mirror_directory+'/')[1]):
+            return self.UploadLockedFile(http, file_path, parent, file_id)
+
+    def RemoteFileAt(self, drivepath):
+        """
+        Return the regular file the drive has at drivepath according to
+        the index, or None.
+        """
+        f = self.metaStore.FindPath(drivepath)
+        if f is None or f['mimeType'] == 'application/vnd.google-apps.folder' or self.IsGoogleDocument(f):
+            return None
+        return f
+
+    @Timed('upload')
+    def UploadLockedFile(self, http, file_path, parent, file_id=None):
+        drivepath = file_path.split(self.mirror_directory+'/')[1]
+        if not os.path.isfile(file_path):
+            self.logger.debug("UploadWorker: %s is gone. Skipping.\n" % file_path)
+            self.metaStore.RemoveUpload(drivepath)
+            return True
 
-    def CreateRegularFile(self, file_path, parent='root', uploaded=False):
+        # What is uploaded is only in sync if the file doesn't change
+        # before the upload is done.
+        st = os.stat(file_path)
+
+        # A file already on the drive gets a new version, also when it
+        # was uploaded by an earlier job after this one was queued.
+        if file_id is None:
+            f = self.RemoteFileAt(drivepath)
+            if f is not None:
+                if f.get('md5Checksum', None) == self.HashOfFile(file_path):
+                    self.logger.debug("UploadWorker: %s is already on drive. Skipping.\n" % file_path)
+                    self.metaStore.RemoveUpload(drivepath)
+                    self.RecordLocalFile(file_path, f, st)
+                    return True
+                file_id = f['id']
+
+        size = st.st_size
+        if size >= self.resumable_upload_threshold:
+            upfile = self.ResumableUpload(http, file_path, parent, file_id)
+        else:
+            media = MediaFileUpload(file_path, resumable=False)
+            try:
+                upfile = self.ApiCall(self.NewUploadRequest(file_path, parent, file_id, media), http)
+            finally:
+                media.stream().close()
+
+        self.metrics.Inc(BYTES, size, direction='upload')
+        self.metaStore.AddFile(upfile)
+        self.updates_done = 1
+        self.RecordLocalFile(file_path, upfile, st)
+        self.pathCache.Invalidate(drivepath)
+        self.logger.info("Uploaded %s\n" % file_path)
+        return True
+
+    def ResumePendingUploads(self):
+        for drivepath, parent in self.metaStore.GetUploads():
+            self.uploadPool.Submit(self.UploadWorker,
+                                   os.path.join(self.mirror_directory, drivepath), parent)
+
+    def CreateRegularFile(self, file_path, parent='root', file_id=None):
         self.logger.debug("Create file %s\n" % file_path)
-        filename = self.PathLeaf(file_path)
-        upfile = self.drive.CreateFile({'title': filename,
-                                       "parents": [{"kind": "drive#fileLink", "id": parent}]})
-        upfile.SetContentFile(file_path)
-        upfile.Upload()
+        self.uploadPool.Submit(self.UploadWorker, file_path, parent, file_id)
 
     def UploadFile(self, file_path):
         if os.path.isfile(file_path):
@@ -378,25 +804,26 @@ class GoSyncModel(object):
             try:
                 f = self.LocateFileOnDrive(drivepath)
                 self.logger.debug('Found file %s on remote (dpath: %s)\n' % (f['title'], drivepath))
-                newfile = False
+                file_id = f['id']
                 self.logger.debug('Checking if they are same... ')
-                if f['md5Checksum'] == self.HashOfFile(file_path):
+                if f.get('md5Checksum', None) == self.HashOfFile(file_path):
                     self.logger.debug('yes\n')
                     return
                 else:
                     self.logger.debug('no\n')
             except (FileNotFound, FolderNotFound):
                 self.logger.debug("A new file!\n")
-                newfile = True
+                file_id = None
 
+            self.pathCache.Invalidate(drivepath)
             dirpath = os.path.dirname(drivepath)
             if dirpath == '':
                 self.logger.debug('Creating %s file in root\n' % file_path)
-                self.CreateRegularFile(file_path, 'root', newfile)
+                self.CreateRegularFile(file_path, 'root', file_id)
             else:
                 try:
                     f = self.LocateFolderOnDrive(dirpath)
-                    self.CreateRegularFile(file_path, f['id'], newfile)
+                    self.CreateRegularFile(file_path, f['id'], file_id)
                 except FolderNotFound:
                     # We are coming from premise that upload comes as part
                     # of observer. So before notification of this file's
@@ -408,17 +835,48 @@ class GoSyncModel(object):
         else:
             self.CreateDirectoryByPath(file_path)
 
+    def LocalInSync(self, drive_path):
+        """
+        Return true if the local file at drive_path is still the one
+        recorded in sync with the drive: same inode, size and mtime, and
+        the content of its base entry.
+        """
+        local = self.metaStore.GetLocal(drive_path)
+        base = self.metaStore.GetBaseEntry(drive_path)
+        if not local or not base or local[3] is None or local[3] != base[1]:
+            return False
+
+        try:
+            st = os.stat(os.path.join(self.mirror_directory, drive_path))
+        except OSError:
+            return False
+        return local[0] == st.st_ino and local[1] == st.st_mtime and local[2] == st.st_size
+
     def UploadObservedFile(self, file_path):
-        self.sync_lock.acquire()
-        self.UploadFile(file_path)
-        self.sync_lock.release()
+        drive_path = file_path.split(self.mirror_directory+'/')[1]
+        # Files are locked by the upload worker. Holding the lock here
+        # while queueing the upload could keep the queue from draining.
+        if os.path.isdir(file_path):
+            with self.pathLocks.Lock(drive_path):
+                self.UploadFile(file_path)
+        else:
+            # Files written by the sync itself come back from the observer
+            # too. The lock waits for the download to be recorded.
+            with self.pathLocks.Lock(drive_path):
+                if self.LocalInSync(drive_path):
+                    self.logger.debug("UploadObservedFile: %s is in sync. Skipping.\n" % file_path)
+                    return
+            self.UploadFile(file_path)
 
     def RenameFile(self, file_object, new_title):
         try:
             file = {'title': new_title}
 
-            updated_file = self.authToken.service.files().patch(fileId=file_object['id'],
-                                                                body=file, fields='title').execute()
+            with self.metrics.Time('rename'):
+                updated_file = self.ApiCall(self.authToken.service.files().patch(fileId=file_object['id'],
+                                                                                 body=file,
+                                                                                 fields=','.join(FILE_FIELDS)))
+            self.metaStore.AddFile(updated_file)
             return updated_file
         except errors.HttpError, error:
             self.logger.error('An error occurred while renaming file: %s' % error)
@@ -428,184 +886,365 @@ class GoSyncModel(object):
             return None
 
     def RenameObservedFile(self, file_path, new_name):
-        self.sync_lock.acquire()
+        """
+        Rename the drive file of file_path to new_name. Returns false if
+        it could not be renamed.
+        """
         drive_path = file_path.split(self.mirror_directory+'/')[1]
         self.logger.debug("RenameObservedFile: Rename %s to new name %s\n"
                           % (file_path, new_name))
-        try:
-            ftd = self.LocateFileOnDrive(drive_path)
+        with self.pathLocks.Lock(drive_path, os.path.join(os.path.dirname(drive_path), new_name)):
+            try:
+                ftd = self.LocateFileOnDrive(drive_path)
+            except (FileNotFound, FolderNotFound, FileListQueryFailed):
+                self.logger.error("RenameObservedFile: Could not locate %s on drive.\n" % drive_path)
+                return False
+
             nftd = self.RenameFile(ftd, new_name)
+            self.pathCache.Invalidate(drive_path)
             if not nftd:
                 self.logger.error("File rename failed\n")
-        except:
-            self.logger.exception("Could not locate file on drive.\n")
-
-        self.sync_lock.release()
+                return False
+            return True
 
     def TrashFile(self, file_object):
         try:
-            self.authToken.service.files().trash(fileId=file_object['id']).execute()
+            with self.metrics.Time('trash'):
+                self.ApiCall(self.authToken.service.files().trash(fileId=file_object['id']))
             self.logger.info({"TRASH_FILE: File %s deleted successfully.\n" % file_object['title']})
         except errors.HttpError, error:
             self.logger.error("TRASH_FILE: HTTP Error\n")
             raise RegularFileTrashFailed()
 
     def TrashObservedFile(self, file_path):
-        self.sync_lock.acquire()
         drive_path = file_path.split(self.mirror_directory+'/')[1]
         self.logger.debug({"TRASH_FILE: dirpath to delete: %s\n" % drive_path})
-        try:
-            ftd = self.LocateFileOnDrive(drive_path)
+        with self.pathLocks.Lock(drive_path):
             try:
-                self.TrashFile(ftd)
-            except RegularFileTrashFailed:
-                self.logger.error({"TRASH_FILE: Failed to move file %s to trash\n" % drive_path})
-                raise
-            except:
-                raise
-        except (FileNotFound, FileListQueryFailed, FolderNotFound):
-            self.logger.error({"TRASH_FILE: Failed to locate %s file on drive\n" % drive_path})
-            pass
-
-        self.sync_lock.release()
+                ftd = self.LocateFileOnDrive(drive_path)
+                self.pathCache.Invalidate(drive_path)
+                try:
+                    self.TrashFile(ftd)
+                except RegularFileTrashFailed:
+                    self.logger.error({"TRASH_FILE: Failed to move file %s to trash\n" % drive_path})
+                    raise
+                self.metaStore.RemoveFile(ftd['id'])
+                self.metaStore.RemoveLocal(drive_path)
+            except (FileNotFound, FileListQueryFailed, FolderNotFound):
+                self.logger.error({"TRASH_FILE: Failed to locate %s file on drive\n" % drive_path})
 
     def MoveFile(self, src_file, dst_folder='root', src_folder='root'):
-        try:
-            if dst_folder != 'root':
-                did = dst_folder['id']
-            else:
-                did = 'root'
+        if dst_folder != 'root':
+            did = dst_folder['id']
+        else:
+            did = 'root'
 
-            if src_folder != 'root':
-                sid = src_folder['id']
-            else:
-                sid = 'root'
+        if src_folder != 'root':
+            sid = src_folder['id']
+        else:
+            sid = 'root'
 
-            updated_file = self.authToken.service.files().patch(fileId=src_file['id'],
-                                                                body=src_file,
-                                                                addParents=did,
-                                                                removeParents=sid).execute()
-        except:
-            self.logger.exception("move failed\n")
+        try:
+            with self.metrics.Time('move'):
+                updated_file = self.ApiCall(self.authToken.service.files().patch(fileId=src_file['id'],
+                                                                                 body={},
+                                                                                 addParents=did,
+                                                                                 removeParents=sid,
+                                                                                 fields=','.join(FILE_FIELDS)))
+            self.metaStore.AddFile(updated_file)
+            return updated_file
+        except HttpError as error:
+            self.logger.error("An error occurred while moving file: %s\n" % error)
+            return None
 
     def MoveObservedFile(self, src_path, dest_path):
-	from_drive_path = src_path.split(self.mirror_directory+'/')[1]
-	to_drive_path = os.path.dirname(dest_path.split(self.mirror_directory+'/')[1])
+        """
+        Move the drive file of src_path to the folder of dest_path.
+        Returns false if it could not be moved.
+        """
+        from_drive_path = src_path.split(self.mirror_directory+'/')[1]
+        to_drive_path = os.path.dirname(dest_path.split(self.mirror_directory+'/')[1])
 
         self.logger.debug("Moving file %s to %s\n" % (from_drive_path, to_drive_path))
 
-	try:
-	    ftm = self.LocateFileOnDrive(from_drive_path)
+        try:
+            ftm = self.LocateFileOnDrive(from_drive_path)
             self.logger.debug("MoveObservedFile: Found source file on drive\n")
             if os.path.dirname(from_drive_path) == '':
                 sf = 'root'
             else:
                 sf = self.LocateFolderOnDrive(os.path.dirname(from_drive_path))
             self.logger.debug("MoveObservedFile: Found source folder on drive\n")
-            try:
-                if to_drive_path == '':
-                    df = 'root'
-                else:
-                    df = self.LocateFolderOnDrive(to_drive_path)
-                self.logger.debug("MoveObservedFile: Found destination folder on drive\n")
-                try:
-                    self.logger.debug("MovingFile() ")
-                    self.MoveFile(ftm, df, sf)
-                    self.logger.debug("done\n")
-                except (Unkownerror, FileMoveFailed):
-                    self.logger.error("MovedObservedFile: Failed\n")
-                    return
-                except:
-                    self.logger.error("?????\n")
-                    return
-            except FolderNotFound:
-                self.logger.error("MoveObservedFile: Couldn't locate destination folder on drive.\n")
-                return
-            except:
-                self.logger.error("MoveObservedFile: Unknown error while locating destination folder on drive.\n")
-                return
-	except FileNotFound:
+        except (FileNotFound, FolderNotFound):
             self.logger.error("MoveObservedFile: Couldn't locate file on drive.\n")
-            return
-	except FileListQueryFailed:
-	    self.logger.error("MoveObservedFile: File Query failed. aborting.\n")
-	    return
-	except FolderNotFound:
-	    self.logger.error("MoveObservedFile: Folder not found\n")
-	    return
-	except:
-	    self.logger.error("MoveObservedFile: Unknown error while moving file.\n")
-	    return
+            return False
+        except FileListQueryFailed:
+            self.logger.error("MoveObservedFile: File Query failed. aborting.\n")
+            return False
+
+        try:
+            if to_drive_path == '':
+                df = 'root'
+            else:
+                df = self.LocateFolderOnDrive(to_drive_path)
+            self.logger.debug("MoveObservedFile: Found destination folder on drive\n")
+        except FolderNotFound:
+            self.logger.error("MoveObservedFile: Couldn't locate destination folder on drive.\n")
+            return False
+        except FileListQueryFailed:
+            self.logger.error("MoveObservedFile: File Query failed. aborting.\n")
+            return False
+
+        self.logger.debug("MovingFile() ")
+        self.pathCache.Invalidate(from_drive_path)
+        if self.MoveFile(ftm, df, sf) is None:
+            self.logger.error("MovedObservedFile: Failed\n")
+            return False
+        self.logger.debug("done\n")
+
+        if self.PathLeaf(src_path) != self.PathLeaf(dest_path) and \
+                not self.RenameFile(ftm, self.PathLeaf(dest_path)):
+            self.logger.error("MovedObservedFile: Moved %s but failed to rename it\n" % from_drive_path)
+            return False
+        return True
+
+    def HandleObservedEvent(self, op, path, dest=None):
+        if op == OP_MOVE:
+            self.HandleMovedFile(path, dest)
+        elif op == OP_DELETE:
+            self.TrashObservedFile(path)
+        elif os.path.exists(path):
+            self.UploadObservedFile(path)
+        else:
+            self.logger.debug("HandleObservedEvent: %s is gone. Skipping.\n" % path)
 
     def HandleMovedFile(self, src_path, dest_path):
+        """
+        Carry a local rename or move over to the drive. Returns false if
+        it failed.
+        """
         drive_path1 = os.path.dirname(src_path.split(self.mirror_directory+'/')[1])
-	drive_path2 = os.path.dirname(dest_path.split(self.mirror_directory+'/')[1])
+        drive_path2 = os.path.dirname(dest_path.split(self.mirror_directory+'/')[1])
 
-	if drive_path1 == drive_path2:
+        if drive_path1 == drive_path2:
             self.logger.debug("Rename file\n")
-	    self.RenameObservedFile(src_path, self.PathLeaf(dest_path))
-	else:
+            return self.RenameObservedFile(src_path, self.PathLeaf(dest_path))
+        else:
             self.logger.debug("Move file\n")
-	    self.MoveObservedFile(src_path, dest_path)
+            with self.pathLocks.Lock(src_path.split(self.mirror_directory+'/')[1],
+                                     dest_path.split(self.mirror_directory+'/')[1]):
+                return self.MoveObservedFile(src_path, dest_path)
 
     ####### DOWNLOAD SECTION #######
-    def MakeFileListQuery(self, query):
-        # Retry 5 times to get the query
-        for n in range (0, 5):
+    def QuoteQueryString(self, value):
+        return value.replace('\\', '\\\\').replace("'", "\\'")
+
+    def ProjectQuery(self, query, fields):
+        """
+        Return a copy of query that asks only for the given file fields,
+        with the largest page size the API allows.
+        """
+        pquery = dict(query)
+        pquery['maxResults'] = MAX_LIST_PAGE_SIZE
+        pquery['fields'] = 'nextPageToken,items(%s)' % ','.join(fields)
+        return pquery
+
+    def ApiCall(self, request, http=None):
+        """
+        Execute a Drive API request through the shared rate limiter, on
+        the given HTTP client or else on one checked out of the pool.
+        """
+        if http is not None:
+            return self.apiLimiter.Call(request.execute, http=http)
+
+        with self.httpPool.Client() as http:
+            return self.apiLimiter.Call(request.execute, http=http)
+
+    def MakeFileListQuery(self, query, fields=FILE_FIELDS):
+        file_list = []
+        for page in self.IterateFileListQuery(query, fields):
+            file_list.extend(page)
+        return file_list
+
+    def IterateFileListQuery(self, query, fields=FILE_FIELDS):
+        """
+        Yield the result of query one page at a time. A failed page is
+        retried on its own instead of restarting the whole listing.
+        """
+        query = self.ProjectQuery(query, fields)
+        while True:
             try:
-                return self.drive.ListFile(query).GetList()
-            except HttpError as error:
-                if error.resp.reason in ['userRateLimitExceeded', 'quotaExceeded']:
-                    self.logger.error("user rate limit/quota exceeded. Will try later\n")
-                    time.sleep((2**n) + random.random())
-            except:
-                self.logger.error("MakeFileListQuery: failed with reason %s\n" % error.resp.reason)
-                time.sleep((2**n) + random.random())
+                with self.metrics.Time('list'):
+                    result = self.ApiCall(self.authToken.service.files().list(**query))
+            except Exception:
+                self.logger.exception("IterateFileListQuery: page query failed. Bailing out\n")
+                raise FileListQueryFailed
 
-        self.logger.error("Can't get the connection back after many retries. Bailing out\n")
-        raise FileListQueryFailed
+            yield result.get('items', [])
 
-    def TotalFilesInFolder(self, parent='root'):
+            if not result.get('nextPageToken', None):
+                return
+            query['pageToken'] = result['nextPageToken']
+
+    def BuildDriveIndex(self):
+        """
+        Enumerate every file on the drive in a single paged listing and
+        index it by id and parent.
+        """
+        self.logger.info("Building drive index... ")
+        # The listing also counts the usage, so its progress is reported
+        # as such, against the number of files seen last time.
+        GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_STARTED,
+                                          max(len(self.metaStore), self.totalFilesToCheck))
+        self.metaStore.BeginRebuild()
         file_count = 0
-        try:
-            file_list = self.MakeFileListQuery({'q': "'%s' in parents and trashed=false" % parent})
-            for f in file_list:
-                if f['mimeType'] == 'application/vnd.google-apps.folder':
-                    file_count += self.TotalFilesInFolder(f['id'])
-                    file_count += 1
-                else:
-                    file_count += 1
+        for page in self.IterateFileListQuery({'q': "trashed=false"}):
+            self.metaStore.AddRebuildPage(page)
+            file_count += len(page)
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_UPDATE, file_count)
 
-            return file_count
-        except:
-            raise
+        self.metaStore.FinishRebuild()
+        self.updates_done = 1
+        self.logger.info("done (%d files)\n" % file_count)
 
     def IsGoogleDocument(self, f):
-        if any(f['mimeType'] in s for s in google_docs_mimelist):
-            return True
-        else:
+        """
+        Return true if the file f has no content to download: anything
+        of a Google type, or without a checksum.
+        """
+        return f['mimeType'].startswith(GOOGLE_APPS_MIMETYPE_PREFIX) or 'md5Checksum' not in f
+
+    def SameStat(self, st1, st2):
+        return st1.st_ino == st2.st_ino and st1.st_mtime == st2.st_mtime and \
+            st1.st_size == st2.st_size
+
+    def RecordLocalFile(self, abs_filepath, file_obj, st=None):
+        """
+        Record that the local file at abs_filepath is in sync with
+        file_obj on the drive. st is the stat of the file taken before
+        its content was read. If the file changed since, only the drive
+        side is recorded and the file is queued to be uploaded again.
+        """
+        try:
+            drivepath = abs_filepath.split(self.mirror_directory+'/')[1]
+            md5 = file_obj.get('md5Checksum', None)
+            self.metaStore.PutBase(drivepath, file_obj['id'], md5)
+            now = os.stat(abs_filepath)
+            if st is not None and not self.SameStat(st, now):
+                self.logger.info("%s changed while it was uploaded. Uploading it again.\n" % abs_filepath)
+                self.observerQueue.Put(OP_MODIFY, abs_filepath)
+                return
+            self.metaStore.PutLocal(drivepath, now, md5)
+        except:
+            self.logger.exception("Failed to record local file %s\n" % abs_filepath)
+
+    def NewHttpClient(self):
+        """
+        Return a new HTTP client authorized with our credentials. httplib2
+        clients are not thread safe, so each thread needs its own.
+        """
+        return self.authToken.credentials.authorize(httplib2.Http())
+
+    def DownloadChunk(self, http, uri, first, last):
+        """
+        Return bytes first to last (inclusive) of the media at uri.
+        """
+        resp, content = http.request(uri, headers={'range': 'bytes=%d-%d' % (first, last)})
+        if resp.status == 200:
+            # The whole file, the range was ignored.
+            return content[first:last + 1]
+        if resp.status != 206:
+            raise HttpError(resp, content, uri=uri)
+        return content
+
+    @Timed('download')
+    def DownloadFileContent(self, http, file_obj, abs_filepath):
+        """
+        Download into a partial file next to abs_filepath and rename it
+        into place once its checksum is verified. A partial file left by
+        an earlier attempt of the same remote content is continued with a
+        Range request from its last byte. Partial files of older versions
+        are removed by the mirror scan.
+        """
+        dirname, title = os.path.split(abs_filepath)
+        part_path = os.path.join(dirname, '.%s.%s%s' % (title, file_obj['md5Checksum'],
+                                                        PARTIAL_DOWNLOAD_SUFFIX))
+
+        size = long(file_obj.get('fileSize', 0))
+        offset = 0
+        if os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            if offset > size:
+                os.remove(part_path)
+                offset = 0
+            elif offset:
+                self.logger.info("Resuming download of %s at byte %d\n" % (abs_filepath, offset))
+
+        if size == 0:
+            open(part_path, "wb").close()
+        elif offset < size:
+            uri = self.authToken.service.files().get_media(fileId=file_obj['id']).uri
+            start = offset
+            with open(part_path, "ab") as fd:
+                while offset < size:
+                    # Every chunk is asked for by range from the end of the
+                    # partial file, so the limiter's retry of a failed
+                    # chunk asks for the same range again.
+                    chunk = self.apiLimiter.Call(self.DownloadChunk, http, uri, offset,
+                                                 min(offset + DOWNLOAD_CHUNK_SIZE, size) - 1)
+                    if not chunk:
+                        break
+                    fd.write(chunk)
+                    offset += len(chunk)
+            self.metrics.Inc(BYTES, offset - start, direction='download')
+
+        if self.ChecksumOfFile(part_path) != file_obj['md5Checksum']:
+            os.remove(part_path)
+            self.logger.error("Checksum of downloaded %s doesn't match. Discarding.\n" % abs_filepath)
+            raise DownloadVerificationFailed()
+
+        os.rename(part_path, abs_filepath)
+
+    def DownloadWorker(self, http, file_obj, abs_filepath, action):
+        if not self.syncRunning.is_set():
+            self.logger.debug("DownloadWorker: Sync has been paused. Skipping %s\n" % abs_filepath)
             return False
 
-    def TotalFilesInDrive(self):
-        return self.TotalFilesInFolder()
+        fd = abs_filepath.split(self.mirror_directory+'/')[1]
+        with self.pathLocks.Lock(fd):
+            if self.metaStore.GetPath(file_obj['id']) != fd:
+                self.logger.debug("DownloadWorker: %s moved or removed on drive. Skipping.\n" % fd)
+                return True
 
-    def DownloadFileByObject(self, file_obj, download_path):
-        dfile = self.drive.CreateFile({'id': file_obj['id']})
+            self.logger.info('%s %s\n' % (action, abs_filepath))
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_UPDATE,
+                                              {'%s %s' % (action, fd)})
+            try:
+                self.DownloadFileContent(http, file_obj, abs_filepath)
+            except HttpError as e:
+                if ClassifyError(e) is not None or e.resp.status not in PERMANENT_DOWNLOAD_ERRORS:
+                    raise
+                self.ReportError('Download Failed', "Drive refused to download %s (%d). Skipping.\n"
+                                 % (fd, e.resp.status))
+                return True
+            self.RecordLocalFile(abs_filepath, file_obj)
+        self.updates_done = 1
+        self.logger.info('Done (%s)\n' % fd)
+        return True
+
+    def DownloadFileByObject(self, file_obj, download_path, overwrite=False):
         abs_filepath = os.path.join(download_path, file_obj['title'])
         if os.path.exists(abs_filepath):
             if self.HashOfFile(abs_filepath) == file_obj['md5Checksum']:
                 self.logger.debug('%s file is same as local. not downloading\n' % abs_filepath)
+                self.RecordLocalFile(abs_filepath, file_obj)
                 return
-            else:
+            elif not overwrite:
                 self.logger.debug("DownloadFileByObject: Local and remote file with same name but different content. Skipping. (local file: %s)\n" % abs_filepath)
+            else:
+                self.downloadPool.Submit(self.DownloadWorker, file_obj, abs_filepath, 'Updating')
         else:
-            self.logger.info('Downloading %s ' % abs_filepath)
-            fd = abs_filepath.split(self.mirror_directory+'/')[1]
-            GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_UPDATE,
-                                              {'Downloading %s' % fd})
-            dfile.GetContentFile(abs_filepath)
-            self.updates_done = 1
-            self.logger.info('Done\n')
+            self.downloadPool.Submit(self.DownloadWorker, file_obj, abs_filepath, 'Downloading')
 
     def SyncRemoteDirectory(self, parent, pwd, recursive=True):
         if not self.syncRunning.is_set():
@@ -616,7 +1255,7 @@ class GoSyncModel(object):
             os.makedirs(os.path.join(self.mirror_directory, pwd))
 
         try:
-            file_list = self.MakeFileListQuery({'q': "'%s' in parents and trashed=false" % parent})
+            file_list = self.metaStore.GetChildren(parent)
             for f in file_list:
                 if not self.syncRunning.is_set():
                     self.logger.debug("SyncRemoteDirectory: Sync has been paused. Aborting.\n")
@@ -632,6 +1271,7 @@ class GoSyncModel(object):
                         self.logger.debug("creating directory %s " % abs_dirpath)
                         os.makedirs(abs_dirpath)
                         self.logger.debug("done\n")
+                    self.metaStore.PutBase(os.path.join(pwd, f['title']), f['id'])
                     self.logger.debug('syncing directory %s\n' % f['title'])
                     self.SyncRemoteDirectory(f['id'], os.path.join(pwd, f['title']))
                     if not self.syncRunning.is_set():
@@ -647,40 +1287,420 @@ class GoSyncModel(object):
             self.logger.error("Failed to sync directory\n")
             raise
 
-    def SyncLocalDirectory(self):
-        for root, dirs, files in os.walk(self.mirror_directory):
-            for names in files:
-                try:
-                    dirpath = os.path.join(root, names)
-                    drivepath = dirpath.split(self.mirror_directory+'/')[1]
-                    f = self.LocateFileOnDrive(drivepath)
-                except FileListQueryFailed:
-                    # if the file list query failed, we can't delete the local file even if
-                    # its gone in remote drive. Let the next sync come and take care of this
-                    # Log the event though
-                    self.logger.info("File check on remote directory has failed. Aborting local sync.\n")
+    ####### CHANGES FEED SECTION #######
+    def GetStartPageToken(self):
+        """
+        Return the token from which the changes feed will report every
+        change made after this call.
+        """
+        return self.ApiCall(self.authToken.service.changes().getStartPageToken())['startPageToken']
+
+    def SaveChangeToken(self, token):
+        self.change_token = token
+        if token:
+            self.config_dict['Change Token'] = token
+        elif 'Change Token' in self.config_dict:
+            del self.config_dict['Change Token']
+        self.SaveConfig()
+
+    def IsPathSelected(self, drive_path, is_folder=False):
+        """
+        Return true if drive_path (relative to the mirror) falls inside
+        the folders chosen for syncing. Files in root are always synced.
+        """
+        if not is_folder and os.path.dirname(drive_path) == '':
+            return True
+
+        for d in self.sync_selection:
+            if d[0] == 'root':
+                return True
+            if drive_path == d[0] or drive_path.startswith(d[0] + os.sep):
+                return True
+
+        return False
+
+    def LocalChanged(self, drive_path):
+        """
+        Return true if the local file at drive_path has changes the drive
+        hasn't got: it was never in sync, or its content differs from
+        what was in sync last time.
+        """
+        base = self.metaStore.GetBaseEntry(drive_path)
+        if base is None:
+            return True
+        try:
+            return self.HashOfFile(os.path.join(self.mirror_directory, drive_path)) != base[1]
+        except OSError:
+            return False
+
+    def UploadAgain(self, abs_paths, top):
+        """
+        Queue the local files in abs_paths for upload, with the folders
+        between top and them, parents first.
+        """
+        folders = set()
+        for abs_path in abs_paths:
+            folder = os.path.dirname(abs_path)
+            while folder == top or folder.startswith(top + '/'):
+                folders.add(folder)
+                folder = os.path.dirname(folder)
+
+        for folder in sorted(folders, key=lambda p: p.count('/')):
+            self.observerQueue.Put(OP_CREATE, folder)
+        for abs_path in abs_paths:
+            self.logger.info("%s was removed from drive but changed locally. Uploading it again.\n" % abs_path)
+            self.observerQueue.Put(OP_CREATE, abs_path)
+
+    def RemoveLocalPath(self, drive_path):
+        """
+        Remove what was removed from the drive from the mirror. Local
+        files changed since they were last in sync are kept and uploaded
+        again, along with the folders holding them.
+        """
+        abs_path = os.path.join(self.mirror_directory, drive_path)
+        kept = []
+        with self.pathLocks.Lock(drive_path):
+            if os.path.isdir(abs_path):
+                self.logger.info("%s folder has been removed from drive. Deleting local copy\n" % abs_path)
+                for root, dirs, files in os.walk(abs_path, topdown=False):
+                    for name in files:
+                        path = os.path.join(root, name)
+                        if not name.endswith(PARTIAL_DOWNLOAD_SUFFIX) and \
+                                self.LocalChanged(path.split(self.mirror_directory+'/')[1]):
+                            kept.append(path)
+                        else:
+                            os.remove(path)
+                    if not os.listdir(root):
+                        os.rmdir(root)
+                self.updates_done = 1
+            elif os.path.isfile(abs_path):
+                if self.LocalChanged(drive_path):
+                    kept.append(abs_path)
+                else:
+                    self.logger.info("%s has been removed from drive. Deleting local copy\n" % abs_path)
+                    os.remove(abs_path)
+                self.updates_done = 1
+            self.metaStore.RemoveLocal(drive_path)
+
+        if kept:
+            self.UploadAgain(kept, abs_path)
+
+    def KeepConflictCopy(self, drive_path, move=False):
+        """
+        Copy the local file at drive_path to a new name next to it before
+        the drive's version replaces it. The copy is uploaded as a new
+        file. With move, the file or folder is renamed instead, for when
+        the drive has the other kind of item at drive_path.
+        """
+        abs_path = os.path.join(self.mirror_directory, drive_path)
+        root, ext = os.path.splitext(abs_path)
+        if os.path.isdir(abs_path):
+            root, ext = abs_path, ''
+        copy_path = "%s (conflicted copy %s)%s" % (root, time.strftime('%Y-%m-%d %H%M%S'), ext)
+        if move:
+            os.rename(abs_path, copy_path)
+        else:
+            shutil.copy2(abs_path, copy_path)
+        self.logger.info("%s changed both locally and on drive. Local version kept as %s\n"
+                         % (abs_path, copy_path))
+        self.observerQueue.Put(OP_CREATE, copy_path)
+        if os.path.isdir(copy_path):
+            for dirpath, dirnames, filenames in os.walk(copy_path):
+                for name in dirnames + filenames:
+                    self.observerQueue.Put(OP_CREATE, os.path.join(dirpath, name))
+
+    def ApplyRemoteChange(self, change):
+        file_id = change['fileId']
+        old_path = self.metaStore.GetPath(file_id)
+        f = change.get('file', None)
+
+        self.updates_done = 1
+        self.remoteChanges += 1
+        self.pathCache.InvalidateId(file_id)
+        if old_path is not None:
+            self.pathCache.Invalidate(old_path)
+
+        if change.get('deleted', False) or not f or f['labels']['trashed']:
+            # Forgotten first, so that local changes uploaded again don't
+            # find it in the index.
+            self.metaStore.RemoveFile(file_id)
+            if old_path is not None and self.IsPathSelected(old_path):
+                self.RemoveLocalPath(old_path)
+            return
+
+        self.metaStore.AddFile(f)
+        new_path = self.metaStore.GetPath(file_id)
+        if new_path is None:
+            # Moved under a folder that is not in My Drive (or one we
+            # never saw). As far as the mirror is concerned, it is gone.
+            if old_path is not None and self.IsPathSelected(old_path):
+                self.RemoveLocalPath(old_path)
+            return
+
+        is_folder = f['mimeType'] == 'application/vnd.google-apps.folder'
+
+        if old_path is not None and old_path != new_path:
+            self.logger.info("Remote moved %s to %s\n" % (old_path, new_path))
+            abs_old = os.path.join(self.mirror_directory, old_path)
+            abs_new = os.path.join(self.mirror_directory, new_path)
+            with self.pathLocks.Lock(old_path, new_path):
+                if self.IsPathSelected(old_path) and self.IsPathSelected(new_path) and \
+                        os.path.exists(abs_old) and not os.path.exists(abs_new):
+                    if not os.path.exists(os.path.dirname(abs_new)):
+                        os.makedirs(os.path.dirname(abs_new))
+                    os.rename(abs_old, abs_new)
+                    self.metaStore.MoveLocal(old_path, new_path)
+                elif self.IsPathSelected(old_path):
+                    self.RemoveLocalPath(old_path)
+
+        newly_visible = old_path is None or not self.IsPathSelected(old_path, is_folder)
+
+        if not self.IsPathSelected(new_path, is_folder):
+            return
+
+        abs_path = os.path.join(self.mirror_directory, new_path)
+        if is_folder:
+            if not os.path.exists(abs_path):
+                os.makedirs(abs_path)
+            self.metaStore.PutBase(new_path, file_id)
+            if newly_visible:
+                # A folder that comes into view brings its whole subtree,
+                # which the changes feed won't report on its own.
+                self.SyncRemoteDirectory(file_id, new_path)
+        elif not self.IsGoogleDocument(f):
+            download_path = os.path.dirname(abs_path)
+            if not os.path.exists(download_path):
+                os.makedirs(download_path)
+            if os.path.isfile(abs_path) and self.LocalChanged(new_path) and \
+                    self.HashOfFile(abs_path) != f.get('md5Checksum', None):
+                base = self.metaStore.GetBaseEntry(new_path)
+                if base is not None and base[1] == f.get('md5Checksum', None):
+                    # Only renamed or moved on the drive. The local
+                    # changes still have to be uploaded.
+                    self.observerQueue.Put(OP_MODIFY, abs_path)
                     return
-                except:
-                    if os.path.exists(dirpath) and os.path.isfile(dirpath):
-                        self.logger.info("%s has been removed from drive. Deleting local copy\n" % dirpath)
-                        os.remove(dirpath)
+                self.KeepConflictCopy(new_path)
+            self.DownloadFileByObject(f, download_path, overwrite=True)
+
+    def SyncRemoteChanges(self):
+        """
+        Apply everything reported by the changes feed since the saved
+        start page token to the local mirror. Returns False if the sync
+        got paused midway, in which case the token is not advanced.
+        """
+        page_token = self.change_token
+        while page_token:
+            if not self.syncRunning.is_set():
+                self.logger.debug("SyncRemoteChanges: Sync has been paused. Aborting.\n")
+                self.downloadPool.Wait()
+                return False
+
+            try:
+                result = self.ApiCall(self.authToken.service.changes().list(pageToken=page_token,
+                                                                            includeDeleted=True,
+                                                                            maxResults=MAX_LIST_PAGE_SIZE,
+                                                                            fields=CHANGE_FIELDS))
+            except HttpError as error:
+                if error.resp.status in [400, 404, 410]:
+                    self.logger.error("SyncRemoteChanges: change token rejected (%d)\n" % error.resp.status)
+                    raise ChangeTokenInvalid()
+                raise
+
+            for change in result.get('items', []):
+                self.ApplyRemoteChange(change)
 
-            for names in dirs:
+            if 'newStartPageToken' in result:
+                if self.downloadPool.Wait():
+                    # Replay the same changes next time to retry them.
+                    self.logger.error("SyncRemoteChanges: some downloads failed. Not advancing the change token.\n")
+                    return False
+                self.SaveChangeToken(result['newStartPageToken'])
+                return True
+
+            page_token = result.get('nextPageToken', None)
+
+        raise ChangeTokenInvalid()
+
+    def SyncRemoteFull(self):
+        """
+        Crawl the selected folders completely. The start page token is
+        taken before the crawl so that nothing changed during it is lost.
+        """
+        token = self.GetStartPageToken()
+        self.BuildDriveIndex()
+
+        self.logger.info("Reconciling mirror... ")
+        self.ReconcileMirror()
+        self.logger.info("done\n")
+
+        failed = self.downloadPool.Wait()
+        if not self.syncRunning.is_set():
+            return False
+
+        if failed:
+            self.logger.error("SyncRemoteFull: %d downloads failed\n" % failed)
+            return False
+
+        self.SaveChangeToken(token)
+        return True
+
+    ####### RECONCILIATION SECTION #######
+    def PathAncestors(self, path):
+        path = os.path.dirname(path)
+        while path:
+            yield path
+            path = os.path.dirname(path)
+
+    def ScanMirror(self, skip):
+        """
+        Return {path: is_folder} for everything selected in the mirror,
+        leaving out the paths in skip and what is below them.
+        """
+        local = {}
+        for root, dirs, files in os.walk(self.mirror_directory):
+            reldir = os.path.relpath(root, self.mirror_directory)
+            if reldir == '.':
+                reldir = ''
+
+            for name in list(dirs):
+                path = os.path.join(reldir, name)
+                if path in skip:
+                    dirs.remove(name)
+                elif self.IsPathSelected(path, True):
+                    local[path] = True
+
+            for name in files:
+                path = os.path.join(reldir, name)
+                if name.endswith(PARTIAL_DOWNLOAD_SUFFIX):
+                    self.RemoveStalePartial(reldir, name)
+                    continue
+                if path in skip:
+                    continue
+                if self.IsPathSelected(path):
+                    local[path] = False
+
+        return local
+
+    def RemoveStalePartial(self, reldir, name):
+        """
+        Remove the partial download name in reldir unless it is of the
+        content the drive has now, in which case it can be resumed.
+        """
+        try:
+            title, md5 = name[1:-len(PARTIAL_DOWNLOAD_SUFFIX)].rsplit('.', 1)
+        except ValueError:
+            title, md5 = name, None
+
+        path = os.path.join(reldir, title)
+        with self.pathLocks.Lock(path):
+            f = self.metaStore.FindPath(path)
+            if f is None or f.get('md5Checksum', None) != md5:
                 try:
-                    dirpath = os.path.join(root, names)
-                    drivepath = dirpath.split(self.mirror_directory+'/')[1]
-                    f = self.LocateFileOnDrive(drivepath)
-                except FileListQueryFailed:
-                    # if the file list query failed, we can't delete the local file even if
-                    # its gone in remote drive. Let the next sync come and take care of this
-                    # Log the event though
-                    self.logger.info("Folder check on remote directory has failed. Aborting local sync.\n")
-                    return
-                except:
-                    if os.path.exists(dirpath) and os.path.isdir(dirpath):
-                        self.logger.info("%s folder has been removed from drive. Deleting local copy\n" % dirpath)
-                        os.remove(dirpath)
+                    os.remove(os.path.join(self.mirror_directory, reldir, name))
+                except OSError:
+                    pass
+
+    def ReconcileMirror(self):
+        """
+        Bring the mirror and the drive in sync by comparing the mirror,
+        the metadata store and the base entries. Working out what to do
+        costs no API calls. Paths with observed events still pending are
+        left to the observer.
+        """
+        skip = set(p.split(self.mirror_directory+'/')[1]
+                   for p in self.observerQueue.PendingPaths()
+                   if p.startswith(self.mirror_directory+'/'))
+
+        def Skipped(path):
+            return path in skip or any(p in skip for p in self.PathAncestors(path))
+
+        self.lastReconcile = time.time()
+        local = self.ScanMirror(skip)
+
+        remote = {}
+        for f, path in self.metaStore.Walk():
+            is_folder = f['mimeType'] == 'application/vnd.google-apps.folder'
+            if not self.IsPathSelected(path, is_folder) or Skipped(path):
+                continue
+            if is_folder or not self.IsGoogleDocument(f):
+                remote[path] = f
+
+        base = dict((path, b) for path, b in self.metaStore.GetBase().iteritems()
+                    if not Skipped(path))
+
+        plan = Reconciler(local, remote, base,
+                          lambda path: self.HashOfFile(os.path.join(self.mirror_directory, path))).Plan()
+        self.logger.info("ReconcileMirror: %d actions\n" % len(plan))
 
+        for action, path, arg in plan:
+            if not self.syncRunning.is_set():
+                self.logger.debug("ReconcileMirror: Sync has been paused. Aborting.\n")
+                return
+
+            try:
+                self.ApplyReconcileAction(action, path, arg)
+            except:
+                self.logger.exception("ReconcileMirror: %s of %s failed\n" % (action, path))
+
+    def ApplyReconcileAction(self, action, path, arg):
+        abs_path = os.path.join(self.mirror_directory, path)
+
+        if action == ACT_MOVE_LOCAL:
+            abs_new = os.path.join(self.mirror_directory, arg)
+            self.logger.info("Remote moved %s to %s\n" % (path, arg))
+            with self.pathLocks.Lock(path, arg):
+                if not os.path.exists(os.path.dirname(abs_new)):
+                    os.makedirs(os.path.dirname(abs_new))
+                os.rename(abs_path, abs_new)
+                self.metaStore.MoveLocal(path, arg)
+        elif action == ACT_MOVE_REMOTE:
+            self.logger.info("Local moved %s to %s\n" % (path, arg))
+            if self.HandleMovedFile(abs_path, os.path.join(self.mirror_directory, arg)):
+                self.metaStore.MoveLocal(path, arg)
+            else:
+                self.logger.error("ReconcileMirror: could not move %s to %s on drive\n" % (path, arg))
+        elif action == ACT_MKDIR_LOCAL:
+            if not os.path.exists(abs_path):
+                os.makedirs(abs_path)
+            self.metaStore.PutBase(path, arg['id'])
+        elif action == ACT_MKDIR_REMOTE:
+            folder = self.CreateDirectoryByPath(abs_path)
+            if folder is not None:
+                self.metaStore.PutBase(path, folder['id'])
+        elif action == ACT_DOWNLOAD:
+            download_path = os.path.dirname(abs_path)
+            if not os.path.exists(download_path):
+                os.makedirs(download_path)
+            self.DownloadFileByObject(arg, download_path, overwrite=True)
+        elif action == ACT_UPLOAD:
+            self.UploadFile(abs_path)
+        elif action == ACT_DELETE_LOCAL:
+            self.RemoveLocalPath(path)
+        elif action == ACT_DELETE_REMOTE:
+            self.logger.info("%s has been removed locally. Trashing it on drive\n" % path)
+            self.pathCache.Invalidate(path)
+            self.TrashFile(arg)
+            self.metaStore.RemoveFile(arg['id'])
+            self.updates_done = 1
+            self.metaStore.RemoveLocal(path)
+        elif action == ACT_RECORD:
+            if arg['mimeType'] == 'application/vnd.google-apps.folder':
+                self.metaStore.PutBase(path, arg['id'])
+            else:
+                self.RecordLocalFile(abs_path, arg)
+        elif action == ACT_FORGET:
+            self.metaStore.RemoveLocal(path)
+        elif action == ACT_CONFLICT:
+            # The local version is kept under a new name and the drive's
+            # takes its place, as for conflicts in the changes feed.
+            is_folder = arg['mimeType'] == 'application/vnd.google-apps.folder'
+            self.KeepConflictCopy(path, move=is_folder or os.path.isdir(abs_path))
+            if is_folder:
+                os.makedirs(abs_path)
+                self.metaStore.PutBase(path, arg['id'])
+                self.SyncRemoteDirectory(arg['id'], path)
+            else:
+                self.DownloadFileByObject(arg, os.path.dirname(abs_path), overwrite=True)
 
     def validate_sync_settings(self):
         for d in self.sync_selection:
@@ -698,140 +1718,164 @@ class GoSyncModel(object):
                 if d[1] != '':
                     raise FolderNotFound()
 
+    def SyncPass(self):
+        """
+        Apply the remote changes, or crawl the drive if they can't be
+        had, and compare the mirror with the drive when it is due.
+        Returns True if the drive was crawled.
+        """
+        if self.change_token and self.metaStore.IsComplete():
+            try:
+                self.logger.info("Syncing remote changes... ")
+                synced = self.SyncRemoteChanges()
+                self.logger.info("done\n")
+                if synced and time.time() - self.lastReconcile >= self.reconcile_interval:
+                    self.logger.info("Reconciling mirror... ")
+                    self.ReconcileMirror()
+                    self.logger.info("done\n")
+            except ChangeTokenInvalid:
+                self.SaveChangeToken(None)
+
+        if not self.change_token or not self.metaStore.IsComplete():
+            self.SyncRemoteFull()
+            return True
+        return False
+
     def run(self):
+        self.authReady.wait()
         while True:
             self.syncRunning.wait()
 
-            self.sync_lock.acquire()
-
             try:
                 self.validate_sync_settings()
             except:
+                # Listeners of INV_FOLDER tell the user, so only record it.
+                msg = "Some of the folders to be synced were not found on the drive. Sync paused.\n"
+                self.logger.error(msg)
+                self.recentErrors.append((time.time(), 'Folder Not Found', msg))
                 GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_INV_FOLDER, 0)
                 self.syncRunning.clear()
-                self.sync_lock.release()
                 continue
 
+            seen = self.remoteChanges
+            busy = False
             try:
                 GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_STARTED, None)
-                for d in self.sync_selection:
-                    self.logger.info("Syncing remote (%s)... " % d[0])
-                    if d[0] != 'root':
-                        #Root folder files are always synced
-                        self.SyncRemoteDirectory('root', '', False)
-                        self.SyncRemoteDirectory(d[1], d[0])
-                    else:
-                        self.SyncRemoteDirectory('root', '')
-                    self.logger.info("done\n")
-                self.logger.info("Syncing local...")
-                self.SyncLocalDirectory()
-                self.logger.info("done\n")
+                busy = self.SyncPass()
                 if self.updates_done:
                     self.usageCalculateEvent.set()
+                self.lastSync = (time.time(), True)
+                self.StartupMark('first sync')
                 GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_DONE, 0)
             except:
+                self.logger.exception("run: sync failed\n")
+                self.lastSync = (time.time(), False)
                 GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_DONE, -1)
 
-            self.sync_lock.release()
-
-            time_left = 600
-
-            while (time_left):
-                GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_TIMER,
-                                                  {'Sync starts in %02dm:%02ds' % ((time_left/60), (time_left % 60))})
-                time_left -= 1
-                self.syncRunning.wait()
-                time.sleep(1)
+            next_run = self.scheduler.PassDone(busy or self.remoteChanges != seen)
+            GoSyncEventController().PostEvent(GOSYNC_EVENT_SYNC_TIMER,
+                                              {'Next sync at %s' % time.strftime('%H:%M', time.localtime(next_run))})
+            self.logger.debug("run: next sync in %d seconds\n" % (next_run - time.time()))
+            self.scheduler.Wait()
 
-    def GetFileSize(self, f):
-        try:
-            size = f['fileSize']
-            return long(size)
-        except:
-            self.logger.error("Failed to get size of file %s (mime: %s)\n" % (f['title'], f['mimeType']))
-            return 0
-
-    def calculateUsageOfFolder(self, folder_id):
-        try:
-            file_list = self.MakeFileListQuery({'q': "'%s' in parents and trashed=false" % folder_id})
-            for f in file_list:
-                self.fcount += 1
-                GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_UPDATE, self.fcount)
-                if f['mimeType'] == 'application/vnd.google-apps.folder':
-                    self.driveTree.AddFolder(folder_id, f['id'], f['title'], f)
-                    self.calculateUsageOfFolder(f['id'])
-                else:
-                    if not self.IsGoogleDocument(f):
-                        if any(f['mimeType'] in s for s in audio_file_mimelist):
-                            self.driveAudioUsage += self.GetFileSize(f)
-                        elif  any(f['mimeType'] in s for s in image_file_mimelist):
-                            self.drivePhotoUsage += self.GetFileSize(f)
-                        elif any(f['mimeType'] in s for s in movie_file_mimelist):
-                            self.driveMoviesUsage += self.GetFileSize(f)
-                        elif any(f['mimeType'] in s for s in document_file_mimelist):
-                            self.driveDocumentUsage += self.GetFileSize(f)
-                        else:
-                            self.driveOthersUsage += self.GetFileSize(f)
+    def UpdateUsage(self):
+        """
+        Take the usage per category from the rollup of the drive root the
+        metadata store keeps. Costs two small queries, no crawl.
+        """
+        usage = {'Audio Size': 0, 'Movies Size': 0, 'Document Size': 0,
+                 'Photo Size': 0, 'Others Size': 0}
+        for category, (files, size) in self.metaStore.GetFolderUsage('root').iteritems():
+            if category not in CATEGORIES:
+                # Categories of the user's own only show up per folder.
+                category = 'Others'
+            usage['%s Size' % category] += size
+
+        total_files = self.metaStore.CountFiles()
+        self.totalFilesToCheck = total_files
+        self.driveAudioUsage = usage['Audio Size']
+        self.driveMoviesUsage = usage['Movies Size']
+        self.driveDocumentUsage = usage['Document Size']
+        self.drivePhotoUsage = usage['Photo Size']
+        self.driveOthersUsage = usage['Others Size']
+
+        usage['Total Files'] = total_files
+        usage['Total Size'] = long(self.about_drive['quotaBytesTotal'])
+        self.drive_usage_dict = usage
+        self.config_dict['Drive Usage'] = self.drive_usage_dict
+        self.SaveConfig()
 
-        except:
-            raise
+    def RecalculateUsage(self):
+        """
+        Ask for the usage to be counted again from scratch. Normally it
+        is kept up to date as the drive changes.
+        """
+        self.usageRecount = True
+        self.usageCalculateEvent.set()
 
     def calculateUsage(self):
         while True:
             self.usageCalculateEvent.wait()
             self.usageCalculateEvent.clear()
 
-            self.sync_lock.acquire()
-            if self.drive_usage_dict and not self.updates_done:
+            if not self.metaStore.IsComplete():
+                # The first full sync lists the drive, reporting progress
+                # as it goes, and wakes us up when it is done.
+                continue
+
+            recount = self.usageRecount
+            self.usageRecount = False
+            if self.drive_usage_dict and not self.updates_done and not recount:
                 GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, 0)
-                self.sync_lock.release()
                 continue
 
             self.updates_done = 0
             self.calculatingDriveUsage = True
-            self.driveAudioUsage = 0
-            self.driveMoviesUsage = 0
-            self.driveDocumentUsage = 0
-            self.drivePhotoUsage = 0
-            self.driveOthersUsage = 0
-            self.fcount = 0
             try:
-                self.totalFilesToCheck = self.TotalFilesInDrive()
-                self.logger.info("Total files to check %d\n" % self.totalFilesToCheck)
-                GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_STARTED,
-                                                  self.totalFilesToCheck)
-                try:
-                    self.calculateUsageOfFolder('root')
-                    GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, 0)
-                    self.drive_usage_dict['Total Files'] = self.totalFilesToCheck
-                    self.drive_usage_dict['Total Size'] = long(self.about_drive['quotaBytesTotal'])
-                    self.drive_usage_dict['Audio Size'] = self.driveAudioUsage
-                    self.drive_usage_dict['Movies Size'] = self.driveMoviesUsage
-                    self.drive_usage_dict['Document Size'] = self.driveDocumentUsage
-                    self.drive_usage_dict['Photo Size'] = self.drivePhotoUsage
-                    self.drive_usage_dict['Others Size'] = self.driveOthersUsage
-                    pickle.dump(self.driveTree, open(self.tree_pickle_file, "wb"))
-                    self.config_dict['Drive Usage'] = self.drive_usage_dict
-                    self.SaveConfig()
-                except:
-                    self.driveAudioUsage = 0
-                    self.driveMoviesUsage = 0
-                    self.driveDocumentUsage = 0
-                    self.drivePhotoUsage = 0
-                    self.driveOthersUsage = 0
-                    GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, -1)
+                if recount:
+                    self.metaStore.RecomputeRollups()
+                self.UpdateUsage()
+                driveTree = GoogleDriveTree()
+                driveTree.LoadIndex(self.metaStore)
+                self.PublishDriveTree(driveTree)
+                GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, 0)
             except:
+                self.logger.exception("Failed to calculate drive usage\n")
                 GoSyncEventController().PostEvent(GOSYNC_EVENT_CALCULATE_USAGE_DONE, -1)
-                self.logger.error("Failed to get the total number of files in drive\n")
 
             self.calculatingDriveUsage = False
-            self.sync_lock.release()
+
+    def PublishDriveTree(self, driveTree):
+        """
+        Freeze driveTree and make it the one handed to readers.
+        """
+        self.treeGeneration += 1
+        driveTree.Freeze(self.treeGeneration)
+        self.driveTree = driveTree
+
+    def GetFolderUsage(self, folder_id='root'):
+        """
+        Return {category: (files, bytes)} of everything below folder_id,
+        from the metadata store. No API calls.
+        """
+        return self.metaStore.GetFolderUsage(folder_id)
+
+    def GetAllFolderUsage(self):
+        """
+        Return {folder id: {category: (files, bytes)}} for every folder
+        holding files, in one query.
+        """
+        return self.metaStore.GetAllFolderUsage()
 
     def GetDriveDirectoryTree(self):
-        self.sync_lock.acquire()
-        ref_tree = copy.deepcopy(self.driveTree)
-        self.sync_lock.release()
-        return ref_tree
+        """
+        Return a read-only snapshot of the drive folders. A new snapshot
+        replaces it when the tree changes, the one returned never does.
+        """
+        return self.driveTree
+
+    def GetDriveTreeGeneration(self):
+        return self.driveTree.GetGeneration()
 
     def IsCalculatingDriveUsage(self):
         return self.calculatingDriveUsage
@@ -860,25 +1904,36 @@ class GoSyncModel(object):
     def IsSyncEnabled(self):
         return self.syncRunning.is_set()
 
+    def SyncNow(self):
+        """
+        Start the next remote pass right away instead of at its time.
+        """
+        self.scheduler.Trigger()
+
     def SetSyncSelection(self, folder):
+        # The selection is replaced, never changed in place, so that a
+        # sync pass iterating over it sees a consistent list.
         if folder == 'root':
-            self.sync_selection = [['root', '']]
+            sync_selection = [['root', '']]
         else:
-            for d in self.sync_selection:
-                if d[0] == 'root':
-                    self.sync_selection = []
-            for d in self.sync_selection:
+            sync_selection = [d for d in self.sync_selection if d[0] != 'root']
+            for d in sync_selection:
                 if d[0] == folder.GetPath() and d[1] == folder.GetId():
                     return
-            self.sync_selection.append([folder.GetPath(), folder.GetId()])
+            sync_selection.append([folder.GetPath(), folder.GetId()])
+        self.sync_selection = sync_selection
         self.config_dict['Sync Selection'] = self.sync_selection
-        self.SaveConfig()
+        # The changes feed only covers what was crawled before, so a new
+        # selection needs a full crawl.
+        self.SaveChangeToken(None)
+        self.scheduler.Trigger()
 
     def GetSyncList(self):
-        return copy.deepcopy(self.sync_selection)
+        return tuple((d[0], d[1]) for d in self.sync_selection)
 
 class FileModificationNotifyHandler(PatternMatchingEventHandler):
     patterns = ["*"]
+    ignore_patterns = ["*" + PARTIAL_DOWNLOAD_SUFFIX]
 
     def __init__(self, sync_handler):
         super(FileModificationNotifyHandler, self).__init__()
@@ -886,12 +1941,26 @@ class FileModificationNotifyHandler(PatternMatchingEventHandler):
 
     def on_created(self, evt):
         self.sync_handler.logger.debug("Observer: %s created\n" % evt.src_path)
-        self.sync_handler.UploadObservedFile(evt.src_path)
+        self.sync_handler.observerQueue.Put(OP_CREATE, evt.src_path)
+
+    def on_modified(self, evt):
+        # Directories are reported modified whenever their content
+        # changes, the content itself is reported separately.
+        if evt.is_directory:
+            return
+
+        self.sync_handler.logger.debug("Observer: %s modified\n" % evt.src_path)
+        self.sync_handler.observerQueue.Put(OP_MODIFY, evt.src_path)
 
     def on_moved(self, evt):
-        self.sync_handler.logger.info("Observer: file %s moved to %s: Not supported yet!\n" % (evt.src_path, evt.dest_path))
-        self.sync_handler.HandleMovedFile(evt.src_path, evt.dest_path)
+        if evt.src_path.endswith(PARTIAL_DOWNLOAD_SUFFIX):
+            # A finished download being renamed into place.
+            self.sync_handler.observerQueue.Put(OP_CREATE, evt.dest_path)
+            return
+
+        self.sync_handler.logger.info("Observer: file %s moved to %s\n" % (evt.src_path, evt.dest_path))
+        self.sync_handler.observerQueue.Put(OP_MOVE, evt.src_path, evt.dest_path)
 
     def on_deleted(self, evt):
         self.sync_handler.logger.info("Observer: file %s deleted on drive.\n" % evt.src_path)
-        self.sync_handler.TrashObservedFile(evt.src_path)
+        self.sync_handler.observerQueue.Put(OP_DELETE, evt.src_path)
@@ -0,0 +1,92 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, threading, time
+from collections import OrderedDict
+
+# A bounded cache of drive path -> file object. Entries expire after
+# "ttl" seconds and the least recently used entry is dropped once the
+# cache holds "max_entries". Only positive lookups are cached.
+class PathCache(object):
+    def __init__(self, max_entries=10000, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.id_paths = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def Get(self, path):
+        with self.lock:
+            entry = self.entries.pop(path, None)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry[1] < time.time():
+                self._Forget(path, entry)
+                self.misses += 1
+                return None
+
+            # Re-insert to mark it as the most recently used.
+            self.entries[path] = entry
+            self.hits += 1
+            return entry[0]
+
+    def Put(self, path, file_obj):
+        with self.lock:
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self._Forget(path, old)
+
+            self.entries[path] = (file_obj, time.time() + self.ttl)
+            self.id_paths.setdefault(file_obj['id'], set()).add(path)
+
+            while len(self.entries) > self.max_entries:
+                opath, oentry = self.entries.popitem(last=False)
+                self._Forget(opath, oentry)
+
+    def Invalidate(self, path):
+        """
+        Drop path and everything cached below it.
+        """
+        prefix = path + os.sep
+        with self.lock:
+            for cpath in self.entries.keys():
+                if cpath == path or cpath.startswith(prefix):
+                    self._Forget(cpath, self.entries.pop(cpath))
+
+    def InvalidateId(self, file_id):
+        with self.lock:
+            paths = list(self.id_paths.get(file_id, []))
+
+        for path in paths:
+            self.Invalidate(path)
+
+    def Clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.id_paths.clear()
+
+    def _Forget(self, path, entry):
+        paths = self.id_paths.get(entry[0]['id'], None)
+        if paths is not None:
+            paths.discard(path)
+            if not paths:
+                del self.id_paths[entry[0]['id']]
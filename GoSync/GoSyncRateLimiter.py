@@ -0,0 +1,153 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading, logging, time, random, socket, json, httplib
+import httplib2
+from apiclient.errors import HttpError
+from defines import *
+from GoSyncMetrics import API_REQUESTS, API_RETRIES
+
+# A 403 with one of these reasons means the request was fine but sent
+# too fast. Any other 403 (e.g. no permission) will fail again.
+RATE_LIMIT_REASONS = frozenset(['rateLimitExceeded', 'userRateLimitExceeded'])
+
+RETRY_TRANSIENT = 'transient'
+RETRY_THROTTLED = 'throttled'
+
+MAX_BACKOFF = 64
+
+def ErrorReason(error):
+    """
+    Return the reason the API gave for an HttpError, if any.
+    """
+    try:
+        return json.loads(error.content)['error']['errors'][0]['reason']
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+def ClassifyError(e):
+    """
+    Return RETRY_THROTTLED if e says the requests are sent too fast,
+    RETRY_TRANSIENT if the same request may succeed when sent again, and
+    None if it is pointless to retry.
+    """
+    error = e
+    # PyDrive wraps the HttpError in its own ApiRequestError.
+    if not isinstance(error, HttpError) and error.args and isinstance(error.args[0], HttpError):
+        error = error.args[0]
+
+    if isinstance(error, HttpError):
+        status = error.resp.status
+        if status == 429 or (status == 403 and ErrorReason(error) in RATE_LIMIT_REASONS):
+            return RETRY_THROTTLED
+        if status >= 500:
+            return RETRY_TRANSIENT
+        return None
+
+    if isinstance(error, (socket.error, httplib.HTTPException, httplib2.HttpLib2Error)):
+        return RETRY_TRANSIENT
+
+    return None
+
+# Paces the Drive API calls of all threads with a token bucket refilled
+# at "rate" requests per second. The rate is halved whenever the API
+# says it is being sent too much, and grows back by about "increase"
+# requests per second for every second of successful calls, up to
+# "max_rate" (AIMD). A failed call is retried with exponential backoff
+# as long as ClassifyError says it may succeed. Requests and retries are
+# counted in "metrics", if given.
+class ApiRateLimiter(object):
+    def __init__(self, max_rate=10.0, burst=None, min_rate=0.5, increase=0.1, retries=6,
+                 metrics=None):
+        self.lock = threading.Lock()
+        self.metrics = metrics
+        self.logger = logging.getLogger(APP_NAME)
+        self.min_rate = min_rate
+        self.increase = increase
+        self.retries = retries
+        self.stamp = time.time()
+        self.SetMaxRate(max_rate, burst)
+
+    def SetMaxRate(self, max_rate, burst=None):
+        with self.lock:
+            self.max_rate = max(float(max_rate), self.min_rate)
+            self.burst = float(burst or max(1, self.max_rate))
+            self.rate = self.max_rate
+            self.tokens = self.burst
+
+    def GetRate(self):
+        return self.rate
+
+    def _Refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def Acquire(self):
+        """
+        Block until the next request may be sent.
+        """
+        while True:
+            with self.lock:
+                self._Refill(time.time())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+    def Succeeded(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def Throttled(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
+            self.logger.info("Drive API rate limited. Slowing down to %.1f requests/s\n" % self.rate)
+
+    def Call(self, func, *args, **kwargs):
+        """
+        Return func(*args, **kwargs), paced and retried as described
+        above. The last error is raised once the retries run out.
+        """
+        attempt = 0
+        while True:
+            self.Acquire()
+            if self.metrics:
+                self.metrics.Inc(API_REQUESTS)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                kind = ClassifyError(e)
+                if kind is None or attempt >= self.retries:
+                    raise
+                if self.metrics:
+                    self.metrics.Inc(API_RETRIES, reason=kind)
+                if kind == RETRY_THROTTLED:
+                    self.Throttled()
+
+                delay = min(2 ** attempt, MAX_BACKOFF) + random.random()
+                self.logger.info("Drive API call failed (%s). Retrying in %.1f seconds\n" % (e, delay))
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self.Succeeded()
+            return result
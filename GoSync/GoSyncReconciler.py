@@ -0,0 +1,298 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+
+ACT_MOVE_LOCAL = 'move-local'
+ACT_MOVE_REMOTE = 'move-remote'
+ACT_MKDIR_LOCAL = 'mkdir-local'
+ACT_MKDIR_REMOTE = 'mkdir-remote'
+ACT_DOWNLOAD = 'download'
+ACT_UPLOAD = 'upload'
+ACT_DELETE_LOCAL = 'delete-local'
+ACT_DELETE_REMOTE = 'delete-remote'
+ACT_RECORD = 'record'
+ACT_FORGET = 'forget'
+ACT_CONFLICT = 'conflict'
+
+# The order in which the actions of a plan are carried out. Moves come
+# first so that the paths of everything else are final, except that the
+# folders a local move goes into must exist on the drive before it.
+# Deletions come last and deepest first.
+ACTION_ORDER = [ACT_MOVE_LOCAL, ACT_MKDIR_REMOTE, ACT_MOVE_REMOTE, ACT_MKDIR_LOCAL,
+                ACT_DOWNLOAD, ACT_UPLOAD, ACT_RECORD, ACT_FORGET, ACT_CONFLICT,
+                ACT_DELETE_LOCAL, ACT_DELETE_REMOTE]
+
+def _Ancestors(path):
+    while '/' in path:
+        path = path.rsplit('/', 1)[0]
+        yield path
+
+def _Rebase(table, old, new, folder):
+    """
+    Move the key old, and for a folder every key below it, to new.
+    """
+    if not folder:
+        if old in table:
+            table[new] = table.pop(old)
+        return
+
+    for path in [p for p in table if p == old or p.startswith(old + '/')]:
+        table[new + path[len(old):]] = table.pop(path)
+
+# Works out what has to be done to bring the mirror and the drive back
+# in sync, comparing three views of the same tree (paths relative to the
+# mirror):
+#
+#   local  - {path: is_folder} found on disk now
+#   remote - {path: file} in the metadata store now
+#   base   - {path: (id, md5)} of everything that was in sync after the
+#            last sync (md5 is None for folders)
+#
+# A side changed a path if its state differs from the base. A path
+# changed on one side only is copied to the other side. A path missing
+# from the base is new, so a local file the drive doesn't know about is
+# uploaded, never deleted. Nothing here talks to the drive; file hashes
+# come from hash_func(path) and are only asked for where needed.
+#
+# Plan() returns a list of (action, path, arg) tuples in the order they
+# should be carried out. arg is the remote file for downloads, remote
+# deletions, records and conflicts, the new path for moves, and None
+# otherwise.
+class Reconciler(object):
+    def __init__(self, local, remote, base, hash_func):
+        self.local = dict(local)
+        self.remote = dict(remote)
+        self.base = dict(base)
+        self.hash_func = hash_func
+        self.hashes = {}
+        self.actions = []
+        self.local_moves = []
+
+    def Hash(self, path):
+        if path not in self.hashes:
+            # Local moves are only planned, the file is still where it was.
+            disk_path = path
+            for old, new in reversed(self.local_moves):
+                if disk_path == new or disk_path.startswith(new + '/'):
+                    disk_path = old + disk_path[len(new):]
+            self.hashes[path] = self.hash_func(disk_path)
+        return self.hashes[path]
+
+    def IsRemoteFolder(self, path):
+        return self.remote[path]['mimeType'] == FOLDER_MIME_TYPE
+
+    def RemoteChanged(self, path):
+        f = self.remote[path]
+        id, md5 = self.base[path]
+        return f['id'] != id or f.get('md5Checksum', None) != md5
+
+    def Add(self, action, path, arg=None):
+        self.actions.append((action, path, arg))
+
+    ####### MOVES #######
+    def FindRemoteMoves(self):
+        """
+        A file or folder whose id sits at another path on the drive than
+        in the base was moved there remotely.
+        """
+        remote_paths = {}
+        for path, f in self.remote.iteritems():
+            remote_paths[f['id']] = path
+
+        moves = []
+        for path, (id, md5) in self.base.iteritems():
+            new_path = remote_paths.get(id, None)
+            if new_path is not None and new_path != path and path not in self.remote:
+                moves.append((path, new_path))
+
+        # Folders first, their content moves along with them.
+        moves.sort(key=lambda m: m[0].count('/'))
+        for path, new_path in moves:
+            if path not in self.base or new_path in self.base:
+                # Already moved along with its folder.
+                continue
+
+            folder = self.base[path][1] is None
+            if path in self.local and new_path not in self.local:
+                self.Add(ACT_MOVE_LOCAL, path, new_path)
+                self.local_moves.append((path, new_path))
+                _Rebase(self.local, path, new_path, folder)
+            _Rebase(self.base, path, new_path, folder)
+
+    def FindLocalMoves(self):
+        """
+        A new local file with the content of a synced file that is gone
+        locally but unchanged on the drive was moved there locally.
+        """
+        missing = {}
+        for path, (id, md5) in self.base.iteritems():
+            if md5 and path not in self.local and path in self.remote and not self.RemoteChanged(path):
+                missing.setdefault(md5, []).append(path)
+
+        if not missing:
+            return
+
+        for path in sorted(self.local):
+            if self.local[path] or path in self.base or path in self.remote:
+                continue
+
+            candidates = missing.get(self.Hash(path), None)
+            if candidates:
+                old_path = candidates.pop()
+                self.Add(ACT_MOVE_REMOTE, old_path, path)
+                self.base[path] = self.base.pop(old_path)
+                self.remote[path] = self.remote.pop(old_path)
+
+    ####### FILES #######
+    def PlanFile(self, path):
+        in_local = path in self.local
+        in_remote = path in self.remote
+        in_base = path in self.base
+
+        if in_local and in_remote:
+            if in_base:
+                local_changed = self.Hash(path) != self.base[path][1]
+                remote_changed = self.RemoteChanged(path)
+                if not local_changed and not remote_changed:
+                    return
+                if not remote_changed:
+                    self.Add(ACT_UPLOAD, path)
+                    return
+                if not local_changed:
+                    self.Add(ACT_DOWNLOAD, path, self.remote[path])
+                    return
+
+            if self.Hash(path) == self.remote[path].get('md5Checksum', None):
+                self.Add(ACT_RECORD, path, self.remote[path])
+            else:
+                self.Add(ACT_CONFLICT, path, self.remote[path])
+        elif in_local:
+            if in_base and self.Hash(path) == self.base[path][1]:
+                self.Add(ACT_DELETE_LOCAL, path)
+            else:
+                # New, or changed locally after it was deleted remotely.
+                self.Add(ACT_UPLOAD, path)
+        elif in_remote:
+            if in_base and not self.RemoteChanged(path):
+                self.Add(ACT_DELETE_REMOTE, path, self.remote[path])
+            else:
+                # New, or changed remotely after it was deleted locally.
+                self.Add(ACT_DOWNLOAD, path, self.remote[path])
+        else:
+            self.Add(ACT_FORGET, path)
+
+    ####### FOLDERS #######
+    def PlanFolder(self, path, keep_local, keep_remote):
+        """
+        keep_local/keep_remote tell if anything below path stays on that
+        side, in which case the folder must not be deleted there. Returns
+        the action taken, if any.
+        """
+        in_local = path in self.local
+        in_remote = path in self.remote
+        in_base = path in self.base
+
+        if in_local and in_remote:
+            if in_base and self.base[path][0] == self.remote[path]['id']:
+                return None
+            action, arg = ACT_RECORD, self.remote[path]
+        elif in_local:
+            if in_base and not keep_local:
+                action, arg = ACT_DELETE_LOCAL, None
+            else:
+                action, arg = ACT_MKDIR_REMOTE, None
+        elif in_remote:
+            if in_base and not keep_remote:
+                action, arg = ACT_DELETE_REMOTE, self.remote[path]
+            else:
+                action, arg = ACT_MKDIR_LOCAL, self.remote[path]
+        else:
+            action, arg = ACT_FORGET, None
+
+        self.Add(action, path, arg)
+        return action
+
+    def Plan(self):
+        self.FindRemoteMoves()
+        self.FindLocalMoves()
+
+        paths = set(self.local) | set(self.remote) | set(self.base)
+        folders = []
+        for path in sorted(paths):
+            local_folder = self.local.get(path, None)
+            remote_folder = path in self.remote and self.IsRemoteFolder(path)
+            if path in self.local and path in self.remote and local_folder != remote_folder:
+                self.Add(ACT_CONFLICT, path, self.remote[path])
+            elif local_folder or remote_folder or (path not in self.local and path not in self.remote
+                                                   and self.base[path][1] is None):
+                folders.append(path)
+            else:
+                self.PlanFile(path)
+
+        # Folders holding something that stays on each side once the
+        # files are done.
+        keep_local = set()
+        keep_remote = set()
+        for action, path, arg in self.actions:
+            if action in [ACT_UPLOAD, ACT_RECORD, ACT_CONFLICT]:
+                keep_local.update(_Ancestors(path))
+            if action in [ACT_DOWNLOAD, ACT_RECORD, ACT_CONFLICT]:
+                keep_remote.update(_Ancestors(path))
+            if action in [ACT_MOVE_LOCAL, ACT_MOVE_REMOTE]:
+                keep_local.update(_Ancestors(arg))
+                keep_remote.update(_Ancestors(arg))
+
+        # Deepest first, so a folder knows if its subfolders stay.
+        for path in sorted(folders, reverse=True):
+            action = self.PlanFolder(path, path in keep_local, path in keep_remote)
+            if action not in [ACT_DELETE_LOCAL, ACT_FORGET]:
+                keep_local.update(_Ancestors(path))
+            if action not in [ACT_DELETE_REMOTE, ACT_FORGET]:
+                keep_remote.update(_Ancestors(path))
+
+        return self.Order()
+
+    def Order(self):
+        # A deletion inside a folder that is deleted too is redundant.
+        deleted = {}
+        for action, path, arg in self.actions:
+            if action in [ACT_DELETE_LOCAL, ACT_DELETE_REMOTE]:
+                deleted.setdefault(action, set()).add(path)
+
+        plan = []
+        for action, path, arg in self.actions:
+            if action in deleted and any(p in deleted[action] for p in _Ancestors(path)):
+                continue
+            plan.append((action, path, arg))
+
+        def Key(item):
+            action, path, arg = item
+            if action in [ACT_DELETE_LOCAL, ACT_DELETE_REMOTE]:
+                depth = -path.count('/')
+            elif action in [ACT_MOVE_LOCAL, ACT_MOVE_REMOTE]:
+                # Keep the order they were found in.
+                depth = 0
+            else:
+                depth = path.count('/')
+            return (ACTION_ORDER.index(action), depth)
+
+        plan.sort(key=Key)
+        return plan
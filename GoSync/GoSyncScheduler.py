@@ -0,0 +1,78 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, select, threading, time
+
+# Decides when the next sync pass is due. The interval starts at
+# "interval", drops to "min_interval" after a pass that found remote
+# changes, and doubles after every pass that found none, up to
+# "max_interval". Wait() sleeps until the pass is due or Trigger() is
+# called. The sleep is a select() on a pipe, so nothing wakes up in
+# between.
+class SyncScheduler(object):
+    def __init__(self, interval=600, min_interval=60, max_interval=3600):
+        self.min_interval = max(1, min(min_interval, interval))
+        self.max_interval = max(max_interval, interval)
+        self.interval = interval
+        self.next_run = time.time()
+        self.triggered = False
+        self.lock = threading.Lock()
+        self.wake_r, self.wake_w = os.pipe()
+
+    def Trigger(self):
+        """
+        Make the next pass due now.
+        """
+        with self.lock:
+            self.triggered = True
+        os.write(self.wake_w, 'x')
+
+    def PassDone(self, busy):
+        """
+        Schedule the next pass after one that did (busy) or did not find
+        remote changes. Returns the time the next pass is due.
+        """
+        with self.lock:
+            if busy:
+                self.interval = self.min_interval
+            else:
+                self.interval = min(self.interval * 2, self.max_interval)
+            self.next_run = time.time() + self.interval
+            return self.next_run
+
+    def GetNextRun(self):
+        return self.next_run
+
+    def Wait(self):
+        """
+        Block until the next pass is due. Returns True if it was
+        triggered before its time.
+        """
+        while True:
+            with self.lock:
+                if self.triggered:
+                    self.triggered = False
+                    return True
+
+                left = self.next_run - time.time()
+                if left <= 0:
+                    return False
+
+            r, w, x = select.select([self.wake_r], [], [], left)
+            if r:
+                os.read(self.wake_r, 4096)
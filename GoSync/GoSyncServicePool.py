@@ -0,0 +1,84 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading
+from contextlib import contextmanager
+
+# Authorized HTTP clients shared by the threads that call the Drive API
+# outside of the transfer pools (sync, usage, observer). An httplib2
+# client is not thread safe, so a client is checked out for one request
+# at a time; in between it stays open and keeps its connection alive.
+# Clients are made on demand, at most "size" of them. They are all
+# authorized with the same credentials, so an access token refreshed by
+# one is used by the others.
+class HttpClientPool(object):
+    def __init__(self, new_client, size=4):
+        self.new_client = new_client
+        self.size = max(1, size)
+        self.created = 0
+        self.idle = []
+        self.cond = threading.Condition()
+
+    def SetSize(self, size):
+        with self.cond:
+            self.size = max(1, size)
+            while self.idle and self.created > self.size:
+                self.idle.pop()
+                self.created -= 1
+            self.cond.notify_all()
+
+    def __len__(self):
+        with self.cond:
+            return self.created
+
+    @contextmanager
+    def Client(self):
+        """
+        Check out a client for the duration of the with block. Waits
+        while all of them are in use.
+        """
+        http = self._Checkout()
+        try:
+            yield http
+        finally:
+            self._Checkin(http)
+
+    def _Checkout(self):
+        with self.cond:
+            while not self.idle and self.created >= self.size:
+                self.cond.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.created += 1
+
+        try:
+            return self.new_client()
+        except:
+            with self.cond:
+                self.created -= 1
+                self.cond.notify()
+            raise
+
+    def _Checkin(self, http):
+        with self.cond:
+            if self.created > self.size:
+                # The pool was shrunk while this one was out.
+                self.created -= 1
+            else:
+                self.idle.append(http)
+            self.cond.notify()
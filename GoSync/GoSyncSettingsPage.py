@@ -1,4 +1,4 @@
-import wx
+import wx, math
 import wx.lib.agw.customtreectrl as CT
 from pydrive.drive import GoogleDrive
 from pydrive.auth import GoogleAuth
@@ -34,6 +34,7 @@ class SettingsPage(wx.Panel):
         headerFont = wx.Font(11.5, wx.SWISS, wx.NORMAL, wx.NORMAL)
 
         self.sync_model = sync_model
+        self.tree_generation = None
         self.dstc = GoSyncDriveTree(self, pos=(0,0))
 
         t1 = wx.StaticText(self, -1, "Choose the directories to sync:\n", pos=(0,0))
@@ -75,10 +76,33 @@ class SettingsPage(wx.Panel):
         folder = self.dstc.GetPyData(event.GetItem())
         self.sync_model.SetSyncSelection(folder)
 
+    def FileSizeHumanize(self, size):
+        size = abs(size)
+        if (size==0):
+            return "0B"
+        units = ['B','KB','MB','GB','TB','PB','EB','ZB','YB']
+        p = math.floor(math.log(size, 2)/10)
+        return "%.1f%s" % (size/math.pow(1024,p),units[int(p)])
+
+    def FolderLabel(self, name, usage):
+        """
+        The name of the folder, with its size and number of files and
+        the size of each category in it, largest first.
+        """
+        files = sum(f for f, size in usage.values())
+        size = sum(size for f, size in usage.values())
+        label = "%s (%s, %d files" % (name, self.FileSizeHumanize(size), files)
+        categories = sorted(usage.items(), key=lambda c: (-c[1][1], c[0]))
+        if categories:
+            label += ": " + ", ".join("%s %s" % (category, self.FileSizeHumanize(size))
+                                      for category, (f, size) in categories)
+        return label + ")"
+
     def MakeDriveTree(self, gnode, tnode):
         file_list = gnode.GetChildren()
         for f in file_list:
-            nnode = self.dstc.AppendItem(tnode, f.GetName(), ct_type=1)
+            label = self.FolderLabel(f.GetName(), self.folder_usage.get(f.GetId(), {}))
+            nnode = self.dstc.AppendItem(tnode, label, ct_type=1)
             self.dstc.SetPyData(nnode, f)
             self.MakeDriveTree(f, nnode)
 
@@ -104,10 +128,13 @@ class SettingsPage(wx.Panel):
 
     def RefreshTree(self, event):
         driveTree = self.sync_model.GetDriveDirectoryTree()
-        self.dstc.DeleteAllItems()
-        self.dstc_root = self.dstc.AddRoot("Google Drive Root")
-        self.MakeDriveTree(driveTree.GetRoot(), self.dstc_root)
-        self.dstc.ExpandAll()
+        if driveTree.GetGeneration() != self.tree_generation:
+            self.folder_usage = self.sync_model.GetAllFolderUsage()
+            self.dstc.DeleteAllItems()
+            self.dstc_root = self.dstc.AddRoot("Google Drive Root")
+            self.MakeDriveTree(driveTree.GetRoot(), self.dstc_root)
+            self.dstc.ExpandAll()
+            self.tree_generation = driveTree.GetGeneration()
         sync_list = self.sync_model.GetSyncList()
         for d in sync_list:
             if d[0] == 'root':
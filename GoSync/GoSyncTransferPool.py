@@ -0,0 +1,82 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading, logging, Queue
+from defines import *
+
+# A fixed set of worker threads fed from a bounded queue. Each worker
+# calls worker_init once, before its first job, and passes the result
+# (e.g. its own HTTP client) as the first argument to every job it
+# runs. A job that raises or returns False counts as failed.
+class TransferPool(object):
+    def __init__(self, name, num_workers, worker_init=None):
+        self.name = name
+        self.worker_init = worker_init
+        self.queue = Queue.Queue(num_workers * 4)
+        self.logger = logging.getLogger(APP_NAME)
+        self.failed_lock = threading.Lock()
+        self.failed = 0
+        self.workers = []
+
+        for n in range(0, num_workers):
+            worker = threading.Thread(target=self._Worker, name='%s-%d' % (name, n))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def Submit(self, func, *args):
+        """
+        Queue func(context, *args). Blocks while the queue is full so the
+        producer cannot run far ahead of the workers.
+        """
+        self.queue.put((func, args))
+
+    def __len__(self):
+        """
+        Return the number of jobs queued and not yet started.
+        """
+        return self.queue.qsize()
+
+    def Wait(self):
+        """
+        Wait until every queued job is done. Returns the number of jobs
+        that failed since the last call.
+        """
+        self.queue.join()
+        with self.failed_lock:
+            failed = self.failed
+            self.failed = 0
+        return failed
+
+    def _Worker(self):
+        context = None
+        while True:
+            func, args = self.queue.get()
+            try:
+                if context is None and self.worker_init:
+                    context = self.worker_init()
+                ok = func(context, *args)
+            except:
+                self.logger.exception("%s: job failed\n" % self.name)
+                ok = False
+
+            if ok is False:
+                with self.failed_lock:
+                    self.failed += 1
+
+            self.queue.task_done()
@@ -0,0 +1,162 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import threading
+from collections import OrderedDict
+from GoSyncTransferPool import TransferPool
+from GoSyncLockManager import PathsRelated
+
+OP_CREATE = 'create'
+OP_MODIFY = 'modify'
+OP_DELETE = 'delete'
+OP_MOVE = 'move'
+
+# Queue of observed file system events waiting to be applied to the
+# drive. Events for the same path are coalesced while they wait:
+#
+#   create, modify  -> create        modify, delete -> delete
+#   create, delete  -> (nothing)     delete, create -> modify
+#   create, move    -> create at the destination
+#
+# Every event is saved in the metadata store until it has been handled,
+# so nothing observed is lost across a restart. A dispatcher hands the
+# events to a pool of workers in order. An event waits while another
+# one on the same path, or on a parent or child of it, is being
+# handled.
+class ObserverWorkQueue(object):
+    def __init__(self, store, handler, num_workers):
+        self.store = store
+        self.handler = handler
+        self.cond = threading.Condition()
+        self.pending = OrderedDict()
+        self.inflight = []
+        self.seq = 0
+
+        for seq, op, path, dest in self.store.GetEvents():
+            self.seq = max(self.seq, seq)
+            self.pending[self._Key(op, path, seq)] = [op, path, dest, seq]
+
+        self.pool = TransferPool('observer', num_workers)
+        self.dispatcher = threading.Thread(target=self._Dispatch, name='observer-dispatch')
+        self.dispatcher.daemon = True
+
+    def Start(self):
+        self.dispatcher.start()
+
+    def _Key(self, op, path, seq):
+        # Moves are never coalesced, the others are keyed by path.
+        if op == OP_MOVE:
+            return (OP_MOVE, seq)
+        return path
+
+    def _Add(self, op, path, dest=None):
+        self.seq += 1
+        entry = [op, path, dest, self.seq]
+        self.pending[self._Key(op, path, self.seq)] = entry
+        self.store.PutEvent(self.seq, op, path, dest)
+
+    def _Drop(self, path):
+        entry = self.pending.pop(path)
+        self.store.RemoveEvent(entry[3])
+        return entry[0]
+
+    def _Put(self, op, path):
+        # Every event but a move replaces the one waiting on the same
+        # path, by the rules above.
+        old = None
+        if path in self.pending:
+            old = self._Drop(path)
+
+        if op == OP_DELETE:
+            if old != OP_CREATE:
+                self._Add(OP_DELETE, path)
+        elif op == OP_MODIFY:
+            if old == OP_CREATE:
+                self._Add(OP_CREATE, path)
+            else:
+                self._Add(OP_MODIFY, path)
+        else:
+            if old == OP_DELETE or old == OP_MODIFY:
+                self._Add(OP_MODIFY, path)
+            else:
+                self._Add(OP_CREATE, path)
+
+    def Put(self, op, path, dest=None):
+        with self.cond:
+            if op == OP_MOVE:
+                old = None
+                if path in self.pending:
+                    old = self._Drop(path)
+
+                if old == OP_CREATE:
+                    # Not uploaded yet, so just upload it where it is now.
+                    self._Put(OP_CREATE, dest)
+                else:
+                    self._Add(OP_MOVE, path, dest)
+                    if old == OP_MODIFY:
+                        self._Put(OP_MODIFY, dest)
+            else:
+                self._Put(op, path)
+
+            self.cond.notify_all()
+
+    def PendingPaths(self):
+        """
+        Return every path with an event waiting or being handled.
+        """
+        with self.cond:
+            paths = set()
+            for entry in self.pending.values() + self.inflight:
+                paths.add(entry[1])
+                if entry[2] is not None:
+                    paths.add(entry[2])
+            return paths
+
+    def __len__(self):
+        with self.cond:
+            return len(self.pending) + len(self.inflight)
+
+    def _Blocked(self, entry):
+        for running in self.inflight:
+            for a in (entry[1], entry[2]):
+                for b in (running[1], running[2]):
+                    if a is not None and b is not None and PathsRelated(a, b):
+                        return True
+        return False
+
+    def _Dispatch(self):
+        while True:
+            with self.cond:
+                while not self.pending or self._Blocked(self.pending.itervalues().next()):
+                    self.cond.wait()
+
+                key, entry = self.pending.popitem(last=False)
+                self.inflight.append(entry)
+
+            self.pool.Submit(self._Run, entry)
+
+    def _Run(self, context, entry):
+        try:
+            self.handler(entry[0], entry[1], entry[2])
+        finally:
+            with self.cond:
+                self.inflight.remove(entry)
+                self.store.RemoveEvent(entry[3])
+                self.cond.notify_all()
+
+        return True
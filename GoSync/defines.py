@@ -16,7 +16,10 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import os,sys
+import os,sys,time
+
+# Startup times are measured from here.
+APP_START_TIME = time.time()
 
 APP_LICENSE = """GoSync is an open source Google Drive(TM) client written in python
 
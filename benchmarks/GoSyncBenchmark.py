@@ -0,0 +1,270 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+# Benchmarks of the sync engine against the in-process fake drive of
+# GoSyncFakeDrive. Each run starts from a fresh home directory with a
+# generated drive and times the main operations on it:
+#
+#   full       first sync: list the whole drive and download it
+#   idle       a pass of the changes feed with nothing changed
+#   changes    a pass after --changes files were modified remotely
+#   reconcile  comparing the mirror, the index and the base entries
+#   usage      recounting the folder rollups
+#   observer   uploading a burst of --burst files created locally
+#
+# and reports the wall time, the API requests the drive got, the
+# engine's retries and the peak RSS of the process up to then.
+#
+#   python benchmarks/GoSyncBenchmark.py --files 100000 --shape deep --latency 0.01
+
+import os, sys, json, time, shutil, tempfile, resource, optparse
+
+HERE = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'GoSync'))
+
+from GoSyncFakeDrive import *
+
+# (depth, folders per folder) of the generated folder tree.
+SHAPES = {'wide': (1, 1000), 'deep': (20, 2), 'balanced': (4, 10)}
+PHASES = ['full', 'idle', 'changes', 'reconcile', 'usage', 'observer']
+
+# Kinds of files generated, in turn.
+FILE_KINDS = [('jpg', 'image/jpeg'), ('mp3', 'audio/mpeg'), ('mp4', 'video/mp4'),
+              ('pdf', 'application/pdf'), ('txt', 'text/plain'), ('bin', DEFAULT_MIMETYPE),
+              (None, 'application/vnd.google-apps.document')]
+
+def MakeDrive(drive, num_files, depth, fanout, file_size, max_folders):
+    """
+    Fill drive with a tree of folders depth levels deep, fanout folders
+    per folder (up to max_folders in all), and spread num_files files
+    evenly over the folders.
+    """
+    folders = [ROOT_ID]
+    level = [ROOT_ID]
+    for d in range(depth):
+        next_level = []
+        for parent in level:
+            for n in range(fanout):
+                if len(folders) > max_folders:
+                    break
+                folder_id = drive.AddFile(parent, 'folder-%d-%d' % (d, n), FOLDER_MIMETYPE)
+                folders.append(folder_id)
+                next_level.append(folder_id)
+        level = next_level
+
+    for n in range(num_files):
+        ext, mimeType = FILE_KINDS[n % len(FILE_KINDS)]
+        title = 'file-%d.%s' % (n, ext) if ext else 'document-%d' % n
+        drive.AddFile(folders[n % len(folders)], title, mimeType, size=file_size)
+
+    return len(folders) - 1
+
+def PeakRSS():
+    # Kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def MakeHome(drive, options):
+    """
+    Create a home directory as GoSync leaves it after the first start,
+    for the account of drive.
+    """
+    home = tempfile.mkdtemp(prefix='gosync-bench-')
+    config_path = os.path.join(home, '.gosync')
+    os.mkdir(config_path)
+    with open(os.path.join(config_path, 'client_secrets.json'), 'w') as f:
+        json.dump({}, f)
+    with open(os.path.join(config_path, 'account.json'), 'w') as f:
+        json.dump(drive.about_get(), f)
+
+    config = {'Sync Selection': [['root', '']],
+              'API Requests Per Second': options.client_rate,
+              'API Connections': options.workers,
+              'Download Workers': options.workers,
+              'Upload Workers': options.workers,
+              'Observer Workers': options.workers,
+              'Metrics File': ''}
+    with open(os.path.join(config_path, 'gosyncrc'), 'w') as f:
+        json.dump({drive.email: config}, f)
+    return home
+
+class Benchmark(object):
+    def __init__(self, options):
+        self.options = options
+        self.results = []
+
+        self.drive = FakeDrive(email='bench@example.com')
+        depth, fanout = SHAPES[options.shape]
+        depth = options.depth or depth
+        fanout = options.fanout or fanout
+        start = time.time()
+        folders = MakeDrive(self.drive, options.files, depth, fanout, options.file_size,
+                            options.max_folders)
+        print "Generated %d files in %d folders (%s, depth %d, fanout %d) in %.1f seconds" % \
+            (options.files, folders, options.shape, depth, fanout, time.time() - start)
+
+        self.home = MakeHome(self.drive, options)
+        os.environ['HOME'] = self.home
+
+        # Imported only now: the model finds its files through $HOME.
+        from GoSyncModel import GoSyncModel
+        drive = self.drive
+
+        class BenchmarkModel(GoSyncModel):
+            def DoAuthenticate(self):
+                self.authToken = FakeAuth(drive)
+                self.is_logged_in = True
+
+        self.model = BenchmarkModel(headless=True)
+        self.model.observer.start()
+        self.model.FinishStartup()
+        self.model.StartSync()
+
+        # Latency and rate limit only from here on, the setup is free.
+        self.drive.latency = options.latency
+        self.drive.rate_limit = options.rate_limit
+        self.drive.tokens = options.rate_limit or 0
+        self.drive.ResetCalls()
+
+    def Close(self):
+        self.model.observer.stop()
+        self.model.metaStore.Close()
+        if not self.options.keep:
+            shutil.rmtree(self.home, ignore_errors=True)
+
+    def Retries(self):
+        snapshot = self.model.GetMetrics()
+        return sum(value for name, value in snapshot.items() if name.startswith('gosync_api_retries_total'))
+
+    def Run(self, name, func):
+        retries = self.Retries()
+        self.drive.ResetCalls()
+        start = time.time()
+        result = func()
+        wall = time.time() - start
+        calls = self.drive.ResetCalls()
+        self.results.append({'phase': name, 'wall': wall, 'result': result,
+                             'requests': sum(n for method, n in calls.items() if method != 'rate limited'),
+                             'rate_limited': calls.get('rate limited', 0),
+                             'retries': self.Retries() - retries,
+                             'calls': calls, 'peak_rss': PeakRSS()})
+        print "%-10s %9.2fs %9d requests %7d retries %8.1f MB  %s" % \
+            (name, wall, self.results[-1]['requests'], self.results[-1]['retries'],
+             self.results[-1]['peak_rss'] / 1048576.0, result)
+
+    ####### PHASES SECTION #######
+    def Full(self):
+        return self.model.SyncRemoteFull()
+
+    def Idle(self):
+        return self.model.SyncRemoteChanges()
+
+    def Changes(self):
+        files = [f for f in self.drive.order if 'md5' in self.drive.files[f]]
+        step = max(1, len(files) / max(1, self.options.changes))
+        for file_id in files[::step][:self.options.changes]:
+            self.drive.Modify(file_id)
+        return self.model.SyncRemoteChanges()
+
+    def Reconcile(self):
+        self.model.ReconcileMirror()
+        return self.model.downloadPool.Wait() == 0
+
+    def Usage(self):
+        from GoSyncDriveTree import GoogleDriveTree
+        self.model.metaStore.RecomputeRollups()
+        self.model.UpdateUsage()
+        driveTree = GoogleDriveTree()
+        driveTree.LoadIndex(self.model.metaStore)
+        self.model.PublishDriveTree(driveTree)
+        return True
+
+    def Observer(self):
+        burst = os.path.join(self.model.mirror_directory, 'burst')
+        os.mkdir(burst)
+        for n in range(self.options.burst):
+            with open(os.path.join(burst, 'burst-%d.txt' % n), 'w') as f:
+                f.write('burst %d\n' % n)
+
+        # The events come in from the observer thread, so wait for the
+        # uploads to show up on the drive.
+        deadline = time.time() + self.options.timeout
+        while time.time() < deadline:
+            with self.drive.lock:
+                folders = [f for f in self.drive.children[ROOT_ID]
+                           if self.drive.files[f]['title'] == 'burst']
+                uploaded = sum(len(self.drive.children[f]) for f in folders)
+            if uploaded >= self.options.burst:
+                break
+            time.sleep(0.05)
+        self.model.uploadPool.Wait()
+        return uploaded >= self.options.burst
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options]")
+    parser.add_option('--files', type='int', default=10000,
+                      help="files on the drive [%default]")
+    parser.add_option('--shape', choices=sorted(SHAPES.keys()), default='balanced',
+                      help="shape of the folder tree: %s [%%default]" % ', '.join(sorted(SHAPES.keys())))
+    parser.add_option('--depth', type='int', default=0,
+                      help="levels of folders, instead of the shape's")
+    parser.add_option('--fanout', type='int', default=0,
+                      help="folders per folder, instead of the shape's")
+    parser.add_option('--max-folders', type='int', default=100000,
+                      help="most folders generated [%default]")
+    parser.add_option('--file-size', type='int', default=1024,
+                      help="bytes per file [%default]")
+    parser.add_option('--latency', type='float', default=0,
+                      help="seconds each request takes [%default]")
+    parser.add_option('--rate-limit', type='float', default=0,
+                      help="requests per second the drive allows, 0 for no limit [%default]")
+    parser.add_option('--client-rate', type='float', default=1000,
+                      help="the 'API Requests Per Second' of GoSync [%default]")
+    parser.add_option('--workers', type='int', default=4,
+                      help="transfer workers and API connections [%default]")
+    parser.add_option('--changes', type='int', default=100,
+                      help="files modified remotely for the changes phase [%default]")
+    parser.add_option('--burst', type='int', default=1000,
+                      help="files created locally for the observer phase [%default]")
+    parser.add_option('--timeout', type='float', default=600,
+                      help="longest wait for the observer burst [%default]")
+    parser.add_option('--phases', default=','.join(PHASES),
+                      help="phases to run, in order [%default]")
+    parser.add_option('--json', metavar='FILE',
+                      help="also write the results as JSON to FILE")
+    parser.add_option('--keep', action='store_true', default=False,
+                      help="keep the home directory of the run")
+    options, args = parser.parse_args()
+
+    phases = options.phases.split(',')
+    for name in phases:
+        if name not in PHASES:
+            parser.error("unknown phase %s" % name)
+
+    bench = Benchmark(options)
+    try:
+        for name in phases:
+            bench.Run(name, getattr(bench, name.capitalize()))
+    finally:
+        bench.Close()
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump({'options': options.__dict__, 'results': bench.results}, f, indent=1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,464 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import re, json, time, hashlib, threading, urllib
+from collections import defaultdict
+from apiclient.errors import HttpError
+
+FOLDER_MIMETYPE = 'application/vnd.google-apps.folder'
+ROOT_ID = 'ROOT'
+DEFAULT_MIMETYPE = 'application/octet-stream'
+MEDIA_URI = 'https://fake.drive/files/%s?alt=media'
+MODIFIED_DATE = '2020-01-01T00:00:00.000Z'
+
+_CLAUSE = re.compile(r"'((?:[^'\\]|\\.)*)' in parents|"
+                     r"trashed\s*=\s*(true|false)|"
+                     r"(title|mimeType)\s*=\s*'((?:[^'\\]|\\.)*)'")
+
+def _Unquote(value):
+    return re.sub(r'\\(.)', r'\1', value)
+
+def ParseQuery(q):
+    """
+    Return {'parent', 'trashed', 'title', 'mimeType'} for a query made of
+    the clauses GoSync uses, joined by "and".
+    """
+    terms = {}
+    for clause in q.split(' and '):
+        m = _CLAUSE.match(clause.strip())
+        if not m:
+            raise ValueError("Unsupported query clause: %s" % clause)
+        if m.group(1) is not None:
+            terms['parent'] = _Unquote(m.group(1))
+        elif m.group(2) is not None:
+            terms['trashed'] = (m.group(2) == 'true')
+        else:
+            terms[m.group(3)] = _Unquote(m.group(4))
+    return terms
+
+# What the fake hands to HttpError and media downloads, like an
+# httplib2.Response: a dict of headers with the status as an attribute.
+class FakeResponse(dict):
+    def __init__(self, status, headers=None):
+        dict.__init__(self, headers or {})
+        self.status = status
+        self.reason = {200: 'OK', 206: 'Partial Content', 308: 'Resume Incomplete',
+                       403: 'Forbidden', 404: 'Not Found'}.get(status, 'Error')
+        self['status'] = str(status)
+
+def _Error(status, reason):
+    content = json.dumps({'error': {'errors': [{'reason': reason}], 'code': status}})
+    return HttpError(FakeResponse(status), content)
+
+# An in-memory Google Drive, answering the Drive API v2 calls GoSync makes
+# the way the service object of the API client would. Every request
+# takes "latency" seconds and, beyond "rate_limit" requests per second,
+# fails with 403 userRateLimitExceeded. Requests are counted by method.
+class FakeDrive(object):
+    def __init__(self, latency=0, rate_limit=None, email='bench@example.com'):
+        self.latency = latency
+        self.rate_limit = rate_limit
+        self.email = email
+        self.lock = threading.RLock()
+        self.files = {ROOT_ID: {'id': ROOT_ID, 'title': 'My Drive', 'mimeType': FOLDER_MIMETYPE,
+                                'parents': [], 'trashed': False}}
+        self.children = defaultdict(list)
+        self.order = []
+        self.changes = []
+        self.sessions = {}
+        self.calls = defaultdict(int)
+        self.next_id = 0
+        self.tokens = rate_limit or 0
+        self.stamp = time.time()
+
+    ####### BOOKKEEPING SECTION #######
+    def NewId(self):
+        with self.lock:
+            self.next_id += 1
+            return 'F%08d' % self.next_id
+
+    def Content(self, f):
+        """
+        The content of a generated file, made up from its id and version.
+        """
+        if 'data' in f:
+            return f['data']
+        line = '%s.%d\n' % (f['id'], f['version'])
+        return (line * (f['size'] / len(line) + 1))[:f['size']]
+
+    def AddFile(self, parent, title, mimeType, size=0, data=None, file_id=None):
+        """
+        Add a file (or a folder) and return its id. Its content is data
+        or, if not given, size bytes made up by Content().
+        """
+        with self.lock:
+            f = {'id': file_id or self.NewId(), 'title': title, 'mimeType': mimeType,
+                 'parents': [parent], 'trashed': False, 'version': 1}
+            if mimeType != FOLDER_MIMETYPE and not mimeType.startswith('application/vnd.google-apps.'):
+                if data is not None:
+                    f['data'] = data
+                    f['size'] = len(data)
+                else:
+                    f['size'] = size
+                f['md5'] = hashlib.md5(self.Content(f)).hexdigest()
+            self.files[f['id']] = f
+            self.children[parent].append(f['id'])
+            self.order.append(f['id'])
+            self.changes.append(f['id'])
+            return f['id']
+
+    def Modify(self, file_id):
+        """
+        Change the content of a file as another client would.
+        """
+        with self.lock:
+            f = self.files[file_id]
+            f.pop('data', None)
+            f['version'] += 1
+            f['md5'] = hashlib.md5(self.Content(f)).hexdigest()
+            self.changes.append(file_id)
+
+    def Replace(self, file_id, data):
+        """
+        Give a file new content, as an upload of a new version does.
+        """
+        with self.lock:
+            f = self.files[file_id]
+            f['data'] = data
+            f['size'] = len(data)
+            f['version'] += 1
+            f['md5'] = hashlib.md5(data).hexdigest()
+            self.changes.append(file_id)
+
+    def Rename(self, file_id, title):
+        with self.lock:
+            self.files[file_id]['title'] = title
+            self.changes.append(file_id)
+
+    def Move(self, file_id, add, remove):
+        with self.lock:
+            f = self.files[file_id]
+            for parent in remove:
+                if parent in f['parents']:
+                    f['parents'].remove(parent)
+                    self.children[parent].remove(file_id)
+            for parent in add:
+                f['parents'].append(parent)
+                self.children[parent].append(file_id)
+            self.changes.append(file_id)
+
+    def Trash(self, file_id):
+        with self.lock:
+            self.files[file_id]['trashed'] = True
+            self.changes.append(file_id)
+
+    def Resource(self, f):
+        """
+        The file as the API returns it.
+        """
+        r = {'id': f['id'], 'title': f['title'], 'mimeType': f['mimeType'],
+             'modifiedDate': MODIFIED_DATE, 'labels': {'trashed': f['trashed']},
+             'parents': [{'id': p, 'isRoot': p == ROOT_ID} for p in f['parents']]}
+        if 'md5' in f:
+            r['md5Checksum'] = f['md5']
+            r['fileSize'] = str(f['size'])
+        return r
+
+    def ResolveId(self, file_id):
+        if file_id == 'root':
+            return ROOT_ID
+        return file_id
+
+    def ResetCalls(self):
+        with self.lock:
+            calls = dict(self.calls)
+            self.calls.clear()
+            return calls
+
+    def Call(self, method):
+        """
+        Account for one request: wait the latency and enforce the rate
+        limit.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.calls[method] += 1
+            if self.rate_limit:
+                now = time.time()
+                self.tokens = min(self.rate_limit, self.tokens + (now - self.stamp) * self.rate_limit)
+                self.stamp = now
+                if self.tokens < 1:
+                    self.calls['rate limited'] += 1
+                    raise _Error(403, 'userRateLimitExceeded')
+                self.tokens -= 1
+
+    def Get(self, file_id):
+        f = self.files.get(self.ResolveId(file_id), None)
+        if f is None:
+            raise _Error(404, 'notFound')
+        return f
+
+    ####### API SECTION #######
+    def about_get(self, fields=None):
+        used = sum(f.get('size', 0) for f in self.files.itervalues())
+        return {'name': 'Benchmark', 'user': {'emailAddress': self.email},
+                'quotaBytesTotal': str(1 << 40), 'quotaBytesUsed': str(used)}
+
+    def files_list(self, q='', maxResults=100, fields=None, pageToken=None):
+        terms = ParseQuery(q) if q else {}
+        if 'parent' in terms:
+            candidates = self.children.get(self.ResolveId(terms['parent']), [])
+        else:
+            candidates = self.order
+
+        start = int(pageToken or 0)
+        items = []
+        n = start
+        while n < len(candidates) and len(items) < maxResults:
+            f = self.files[candidates[n]]
+            n += 1
+            if 'trashed' in terms and f['trashed'] != terms['trashed']:
+                continue
+            if 'title' in terms and f['title'] != terms['title']:
+                continue
+            if 'mimeType' in terms and f['mimeType'] != terms['mimeType']:
+                continue
+            items.append(self.Resource(f))
+
+        result = {'items': items}
+        if n < len(candidates):
+            result['nextPageToken'] = str(n)
+        return result
+
+    def files_insert(self, body, media_body=None, fields=None):
+        parent = self.ResolveId(body['parents'][0]['id'])
+        if media_body is None:
+            file_id = self.AddFile(parent, body['title'], body.get('mimeType', FOLDER_MIMETYPE))
+        else:
+            data = media_body.getbytes(0, media_body.size())
+            file_id = self.AddFile(parent, body['title'], media_body.mimetype() or DEFAULT_MIMETYPE,
+                                   data=data)
+        return self.Resource(self.files[file_id])
+
+    def files_update(self, fileId, body=None, media_body=None, fields=None):
+        f = self.Get(fileId)
+        if media_body is not None:
+            self.Replace(f['id'], media_body.getbytes(0, media_body.size()))
+        return self.files_patch(fileId, body, fields)
+
+    def files_patch(self, fileId, body=None, fields=None, addParents=None, removeParents=None):
+        f = self.Get(fileId)
+        if body and body.get('title', f['title']) != f['title']:
+            self.Rename(f['id'], body['title'])
+        if addParents or removeParents:
+            add = [self.ResolveId(p) for p in (addParents or '').split(',') if p]
+            remove = [self.ResolveId(p) for p in (removeParents or '').split(',') if p]
+            self.Move(f['id'], add, remove)
+        return self.Resource(f)
+
+    def files_trash(self, fileId, fields=None):
+        f = self.Get(fileId)
+        self.Trash(f['id'])
+        return self.Resource(f)
+
+    def changes_getStartPageToken(self):
+        return {'startPageToken': str(len(self.changes))}
+
+    def changes_list(self, pageToken, includeDeleted=True, maxResults=100, fields=None):
+        start = int(pageToken)
+        end = min(len(self.changes), start + maxResults)
+        items = []
+        for file_id in self.changes[start:end]:
+            items.append({'fileId': file_id, 'deleted': False,
+                          'file': self.Resource(self.files[file_id])})
+        result = {'items': items}
+        if end < len(self.changes):
+            result['nextPageToken'] = str(end)
+        else:
+            result['newStartPageToken'] = str(end)
+        return result
+
+    def UploadStatus(self, uri):
+        """
+        Answer a status query of an upload session with how much of the
+        file it has.
+        """
+        if uri not in self.sessions:
+            raise _Error(404, 'notFound')
+        received = len(self.sessions[uri])
+        if not received:
+            return FakeResponse(308), ''
+        return FakeResponse(308, {'range': 'bytes=0-%d' % (received - 1)}), ''
+
+    def Media(self, uri, headers):
+        """
+        Answer a media download, honouring the Range header.
+        """
+        file_id = urllib.unquote(uri.split('/files/')[1].split('?')[0])
+        f = self.Get(file_id)
+        if f.get('restricted', False):
+            raise _Error(403, 'cannotDownloadFile')
+        content = self.Content(f)
+        first, last = 0, len(content) - 1
+        if headers and 'range' in headers:
+            first, last = [int(x) for x in headers['range'].split('=')[1].split('-')]
+            last = min(last, len(content) - 1)
+        chunk = content[first:last + 1]
+        return (FakeResponse(206, {'content-range': 'bytes %d-%d/%d' % (first, last, len(content)),
+                                   'content-length': str(len(chunk))}), chunk)
+
+# A request as built by the service object, run by execute().
+class FakeRequest(object):
+    def __init__(self, drive, method, func, kwargs):
+        self.drive = drive
+        self.method = method
+        self.func = func
+        self.kwargs = kwargs
+
+    def execute(self, http=None, num_retries=0):
+        self.drive.Call(self.method)
+        with self.drive.lock:
+            return self.func(**self.kwargs)
+
+class FakeMediaRequest(object):
+    def __init__(self, drive, file_id):
+        self.drive = drive
+        self.uri = MEDIA_URI % urllib.quote(file_id)
+        self.headers = {}
+        self.http = None
+
+class FakeUploadProgress(object):
+    def __init__(self, resumable_progress, total_size):
+        self.resumable_progress = resumable_progress
+        self.total_size = total_size
+
+    def progress(self):
+        return float(self.resumable_progress) / self.total_size
+
+# A resumable upload, sent one chunk per next_chunk() like the API
+# client does, into an upload session kept by the drive. With a file_id
+# it uploads a new version of that file.
+class FakeUploadRequest(object):
+    def __init__(self, drive, body, media_body, file_id=None):
+        self.drive = drive
+        self.body = body
+        self.media_body = media_body
+        self.file_id = file_id
+        self.resumable_uri = None
+        self.resumable_progress = 0
+
+    def next_chunk(self, http=None, num_retries=0):
+        self.drive.Call('files.update (chunk)' if self.file_id else 'files.insert (chunk)')
+        with self.drive.lock:
+            if self.resumable_uri is None:
+                self.resumable_uri = 'https://fake.drive/upload/%s' % self.drive.NewId()
+                self.drive.sessions[self.resumable_uri] = ''
+            session = self.drive.sessions.get(self.resumable_uri, None)
+            if session is None:
+                raise _Error(404, 'notFound')
+
+            size = self.media_body.size()
+            chunk = self.media_body.getbytes(self.resumable_progress, self.media_body.chunksize())
+            session = session[:self.resumable_progress] + chunk
+            self.drive.sessions[self.resumable_uri] = session
+            self.resumable_progress = len(session)
+            if len(session) < size:
+                return FakeUploadProgress(len(session), size), None
+
+            del self.drive.sessions[self.resumable_uri]
+            if self.file_id:
+                self.drive.Get(self.file_id)
+                self.drive.Replace(self.file_id, session)
+                return None, self.drive.files_patch(self.file_id, self.body)
+            parent = self.drive.ResolveId(self.body['parents'][0]['id'])
+            file_id = self.drive.AddFile(parent, self.body['title'],
+                                         self.media_body.mimetype() or DEFAULT_MIMETYPE, data=session)
+            return None, self.drive.Resource(self.drive.files[file_id])
+
+class _FakeResource(object):
+    def __init__(self, drive, collection):
+        self.drive = drive
+        self.collection = collection
+
+    def __getattr__(self, name):
+        func = getattr(self.drive, '%s_%s' % (self.collection, name))
+        method = '%s.%s' % (self.collection, name)
+        return lambda **kwargs: FakeRequest(self.drive, method, func, kwargs)
+
+class FakeFilesResource(_FakeResource):
+    def insert(self, body, media_body=None, fields=None):
+        if media_body is not None and media_body.resumable():
+            return FakeUploadRequest(self.drive, body, media_body)
+        return FakeRequest(self.drive, 'files.insert', self.drive.files_insert,
+                           {'body': body, 'media_body': media_body, 'fields': fields})
+
+    def update(self, fileId, body=None, media_body=None, fields=None):
+        if media_body is not None and media_body.resumable():
+            return FakeUploadRequest(self.drive, body, media_body, fileId)
+        return FakeRequest(self.drive, 'files.update', self.drive.files_update,
+                           {'fileId': fileId, 'body': body, 'media_body': media_body, 'fields': fields})
+
+    def get_media(self, fileId):
+        return FakeMediaRequest(self.drive, fileId)
+
+# Stands in for the service object of the API client.
+class FakeService(object):
+    def __init__(self, drive):
+        self.drive = drive
+
+    def files(self):
+        return FakeFilesResource(self.drive, 'files')
+
+    def changes(self):
+        return _FakeResource(self.drive, 'changes')
+
+    def about(self):
+        return _FakeResource(self.drive, 'about')
+
+# Stands in for an authorized httplib2 client. Only media downloads are
+# sent through it.
+class FakeHttp(object):
+    def __init__(self, drive):
+        self.drive = drive
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        try:
+            if method == 'PUT':
+                self.drive.Call('upload status')
+                with self.drive.lock:
+                    return self.drive.UploadStatus(uri)
+            self.drive.Call('files.get (media)')
+            with self.drive.lock:
+                return self.drive.Media(uri, headers)
+        except HttpError as error:
+            return error.resp, error.content
+
+class FakeCredentials(object):
+    def __init__(self, drive):
+        self.drive = drive
+
+    def authorize(self, http):
+        return FakeHttp(self.drive)
+
+# Stands in for PyDrive's GoogleAuth once the user has logged in.
+class FakeAuth(object):
+    def __init__(self, drive):
+        self.service = FakeService(drive)
+        self.credentials = FakeCredentials(drive)
@@ -0,0 +1,107 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, sys, time, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'GoSync'))
+
+from GoSyncEvents import *
+
+class EventChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.delivered = []
+
+    def testUnlimited(self):
+        channel = GoSyncEventChannel(self, self.delivered.append)
+        for n in range(5):
+            channel.Post(n)
+        self.assertEqual(self.delivered, range(5))
+
+    def testLatestIsKept(self):
+        channel = GoSyncEventChannel(self, self.delivered.append, max_rate=0.1)
+        for n in range(5):
+            channel.Post(n)
+        # The first goes right away, the others wait for the next turn,
+        # when only the latest is delivered.
+        self.assertEqual(self.delivered, [0])
+        channel.Flush()
+        self.assertEqual(self.delivered, [0, 4])
+        channel.Flush()
+        self.assertEqual(self.delivered, [0, 4])
+
+    def testDeliveredWhenDue(self):
+        channel = GoSyncEventChannel(self, self.delivered.append, max_rate=20)
+        channel.Post(1)
+        channel.Post(2)
+        channel.Post(3)
+        deadline = time.time() + 5
+        while len(self.delivered) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.delivered, [1, 3])
+
+# Listeners are added to the controller, which is shared, so they are
+# taken off again after each test.
+class EventControllerTest(unittest.TestCase):
+    def setUp(self):
+        self.controller = GoSyncEventController()
+        self.listeners = dict((event, list(channels))
+                              for event, channels in self.controller._sync_listeners.iteritems())
+        self.received = []
+
+    def tearDown(self):
+        for event, channels in self.listeners.iteritems():
+            for channel in self.controller._sync_listeners[event][len(channels):]:
+                if channel.timer is not None:
+                    channel.timer.cancel()
+            self.controller._sync_listeners[event][:] = channels
+
+    def OnEvent(self, event):
+        self.received.append((event.event, event.data))
+
+    def testCriticalEventsNotThrottled(self):
+        self.controller.AddListener(GOSYNC_EVENT_ERROR, self.OnEvent, max_rate=0.1)
+        for n in range(3):
+            self.controller.PostEvent(GOSYNC_EVENT_ERROR, n)
+        self.assertEqual(self.received, [(GOSYNC_EVENT_ERROR, n) for n in range(3)])
+
+    def testUpdatesCoalesced(self):
+        self.controller.AddListener(GOSYNC_EVENT_SYNC_UPDATE, self.OnEvent, max_rate=0.1)
+        for n in range(10):
+            self.controller.PostEvent(GOSYNC_EVENT_SYNC_UPDATE, n)
+        self.assertEqual(self.received, [(GOSYNC_EVENT_SYNC_UPDATE, 0)])
+
+    def testUpdatesFlushedBeforeCriticalEvent(self):
+        self.controller.AddListener(GOSYNC_EVENT_SYNC_UPDATE, self.OnEvent, max_rate=0.1)
+        self.controller.AddListener(GOSYNC_EVENT_SYNC_DONE, self.OnEvent)
+        for n in range(10):
+            self.controller.PostEvent(GOSYNC_EVENT_SYNC_UPDATE, n)
+        self.controller.PostEvent(GOSYNC_EVENT_SYNC_DONE, 0)
+        self.assertEqual(self.received, [(GOSYNC_EVENT_SYNC_UPDATE, 0),
+                                         (GOSYNC_EVENT_SYNC_UPDATE, 9),
+                                         (GOSYNC_EVENT_SYNC_DONE, 0)])
+
+    def testDefaultRate(self):
+        self.controller.AddListener(GOSYNC_EVENT_SYNC_TIMER, self.OnEvent)
+        channel = self.controller._sync_listeners[GOSYNC_EVENT_SYNC_TIMER][-1]
+        self.assertEqual(channel.interval, 1.0 / GOSYNC_DEFAULT_MAX_RATE[GOSYNC_EVENT_SYNC_TIMER])
+
+    def testInvalidEvent(self):
+        self.assertRaises(ValueError, self.controller.AddListener, 'no such event', self.OnEvent)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,289 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, sys, time, shutil, optparse, unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'GoSync'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from GoSyncFakeDrive import *
+from GoSyncBenchmark import MakeHome
+from GoSyncWorkQueue import OP_CREATE, OP_MODIFY
+from GoSyncModel import FileNotFound, FolderNotFound
+from GoSyncMetrics import OP_ERRORS
+from GoSyncDriveTree import GoogleDriveTree
+
+# Syncs a small drive of the fake into a fresh home directory. The
+# observer is not started, so local changes are only seen when the test
+# says so, as if they were made while GoSync was not running.
+class SyncTest(unittest.TestCase):
+    def setUp(self):
+        self.drive = FakeDrive()
+        self.ids = {}
+        self.ids['d'] = self.drive.AddFile(ROOT_ID, 'd', FOLDER_MIMETYPE)
+        self.ids['a.txt'] = self.drive.AddFile(ROOT_ID, 'a.txt', 'text/plain', data='a\n')
+        self.ids['d/b.txt'] = self.drive.AddFile(self.ids['d'], 'b.txt', 'text/plain', data='b\n')
+
+        options = optparse.Values({'client_rate': 1000, 'workers': 2})
+        self.home = MakeHome(self.drive, options)
+        os.environ['HOME'] = self.home
+
+        from GoSyncModel import GoSyncModel
+        drive = self.drive
+
+        class TestModel(GoSyncModel):
+            def DoAuthenticate(self):
+                self.authToken = FakeAuth(drive)
+                self.is_logged_in = True
+
+        self.model = TestModel(headless=True)
+        self.model.FinishStartup()
+        self.model.StartSync()
+        self.assertTrue(self.model.SyncRemoteFull())
+        self.mirror = self.model.mirror_directory
+
+    def tearDown(self):
+        self.model.metaStore.Close()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+    def Path(self, path):
+        return os.path.join(self.mirror, path)
+
+    def Wait(self):
+        deadline = time.time() + 30
+        while len(self.model.observerQueue) and time.time() < deadline:
+            time.sleep(0.01)
+        self.model.uploadPool.Wait()
+        self.model.downloadPool.Wait()
+
+    def Remote(self, title):
+        """
+        Return (parent title, content) of every file on the drive with
+        the given title.
+        """
+        return sorted((self.drive.files[f['parents'][0]]['title'], self.drive.Content(f))
+                      for f in self.drive.files.values() if f['title'] == title and not f['trashed'])
+
+    def Edit(self, path, data):
+        with open(self.Path(path), 'w') as f:
+            f.write(data)
+        # Make sure the change shows even on coarse mtimes.
+        st = os.stat(self.Path(path))
+        os.utime(self.Path(path), (st.st_atime, st.st_mtime + 10))
+
+    def testFullSync(self):
+        self.assertEqual(open(self.Path('a.txt')).read(), 'a\n')
+        self.assertEqual(open(self.Path('d/b.txt')).read(), 'b\n')
+        self.assertEqual(self.model.metaStore.CountFiles(), 2)
+
+    def testDriveTree(self):
+        sub = self.drive.AddFile(self.ids['d'], 'e', FOLDER_MIMETYPE)
+        self.assertTrue(self.model.SyncRemoteChanges())
+        tree = GoogleDriveTree()
+        tree.LoadIndex(self.model.metaStore)
+        self.assertEqual(len(tree), 2)
+        self.assertEqual(tree.FindFolderByPath('d/e').GetId(), sub)
+        self.assertIs(tree.FindFolderByPath('d').GetParent(), tree.GetRoot())
+
+    def testLocalEditUpdatesFile(self):
+        self.Edit('a.txt', 'edited\n')
+        self.model.ReconcileMirror()
+        self.Wait()
+        self.assertEqual(self.Remote('a.txt'), [('My Drive', 'edited\n')])
+
+    def testEditDuringUpload(self):
+        upload = self.model.NewUploadRequest
+
+        def EditingUpload(file_path, parent, file_id, media):
+            request = upload(file_path, parent, file_id, media)
+            if not self.edited:
+                self.edited = True
+                self.Edit('a.txt', 'first\nsecond\n')
+            return request
+
+        self.edited = False
+        self.model.NewUploadRequest = EditingUpload
+        self.Edit('a.txt', 'first\n')
+        self.model.HandleObservedEvent(OP_MODIFY, self.Path('a.txt'))
+        self.Wait()
+        self.Wait()
+        self.assertEqual(self.Remote('a.txt'), [('My Drive', 'first\nsecond\n')])
+
+    def testChangesWhileStopped(self):
+        # The pass after a restart has a change token but no events.
+        self.Edit('new.txt', 'new\n')
+        os.remove(self.Path('d/b.txt'))
+        self.model.lastReconcile = 0
+        self.assertFalse(self.model.SyncPass())
+        self.Wait()
+        self.assertEqual(self.Remote('new.txt'), [('My Drive', 'new\n')])
+        self.assertEqual(self.Remote('b.txt'), [])
+
+    def testObservedEditUpdatesFile(self):
+        self.Edit('d/b.txt', 'edited\n')
+        self.model.HandleObservedEvent(OP_MODIFY, self.Path('d/b.txt'))
+        self.model.HandleObservedEvent(OP_MODIFY, self.Path('d/b.txt'))
+        self.Wait()
+        self.assertEqual(self.Remote('b.txt'), [('d', 'edited\n')])
+
+    def testObservedDownloadIsIgnored(self):
+        # What the observer reports of the sync's own downloads.
+        self.drive.ResetCalls()
+        self.model.HandleObservedEvent(OP_CREATE, self.Path('d'))
+        self.model.HandleObservedEvent(OP_CREATE, self.Path('d/b.txt'))
+        self.model.HandleObservedEvent(OP_MODIFY, self.Path('a.txt'))
+        self.Wait()
+        self.assertEqual(self.drive.ResetCalls(), {})
+
+    def testLocalMoveIntoNewFolder(self):
+        os.mkdir(self.Path('new'))
+        os.rename(self.Path('a.txt'), self.Path('new/a.txt'))
+        self.model.ReconcileMirror()
+        self.Wait()
+        self.assertEqual(self.Remote('a.txt'), [('new', 'a\n')])
+
+        # Nothing left to do, in particular no move back.
+        self.model.ReconcileMirror()
+        self.Wait()
+        self.assertTrue(os.path.exists(self.Path('new/a.txt')))
+        self.assertFalse(os.path.exists(self.Path('a.txt')))
+        self.assertEqual(self.Remote('a.txt'), [('new', 'a\n')])
+
+    def testRemoteTrashKeepsLocalEdit(self):
+        self.Edit('a.txt', 'edited\n')
+        self.drive.Trash(self.ids['a.txt'])
+        self.assertTrue(self.model.SyncRemoteChanges())
+        self.Wait()
+        self.assertEqual(open(self.Path('a.txt')).read(), 'edited\n')
+        self.assertEqual(self.Remote('a.txt'), [('My Drive', 'edited\n')])
+
+    def testRemoteFolderTrashKeepsLocalEdit(self):
+        self.Edit('d/b.txt', 'edited\n')
+        self.drive.Trash(self.ids['d'])
+        self.assertTrue(self.model.SyncRemoteChanges())
+        self.Wait()
+        self.assertEqual(open(self.Path('d/b.txt')).read(), 'edited\n')
+        self.assertEqual(self.Remote('b.txt'), [('d', 'b\n'), ('d', 'edited\n')])
+
+    def testRemoteTrash(self):
+        self.drive.Trash(self.ids['a.txt'])
+        self.assertTrue(self.model.SyncRemoteChanges())
+        self.Wait()
+        self.assertFalse(os.path.exists(self.Path('a.txt')))
+
+    def testRemoteEditOverLocalEdit(self):
+        self.Edit('a.txt', 'edited\n')
+        self.drive.Replace(self.ids['a.txt'], 'remote\n')
+        self.assertTrue(self.model.SyncRemoteChanges())
+        self.Wait()
+        self.assertEqual(open(self.Path('a.txt')).read(), 'remote\n')
+        copies = [name for name in os.listdir(self.mirror) if name.startswith('a (conflicted copy')]
+        self.assertEqual(len(copies), 1)
+        self.assertEqual(open(self.Path(copies[0])).read(), 'edited\n')
+
+    def testOfflineEditsOnBothSides(self):
+        self.Edit('d/b.txt', 'local\n')
+        self.drive.Replace(self.ids['d/b.txt'], 'remote\n')
+        self.model.BuildDriveIndex()
+        self.model.ReconcileMirror()
+        self.Wait()
+        self.Wait()
+        copies = [name for name in os.listdir(self.Path('d')) if 'conflicted copy' in name]
+        self.assertEqual(len(copies), 1)
+        self.assertEqual(open(self.Path('d/b.txt')).read(), 'remote\n')
+        self.assertEqual(self.Remote(copies[0]), [('d', 'local\n')])
+        self.model.ReconcileMirror()
+        self.Wait()
+        self.assertEqual(len(self.Remote('b.txt')), 1)
+
+    def testOfflineFileAndFolderOfSameName(self):
+        folder = self.drive.AddFile(ROOT_ID, 'n', FOLDER_MIMETYPE)
+        self.drive.AddFile(folder, 'c.txt', 'text/plain', data='c\n')
+        self.Edit('n', 'local\n')
+        self.model.BuildDriveIndex()
+        self.model.ReconcileMirror()
+        self.Wait()
+        self.Wait()
+        copies = [name for name in os.listdir(self.mirror) if 'conflicted copy' in name]
+        self.assertEqual(len(copies), 1)
+        self.assertEqual(open(self.Path('n/c.txt')).read(), 'c\n')
+        self.assertEqual(self.Remote(copies[0]), [('My Drive', 'local\n')])
+
+    def testRemoteEdit(self):
+        self.drive.Replace(self.ids['d/b.txt'], 'remote\n')
+        self.assertTrue(self.model.SyncRemoteChanges())
+        self.Wait()
+        self.assertEqual(open(self.Path('d/b.txt')).read(), 'remote\n')
+
+    def testNothingToDownload(self):
+        self.drive.AddFile(ROOT_ID, 'link', 'application/vnd.google-apps.shortcut')
+        self.drive.AddFile(ROOT_ID, 'new', 'application/vnd.google-apps.unknown')
+        token = self.model.change_token
+        self.assertTrue(self.model.SyncRemoteChanges())
+        self.assertNotEqual(self.model.change_token, token)
+        self.assertFalse(os.path.exists(self.Path('link')))
+
+    def testDownloadRefused(self):
+        file_id = self.drive.AddFile(ROOT_ID, 'secret.txt', 'text/plain', data='secret\n')
+        self.drive.files[file_id]['restricted'] = True
+        self.assertTrue(self.model.SyncRemoteChanges())
+        self.assertFalse(os.path.exists(self.Path('secret.txt')))
+        self.assertEqual([title for t, title, message in self.model.recentErrors], ['Download Failed'])
+
+    def testResumeDownload(self):
+        file_id = self.drive.AddFile(ROOT_ID, 'big.txt', 'text/plain', data='0123456789' * 10)
+        part = self.Path('.big.txt.%s.gosync-part' % self.drive.files[file_id]['md5'])
+        with open(part, 'w') as f:
+            f.write('0123456789' * 4)
+        self.assertTrue(self.model.SyncRemoteChanges())
+        self.assertEqual(open(self.Path('big.txt')).read(), '0123456789' * 10)
+        self.assertFalse(os.path.exists(part))
+
+    def testResumeUpload(self):
+        # An upload interrupted after its first chunk, before a restart.
+        self.model.resumable_upload_threshold = 1
+        self.model.upload_chunk_size = 10
+        self.Edit('up.txt', 'x' * 10 + 'y' * 5)
+        uri = 'https://fake.drive/upload/S1'
+        self.drive.sessions[uri] = 'x' * 10
+        self.model.metaStore.PutUpload('up.txt', 'root', uri, os.stat(self.Path('up.txt')))
+        self.drive.ResetCalls()
+        self.model.ResumePendingUploads()
+        self.Wait()
+        self.assertEqual(self.Remote('up.txt'), [('My Drive', 'x' * 10 + 'y' * 5)])
+        self.assertEqual(self.drive.ResetCalls(), {'upload status': 1, 'files.insert (chunk)': 1})
+
+    def testStalePartialDownloads(self):
+        current = '.a.txt.%s.gosync-part' % self.drive.files[self.ids['a.txt']]['md5']
+        for name in [current, '.a.txt.0123.gosync-part', '.gone.txt.0123.gosync-part']:
+            with open(self.Path(name), 'w') as f:
+                f.write('a')
+        self.model.ReconcileMirror()
+        self.assertEqual([name for name in os.listdir(self.mirror) if name.endswith('.gosync-part')],
+                         [current])
+
+    def testLocateMissingIsNotAnError(self):
+        for path in ['missing.txt', 'd/missing.txt', 'missing/b.txt']:
+            self.assertRaises((FileNotFound, FolderNotFound), self.model.LocateFileOnDrive, path)
+        self.assertRaises(FolderNotFound, self.model.LocateFolderOnDrive, 'missing')
+        errors = [key for key in self.model.metrics.Snapshot() if key.startswith(OP_ERRORS)]
+        self.assertEqual(errors, [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, sys, json, time, socket, unittest
+import httplib2
+from apiclient.errors import HttpError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'GoSync'))
+
+import GoSyncRateLimiter
+from GoSyncRateLimiter import *
+from GoSyncMetrics import MetricsRegistry, API_REQUESTS, API_RETRIES
+
+def Error(status, reason=None):
+    content = ''
+    if reason:
+        content = json.dumps({'error': {'errors': [{'reason': reason}], 'code': status}})
+    return HttpError(httplib2.Response({'status': status}), content)
+
+class ClassifyErrorTest(unittest.TestCase):
+    def testRateLimited(self):
+        self.assertEqual(ClassifyError(Error(403, 'rateLimitExceeded')), RETRY_THROTTLED)
+        self.assertEqual(ClassifyError(Error(403, 'userRateLimitExceeded')), RETRY_THROTTLED)
+        self.assertEqual(ClassifyError(Error(429)), RETRY_THROTTLED)
+
+    def testForbidden(self):
+        self.assertEqual(ClassifyError(Error(403, 'insufficientPermissions')), None)
+        self.assertEqual(ClassifyError(Error(403)), None)
+
+    def testClientErrors(self):
+        self.assertEqual(ClassifyError(Error(400, 'badRequest')), None)
+        self.assertEqual(ClassifyError(Error(404, 'notFound')), None)
+
+    def testServerErrors(self):
+        self.assertEqual(ClassifyError(Error(500)), RETRY_TRANSIENT)
+        self.assertEqual(ClassifyError(Error(503, 'backendError')), RETRY_TRANSIENT)
+
+    def testNetworkErrors(self):
+        self.assertEqual(ClassifyError(socket.timeout()), RETRY_TRANSIENT)
+        self.assertEqual(ClassifyError(httplib2.ServerNotFoundError()), RETRY_TRANSIENT)
+        self.assertEqual(ClassifyError(ValueError()), None)
+
+    def testWrapped(self):
+        # As PyDrive raises it.
+        self.assertEqual(ClassifyError(RuntimeError(Error(403, 'rateLimitExceeded'))), RETRY_THROTTLED)
+
+# Stands in for the time module in GoSyncRateLimiter: sleeping moves
+# the clock on at once. The times used are exact in binary, so that the
+# bucket fills up exactly when a wait is over.
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1024.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+class ApiRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sleeps = self.clock.sleeps
+        GoSyncRateLimiter.time = self.clock
+        self.metrics = MetricsRegistry()
+        self.limiter = ApiRateLimiter(max_rate=8, metrics=self.metrics)
+
+    def tearDown(self):
+        GoSyncRateLimiter.time = time
+
+    def Failing(self, errors, result='done'):
+        """
+        Return a function raising the given errors in turn, then
+        returning result.
+        """
+        errors = list(errors)
+
+        def func():
+            if errors:
+                raise errors.pop(0)
+            return result
+        return func
+
+    def testRefill(self):
+        self.limiter.tokens = 0
+        self.limiter._Refill(self.clock.now + 0.25)
+        self.assertEqual(self.limiter.tokens, 2)
+        # Never more than the burst.
+        self.limiter._Refill(self.clock.now + 100)
+        self.assertEqual(self.limiter.tokens, self.limiter.burst)
+
+    def testAcquireWaitsForToken(self):
+        self.limiter.tokens = 0.5
+        self.limiter.Acquire()
+        self.assertEqual(len(self.sleeps), 1)
+        self.assertEqual(self.sleeps[0], 0.0625)
+
+    def testPace(self):
+        # The burst goes at once, then one request every 1/rate seconds.
+        for n in range(24):
+            self.limiter.Acquire()
+        self.assertEqual(self.sleeps, [0.125] * 16)
+        self.assertEqual(self.clock.now, 1026.0)
+
+    def testBurst(self):
+        for n in range(8):
+            self.limiter.Acquire()
+        self.assertEqual(self.sleeps, [])
+
+    def testMultiplicativeDecrease(self):
+        self.limiter.Throttled()
+        self.assertEqual(self.limiter.GetRate(), 4)
+        self.assertTrue(self.limiter.tokens <= 0)
+        for n in range(10):
+            self.limiter.Throttled()
+        self.assertEqual(self.limiter.GetRate(), self.limiter.min_rate)
+
+    def testAdditiveIncrease(self):
+        self.limiter.rate = 2.0
+        self.limiter.Succeeded()
+        self.assertAlmostEqual(self.limiter.GetRate(), 2.05)
+        for n in range(10000):
+            self.limiter.Succeeded()
+        self.assertEqual(self.limiter.GetRate(), 8)
+
+    def testRetryThrottled(self):
+        func = self.Failing([Error(403, 'rateLimitExceeded')])
+        self.assertEqual(self.limiter.Call(func), 'done')
+        # The backoff leaves time for the bucket to refill.
+        self.assertEqual(len(self.sleeps), 1)
+        # Halved, then raised a little by the call that went through.
+        self.assertAlmostEqual(self.limiter.GetRate(), 4.025)
+        snapshot = self.metrics.Snapshot()
+        self.assertEqual(snapshot[API_REQUESTS], 2)
+        self.assertEqual(snapshot[API_RETRIES + '{reason="throttled"}'], 1)
+
+    def testRetryTransient(self):
+        func = self.Failing([Error(500), socket.error()])
+        self.assertEqual(self.limiter.Call(func), 'done')
+        self.assertEqual(len(self.sleeps), 2)
+        # Backing off exponentially.
+        self.assertTrue(1 <= self.sleeps[0] < 2 <= self.sleeps[1] < 3)
+        self.assertEqual(self.limiter.GetRate(), 8)
+
+    def testNoRetry(self):
+        for error in [Error(404, 'notFound'), Error(400, 'badRequest'), Error(403, 'forbidden')]:
+            func = self.Failing([error])
+            self.assertRaises(HttpError, self.limiter.Call, func)
+        self.assertEqual(self.sleeps, [])
+        self.assertEqual(self.limiter.GetRate(), 8)
+
+    def testRetriesRunOut(self):
+        func = self.Failing([Error(503)] * (self.limiter.retries + 1))
+        self.assertRaises(HttpError, self.limiter.Call, func)
+        self.assertEqual(len(self.sleeps), self.limiter.retries)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, sys, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'GoSync'))
+
+from GoSyncReconciler import *
+
+def File(file_id, md5):
+    return {'id': file_id, 'mimeType': 'text/plain', 'md5Checksum': md5}
+
+def Folder(file_id):
+    return {'id': file_id, 'mimeType': FOLDER_MIME_TYPE}
+
+class ReconcilerTest(unittest.TestCase):
+    def Plan(self, local, remote, base):
+        """
+        local is {path: md5}, with None for folders.
+        """
+        hashes = dict(local)
+        return Reconciler(dict((p, md5 is None) for p, md5 in local.items()), remote, base,
+                          lambda path: hashes[path]).Plan()
+
+    def Actions(self, plan):
+        return [(action, path) for action, path, arg in plan]
+
+    def testInSync(self):
+        plan = self.Plan({'d': None, 'd/a': 'A'},
+                         {'d': Folder('D'), 'd/a': File('1', 'A')},
+                         {'d': ('D', None), 'd/a': ('1', 'A')})
+        self.assertEqual(plan, [])
+
+    def testLocalEdit(self):
+        plan = self.Plan({'a': 'B'}, {'a': File('1', 'A')}, {'a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_UPLOAD, 'a')])
+
+    def testRemoteEdit(self):
+        plan = self.Plan({'a': 'A'}, {'a': File('1', 'B')}, {'a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_DOWNLOAD, 'a')])
+
+    def testBothEdited(self):
+        plan = self.Plan({'a': 'B'}, {'a': File('1', 'C')}, {'a': ('1', 'A')})
+        self.assertEqual(plan, [(ACT_CONFLICT, 'a', File('1', 'C'))])
+
+    def testBothEditedTheSame(self):
+        plan = self.Plan({'a': 'B'}, {'a': File('1', 'B')}, {'a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_RECORD, 'a')])
+
+    def testNewOnEachSide(self):
+        plan = self.Plan({'a': 'A'}, {'b': File('2', 'B')}, {})
+        self.assertEqual(self.Actions(plan), [(ACT_DOWNLOAD, 'b'), (ACT_UPLOAD, 'a')])
+
+    def testSameNewFileOnBothSides(self):
+        plan = self.Plan({'a': 'A'}, {'a': File('1', 'A')}, {})
+        self.assertEqual(self.Actions(plan), [(ACT_RECORD, 'a')])
+
+    def testLocalDelete(self):
+        plan = self.Plan({}, {'a': File('1', 'A')}, {'a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_DELETE_REMOTE, 'a')])
+
+    def testLocalDeleteOfRemoteEdit(self):
+        plan = self.Plan({}, {'a': File('1', 'B')}, {'a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_DOWNLOAD, 'a')])
+
+    def testRemoteDelete(self):
+        plan = self.Plan({'a': 'A'}, {}, {'a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_DELETE_LOCAL, 'a')])
+
+    def testRemoteDeleteOfLocalEdit(self):
+        plan = self.Plan({'a': 'B'}, {}, {'a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_UPLOAD, 'a')])
+
+    def testDeletedOnBothSides(self):
+        plan = self.Plan({}, {}, {'a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_FORGET, 'a')])
+
+    def testRemoteMove(self):
+        plan = self.Plan({'a': 'A', 'd': None},
+                         {'d': Folder('D'), 'd/a': File('1', 'A')},
+                         {'a': ('1', 'A'), 'd': ('D', None)})
+        self.assertEqual(plan, [(ACT_MOVE_LOCAL, 'a', 'd/a')])
+
+    def testRemoteFolderMoveWithNewSubfolder(self):
+        # The local folder has to be moved before anything is created in
+        # its new place.
+        plan = self.Plan({'d': None, 'd/a': 'A'},
+                         {'e': Folder('D'), 'e/a': File('1', 'A'), 'e/f': Folder('F')},
+                         {'d': ('D', None), 'd/a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_MOVE_LOCAL, 'd'), (ACT_MKDIR_LOCAL, 'e/f')])
+
+    def testLocalMove(self):
+        plan = self.Plan({'b': 'A'}, {'a': File('1', 'A')}, {'a': ('1', 'A')})
+        self.assertEqual(plan, [(ACT_MOVE_REMOTE, 'a', 'b')])
+
+    def testLocalMoveOfRemoteEdit(self):
+        # Not a move: the drive has other content now.
+        plan = self.Plan({'b': 'A'}, {'a': File('1', 'B')}, {'a': ('1', 'A')})
+        self.assertEqual(sorted(self.Actions(plan)), [(ACT_DOWNLOAD, 'a'), (ACT_UPLOAD, 'b')])
+
+    def testLocalMoveIntoNewFolder(self):
+        # The folder must exist on the drive before the file moves in.
+        plan = self.Plan({'new': None, 'new/a': 'A'},
+                         {'a': File('1', 'A')},
+                         {'a': ('1', 'A')})
+        self.assertEqual(plan, [(ACT_MKDIR_REMOTE, 'new', None), (ACT_MOVE_REMOTE, 'a', 'new/a')])
+
+    def testNewFoldersParentsFirst(self):
+        plan = self.Plan({'d': None, 'd/e': None, 'd/e/a': 'A'}, {}, {})
+        self.assertEqual(self.Actions(plan), [(ACT_MKDIR_REMOTE, 'd'), (ACT_MKDIR_REMOTE, 'd/e'),
+                                              (ACT_UPLOAD, 'd/e/a')])
+
+    def testRemoteFolderDeleteKeepsNewLocalFile(self):
+        plan = self.Plan({'d': None, 'd/a': 'A', 'd/b': 'B'},
+                         {},
+                         {'d': ('D', None), 'd/a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_MKDIR_REMOTE, 'd'), (ACT_UPLOAD, 'd/b'),
+                                              (ACT_DELETE_LOCAL, 'd/a')])
+
+    def testRemoteFolderDelete(self):
+        plan = self.Plan({'d': None, 'd/e': None, 'd/e/a': 'A'},
+                         {},
+                         {'d': ('D', None), 'd/e': ('E', None), 'd/e/a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_DELETE_LOCAL, 'd')])
+
+    def testLocalFolderDelete(self):
+        plan = self.Plan({},
+                         {'d': Folder('D'), 'd/a': File('1', 'A')},
+                         {'d': ('D', None), 'd/a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_DELETE_REMOTE, 'd')])
+
+    def testFileReplacedByFolder(self):
+        plan = self.Plan({'a': None}, {'a': File('1', 'A')}, {'a': ('1', 'A')})
+        self.assertEqual(self.Actions(plan), [(ACT_CONFLICT, 'a')])
+
+    def testDeletionsDeepestFirst(self):
+        plan = self.Plan({'d': None, 'd/a': 'A', 'd/e': None, 'd/e/b': 'B'},
+                         {'d': Folder('D'), 'd/e': Folder('E')},
+                         {'d': ('D', None), 'd/a': ('1', 'A'), 'd/e': ('E', None), 'd/e/b': ('2', 'B')})
+        self.assertEqual(self.Actions(plan), [(ACT_DELETE_LOCAL, 'd/e/b'), (ACT_DELETE_LOCAL, 'd/a')])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# gosync is an open source Google Drive(TM) sync application for Linux
+#
+# Copyright (C) 2015 Himanshu Chauhan
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os, sys, shutil, tempfile, unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'GoSync'))
+
+from GoSyncMetadataStore import MetadataStore
+from GoSyncWorkQueue import *
+
+# The queue is never started, so the events stay pending.
+class ObserverWorkQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.store = MetadataStore(os.path.join(self.tmp, 'test.db'))
+        self.queue = ObserverWorkQueue(self.store, None, 1)
+
+    def tearDown(self):
+        self.store.Close()
+        shutil.rmtree(self.tmp)
+
+    def Pending(self):
+        """
+        Return the pending events after checking that the saved ones are
+        the same.
+        """
+        pending = [(op, path, dest) for op, path, dest, seq in self.queue.pending.values()]
+        saved = [(op, path, dest) for seq, op, path, dest in self.store.GetEvents()]
+        self.assertEqual(pending, saved)
+        return pending
+
+    def testCreateModify(self):
+        self.queue.Put(OP_CREATE, '/m/a')
+        self.queue.Put(OP_MODIFY, '/m/a')
+        self.assertEqual(self.Pending(), [(OP_CREATE, '/m/a', None)])
+
+    def testCreateDelete(self):
+        self.queue.Put(OP_CREATE, '/m/a')
+        self.queue.Put(OP_DELETE, '/m/a')
+        self.assertEqual(self.Pending(), [])
+
+    def testDeleteCreate(self):
+        self.queue.Put(OP_DELETE, '/m/a')
+        self.queue.Put(OP_CREATE, '/m/a')
+        self.assertEqual(self.Pending(), [(OP_MODIFY, '/m/a', None)])
+
+    def testCreateMove(self):
+        self.queue.Put(OP_CREATE, '/m/a')
+        self.queue.Put(OP_MOVE, '/m/a', '/m/b')
+        self.assertEqual(self.Pending(), [(OP_CREATE, '/m/b', None)])
+
+    def testModifyMove(self):
+        self.queue.Put(OP_MODIFY, '/m/a')
+        self.queue.Put(OP_MOVE, '/m/a', '/m/b')
+        self.assertEqual(self.Pending(), [(OP_MOVE, '/m/a', '/m/b'), (OP_MODIFY, '/m/b', None)])
+
+    def testSaveThroughTemporaryFile(self):
+        # How editors save: the old file goes, a new one is moved in its
+        # place.
+        self.queue.Put(OP_DELETE, '/m/b')
+        self.queue.Put(OP_CREATE, '/m/tmp')
+        self.queue.Put(OP_MOVE, '/m/tmp', '/m/b')
+        self.assertEqual(self.Pending(), [(OP_MODIFY, '/m/b', None)])
+
+    def testModifyMoveOntoPending(self):
+        self.queue.Put(OP_CREATE, '/m/b')
+        self.queue.Put(OP_MODIFY, '/m/a')
+        self.queue.Put(OP_MOVE, '/m/a', '/m/b')
+        self.assertEqual(self.Pending(), [(OP_MOVE, '/m/a', '/m/b'), (OP_CREATE, '/m/b', None)])
+
+    def testRestart(self):
+        self.queue.Put(OP_DELETE, '/m/b')
+        self.queue.Put(OP_CREATE, '/m/tmp')
+        self.queue.Put(OP_MOVE, '/m/tmp', '/m/b')
+        self.queue.Put(OP_MOVE, '/m/c', '/m/d')
+
+        queue = ObserverWorkQueue(self.store, None, 1)
+        self.assertEqual([(op, path, dest) for op, path, dest, seq in queue.pending.values()],
+                         [(OP_MODIFY, '/m/b', None), (OP_MOVE, '/m/c', '/m/d')])
+
+if __name__ == '__main__':
+    unittest.main()